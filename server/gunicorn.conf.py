@@ -0,0 +1,40 @@
+"""Gunicorn settings, read automatically when started from this directory.
+
+The app is imported once in the master and the baselines are loaded there
+before forking, so every worker starts with them already in memory and
+shares those pages with the master instead of parsing its own copy.
+"""
+import gc
+
+# Import the app before forking the workers
+preload_app = True
+
+# No collections in the master while the shared objects are built: a collection writes to every
+# object header it visits, which would make the forked workers' copies of those pages private.
+# Set here because this file is read before the preloaded app is imported.
+gc.disable()
+
+
+def when_ready(server):
+    from services import baseline, metrics
+
+    baseline.preload()
+    # The preload's own counts are reported once, from the master's snapshot
+    metrics.flush()
+    # Everything allocated so far is left out of all future collections, in the workers too
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from services import metrics
+
+    gc.enable()
+    # Start from zero, or every worker would report the master's counts again as its own
+    metrics.reset()
+
+
+def child_exit(server, worker):
+    from services import metrics
+
+    # Totals of the exited worker move into exited.json; its own snapshot would otherwise stay forever
+    metrics.fold(worker.pid)
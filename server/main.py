@@ -1,12 +1,42 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from routers.admin import router as admin_router
 from routers.assets import router as assets_router
+from routers.jobs import router as jobs_router
 from routers.share import router as share_router
-from routers.share import run_migration
+from routers.share import job_queue, maintainer, migrations, rebaser
 from routers.patch import router as patch_router
+from services import admin, baseline, metrics, profiling, validation
+
+baseline_watcher = baseline.Watcher()
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Snapshots left by processes that exited without gunicorn's child_exit (e.g. a previous uvicorn run)
+    metrics.sweep()
+    # Every worker watches the data files itself and swaps in new baselines as they change
+    baseline_watcher.start()
+    # Share migrations run in the background; one worker applies them under a file lock
+    migrations.start()
+    # Eviction and orphan sweeps, likewise run by whichever worker holds the maintenance lock
+    maintainer.start()
+    # Stale shares are rebased onto new baselines ahead of their next download
+    rebaser.start()
+    # Queued background jobs (bulk rebase, summary backfill, bundle export); each runs in exactly one worker
+    job_queue.start()
+    yield
+    job_queue.stop()
+    rebaser.stop()
+    maintainer.stop()
+    migrations.stop()
+    baseline_watcher.stop()
+    validation.shutdown()
 
-app = FastAPI(title="种呱得呱助手 API", version="0.1.0")
+
+app = FastAPI(title="种呱得呱助手 API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,17 +44,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the UI for baseline sync and rebased share downloads
+    expose_headers=["X-Baseline-Sha256", "X-Baseline-Delta", "X-Share-Rebased", "Idempotent-Replayed"],
 )
+app.add_middleware(baseline.SnapshotMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+if admin.ADMIN_TOKEN:
+    # Opt-in per request; not installed at all without an admin token
+    app.add_middleware(profiling.ProfilingMiddleware)
 
 app.include_router(assets_router)
 app.include_router(share_router)
 app.include_router(patch_router)
-
-# Migrate legacy shares to patch format on startup (best-effort)
-try:
-    run_migration()
-except Exception:
-    pass
+app.include_router(admin_router)
+app.include_router(jobs_router)
 
 
 @app.get("/api/health")
@@ -32,6 +65,16 @@ def health():
     return {"ok": True}
 
 
+@app.get("/api/migrations")
+def migration_status():
+    return migrations.status()
+
+
+@app.get("/api/metrics")
+def get_metrics() -> Response:
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":  # pragma: no cover
     import uvicorn
 
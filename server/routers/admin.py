@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import re
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+
+from services import profiling
+from services.admin import require_admin
+
+from . import share
+
+
+router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin)], route_class=profiling.Route)
+
+PROFILE_ID_RE = re.compile(r"^[0-9T]{15}-[0-9a-f]{6}$")
+
+
+@router.get("/profiles")
+def list_profiles() -> Dict[str, Any]:
+    return {"items": profiling.list_profiles()}
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = Query("json", pattern="^(json|folded)$")) -> Any:
+    if not PROFILE_ID_RE.match(profile_id):
+        raise HTTPException(status_code=400, detail="无效的 profile ID")
+    prof = profiling.load_profile(profile_id)
+    if prof is None:
+        raise HTTPException(status_code=404, detail="未找到 profile")
+    if format == "folded":
+        return Response(
+            content=profiling.folded(prof),
+            media_type="text/plain; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'},
+        )
+    return prof
+
+
+@router.get("/maintenance")
+def maintenance_status() -> Dict[str, Any]:
+    return share.maintenance_status()
+
+
+@router.post("/maintenance/run")
+def run_maintenance() -> Dict[str, Any]:
+    if not share.maintainer.run_once(blocking=False):
+        raise HTTPException(status_code=409, detail="维护任务正在其他 worker 上运行")
+    return share.maintenance_status()
+
+
+@router.get("/rebase")
+def rebase_status() -> Dict[str, Any]:
+    return share.rebase_status()
+
+
+@router.post("/rebase", status_code=202)
+def start_rebase() -> Dict[str, Any]:
+    """Rebase all stale shares now (in the background, on this worker)."""
+    share.rebaser.wake()
+    return share.rebase_status()
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+
+from services import admin, jobs, profiling
+from services.ingest import TokenBucket, client_key
+
+from . import share
+
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"], route_class=profiling.Route)
+
+JOB_ID_RE = re.compile(r"^[A-Za-z0-9\-]{16}$")
+# Public job submissions (bundle exports) per client
+SUBMIT_RATE_PER_MIN = float(os.environ.get("ZGDG_JOBS_RATE_PER_MIN") or 6)
+# Queued jobs beyond which public submissions are refused
+MAX_QUEUED = int(os.environ.get("ZGDG_JOBS_MAX_QUEUED") or 100)
+
+submit_limiter = TokenBucket(rate=SUBMIT_RATE_PER_MIN / 60.0, burst=3)
+
+
+def _view(job: Dict[str, Any]) -> Dict[str, Any]:
+    if share.job_queue.artifact(job) is not None:
+        job = dict(job, download=f"/api/jobs/{job['id']}/download")
+    return job
+
+
+def _job_or_404(job_id: str) -> Dict[str, Any]:
+    if not JOB_ID_RE.match(job_id):
+        raise HTTPException(status_code=400, detail="无效的任务ID")
+    job = share.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="未找到任务")
+    return job
+
+
+@router.post("", status_code=202)
+def submit_job(request: Request, body: Dict[str, Any] = Body(...)) -> Dict[str, Any]:
+    """Queue a job: `{"kind": "bundle-export", "params": {"ids": [...]}}`; poll `GET /api/jobs/{id}`."""
+    kind = body.get("kind")
+    job_kind = share.job_queue.kinds.get(kind) if isinstance(kind, str) else None
+    if job_kind is None:
+        raise HTTPException(status_code=400, detail=f"未知的任务类型，可选：{', '.join(sorted(share.job_queue.kinds))}")
+    params = body.get("params") or {}
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="params 必须为对象")
+    if not job_kind.public:
+        admin.require_admin(request)
+    elif not admin.is_admin_token(request.headers.get(admin.ADMIN_HEADER)):
+        submit_limiter.check(client_key(request))
+        if share.job_queue.count("queued") >= MAX_QUEUED:
+            raise HTTPException(status_code=503, detail="任务队列已满，请稍后重试", headers={"Retry-After": "30"})
+    return _view(share.job_queue.submit(kind, job_kind.parse_params(params)))
+
+
+@router.get("", dependencies=[Depends(admin.require_admin)])
+def list_jobs(
+    state: Optional[str] = Query(None, pattern=f"^({'|'.join(jobs.STATES)})$"),
+    limit: int = Query(50, ge=1, le=500),
+) -> Dict[str, Any]:
+    return {"items": [_view(j) for j in share.job_queue.recent(state, limit)]}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str) -> Dict[str, Any]:
+    """State, progress, result and error of a job; job IDs are unguessable, so they work as access tokens."""
+    return _view(_job_or_404(job_id))
+
+
+@router.post("/{job_id}/cancel")
+def cancel_job(request: Request, job_id: str) -> Dict[str, Any]:
+    job = _job_or_404(job_id)
+    kind = share.job_queue.kinds.get(job["kind"])
+    if kind is None or not kind.public:
+        admin.require_admin(request)
+    return _view(share.job_queue.cancel(job_id) or job)
+
+
+@router.get("/{job_id}/download")
+def download_job_result(job_id: str) -> FileResponse:
+    job = _job_or_404(job_id)
+    if job["state"] != "done":
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+    path = share.job_queue.artifact(job)
+    if path is None:
+        raise HTTPException(status_code=404, detail="任务没有可下载的文件，或文件已过期")
+    media_type = "application/zip" if path.suffix == ".zip" else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=f"zgdg-{job['kind']}-{job_id}{path.suffix}")
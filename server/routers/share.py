@@ -1,27 +1,82 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
-import json
+import heapq
+import os
 import secrets
 import time
 import re
+import zipfile
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-from fastapi import APIRouter, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
 
-from .assets import ValidateResult, validate_payload  # reuse existing validators
-from .patch import SUPPORTED_KINDS, diff_patch  # for patch-kind validation and migration
+from services import baseline, codec, compare, eviction, idempotency, jobs, metrics, profiling, rebase, trending, validation, wire
+from services.summary import counts_only, summarize_patch
+from services.background import PeriodicWorker
+from services.cache import LRUCache
+from services.codec import JSONBytesResponse
+from services.compression import accepts
+from services.ingest import IngestGate, TokenBucket, client_key, read_body_capped
+from services.migrations import Migration, MigrationRunner
+from services.share_store import ShareStore
 
+from .patch import SUPPORTED_KINDS, compute_diff  # for patch-kind validation and migration
 
-router = APIRouter(prefix="/api/share", tags=["share"])
+
+router = APIRouter(prefix="/api/share", tags=["share"], route_class=profiling.Route)
 
 # Repo root
 ROOT = Path(__file__).resolve().parents[2]
-STORE_DIR = ROOT / "server" / "uploads" / "share"
-INDEX_PATH = STORE_DIR / "index.json"
+STORE_DIR = Path(os.environ.get("ZGDG_SHARE_DIR") or ROOT / "server" / "uploads" / "share")
 ID_RE = re.compile(r"^[A-Za-z0-9\-]{6,24}$")
+MAX_ITEMS = int(os.environ.get("ZGDG_SHARE_MAX_ITEMS") or 1000)
+# Optional total payload size quota in bytes (0 = unlimited)
+MAX_BYTES = int(os.environ.get("ZGDG_SHARE_MAX_BYTES") or 0)
+EVICTION_POLICY = os.environ.get("ZGDG_SHARE_EVICTION") or "oldest"
+if EVICTION_POLICY not in eviction.POLICIES:
+    raise RuntimeError(f"ZGDG_SHARE_EVICTION must be one of {sorted(eviction.POLICIES)}, got {EVICTION_POLICY!r}")
+MAINTENANCE_INTERVAL = float(os.environ.get("ZGDG_SHARE_MAINTENANCE_SECONDS") or 60)
+# Unreferenced files younger than this may belong to an in-flight write
+ORPHAN_GRACE_SECONDS = 600.0
+# Background rebase of stale shares onto the current baselines
+REBASE_INTERVAL = float(os.environ.get("ZGDG_REBASE_INTERVAL_SECONDS") or 3600)
+# Listing sort orders: name -> (index entry field, descending)
+LIST_SORTS = {
+    "new": ("createdAt", True),
+    "old": ("createdAt", False),
+    "downloads": ("downloads", True),
+    # Time-decayed downloads; order comes from `trending_index`, not the index entries
+    "trending": ("trending", True),
+}
+# Cached listings are exact for creates/deletes (generation counter); download counts may lag by this many seconds
+LIST_CACHE_TTL = float(os.environ.get("ZGDG_SHARE_LIST_TTL") or 30)
+
+# Publish admission control (per worker process)
+MAX_BODY_BYTES = int(os.environ.get("ZGDG_SHARE_MAX_BODY") or 8 * 1024 * 1024)
+PUBLISH_RATE_PER_MIN = float(os.environ.get("ZGDG_SHARE_RATE_PER_MIN") or 10)
+PUBLISH_BURST = float(os.environ.get("ZGDG_SHARE_BURST") or 5)
+# Most shares one bundle-export job may pack
+BUNDLE_MAX_SHARES = int(os.environ.get("ZGDG_SHARE_BUNDLE_MAX") or 200)
+
+store = ShareStore(STORE_DIR)
+trending_index = trending.Trending(STORE_DIR / "trending.log")
+# Retried publishes -> the share their first attempt created
+idempotency_table = idempotency.IdempotencyTable(store)
+publish_limiter = TokenBucket(rate=PUBLISH_RATE_PER_MIN / 60.0, burst=PUBLISH_BURST)
+# Only 2 publishes parse/validate at once (below the storage pool size, so reads keep flowing);
+# up to 8 more may wait, each buffering at most MAX_BODY_BYTES
+publish_gate = IngestGate(
+    concurrency=int(os.environ.get("ZGDG_SHARE_INGEST_CONCURRENCY") or 2),
+    queue=int(os.environ.get("ZGDG_SHARE_INGEST_QUEUE") or 8),
+    wait_seconds=float(os.environ.get("ZGDG_SHARE_INGEST_WAIT") or 10),
+)
+# (q, limit, sort, cursor) -> (store generation, cached at, serialized response)
+_list_cache: LRUCache[Tuple[int, float, bytes]] = LRUCache(maxsize=256)
+# Fire-and-forget storage tasks (download counters); referenced so they aren't GC'd mid-flight
+_background: Set["asyncio.Future[Any]"] = set()
 
 
 def _now_iso() -> str:
@@ -30,92 +85,116 @@ def _now_iso() -> str:
 
 
 def _ensure_store():
-    STORE_DIR.mkdir(parents=True, exist_ok=True)
-    if not INDEX_PATH.exists():
-        INDEX_PATH.write_text(json.dumps({"items": []}, ensure_ascii=False, indent=2), encoding="utf-8")
+    store.ensure()
 
 
 def _load_index() -> Dict[str, Any]:
-    _ensure_store()
-    with INDEX_PATH.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return store.load_index()
 
 
 def _save_index(idx: Dict[str, Any]) -> None:
-    with INDEX_PATH.open("w", encoding="utf-8") as f:
-        json.dump(idx, f, ensure_ascii=False, indent=2)
+    store.save_index(idx)
+
+
+# ---- Migrations ----
+
+# Legacy share `data` keys and the patch kinds they migrate to
+LEGACY_DATA_KINDS = {
+    "cards": "card",
+    "pendants": "pendant",
+    "mapEvents": "mapevent",
+    "beginEffects": "begineffect",
+}
+
+def _legacy_share_ids() -> List[str]:
+    return [it["id"] for it in _load_index().get("items", []) if it.get("mode") != "patch" and it.get("id")]
+
+
+def _migrate_legacy_share(share_id: str) -> None:
+    """Migrate one legacy share file (with `data`) into patch format."""
+    obj = store.read_payload(share_id)
+    data = obj.get("data") if isinstance(obj, dict) else None
+    if not isinstance(data, dict):
+        # Nothing to migrate
+        return
+    present = [k for k in LEGACY_DATA_KINDS.keys() if k in data and data[k] is not None]
+    if not present:
+        return
+    meta = obj.get("meta") or {}
+    meta["mode"] = "patch"
+    patches: List[Dict[str, Any]] = []
+    kinds: List[str] = []
+    for data_key in present:
+        kind = LEGACY_DATA_KINDS[data_key]
+        base = baseline.get(kind)
+        patches.append(compute_diff(kind, base.data, data[data_key], base_sha=base.sha256))
+        kinds.append(kind)
+    # If只有一种，用单 patch；多种则用 patches 数组
+    if len(patches) == 1:
+        obj = {"meta": meta, "patch": patches[0]}
+    else:
+        obj = {"meta": meta, "patches": patches}
+    size = store.write_payload(share_id, obj)
+
+    def update_entry(idx: Dict[str, Any]) -> None:
+        for it in idx.get("items", []):
+            if it.get("id") == share_id:
+                it["kinds"] = sorted(set(kinds))
+                it["size"] = size
+                it["mode"] = "patch"
+                break
+
+    store.mutate_index(update_entry, bump=True)
+
+
+def _unsummarized_share_ids() -> List[str]:
+    return [it["id"] for it in _load_index().get("items", []) if "summary" not in it and it.get("id")]
+
+
+def _backfill_summary(share_id: str) -> None:
+    """Store the summary (and a missing description) of a share published before summaries existed."""
+    obj = store.read_payload(share_id)
+    if not isinstance(obj, dict):
+        return
+    summary = _summarize(obj)
+    meta = obj.get("meta") or {}
+    description = meta.get("description") or meta.get("note") or ""
+
+    def update_entry(idx: Dict[str, Any]) -> None:
+        for it in idx.get("items", []):
+            if it.get("id") == share_id:
+                it["summary"] = summary
+                if not it.get("description"):
+                    it["description"] = description
+                break
+
+    store.mutate_index(update_entry, bump=True)
+
+
+MIGRATIONS = [
+    Migration(
+        version=1,
+        name="legacy data shares to patch format",
+        keys=_legacy_share_ids,
+        step=_migrate_legacy_share,
+        # Stores migrated by the old inline startup migration
+        already_applied=lambda: (store.root / "migrated_v1.flag").exists(),
+    ),
+    Migration(
+        version=2,
+        name="backfill share summaries",
+        keys=_unsummarized_share_ids,
+        step=_backfill_summary,
+    ),
+]
+
+migrations = MigrationRunner(STORE_DIR, MIGRATIONS)
 
 
 def run_migration() -> None:
-    """Migrate legacy share files (with `data`) into patch format once.
-    Creates a flag file to avoid repeating work.
-    """
+    """Apply pending share migrations in the foreground (tools and tests)."""
     _ensure_store()
-    flag = STORE_DIR / "migrated_v1.flag"
-    if flag.exists():
-        return
-    idx = _load_index()
-    items = idx.get("items", [])
-    changed = False
-    for it in items:
-        # Skip already patch-mode entries
-        if it.get("mode") == "patch":
-            continue
-        sid = it.get("id")
-        if not sid:
-            continue
-        fpath = STORE_DIR / f"{sid}.json"
-        if not fpath.exists():
-            continue
-        try:
-            obj = json.loads(fpath.read_text(encoding="utf-8"))
-        except Exception:
-            continue
-        data = obj.get("data") if isinstance(obj, dict) else None
-        if not isinstance(data, dict):
-            # Nothing to migrate
-            continue
-        # Determine single kind present
-        mapping = {
-            "cards": "card",
-            "pendants": "pendant",
-            "mapEvents": "mapevent",
-            "beginEffects": "begineffect",
-        }
-        present = [k for k in mapping.keys() if k in data and data[k] is not None]
-        if not present:
-            continue
-        try:
-            meta = obj.get("meta") or {}
-            meta["mode"] = "patch"
-            patches: List[Dict[str, Any]] = []
-            kinds: List[str] = []
-            for data_key in present:
-                kind = mapping[data_key]
-                edited = data[data_key]
-                p = diff_patch(kind, edited)
-                patches.append(p)
-                kinds.append(kind)
-            # If只有一种，用单 patch；多种则用 patches 数组
-            if len(patches) == 1:
-                obj = {"meta": meta, "patch": patches[0]}
-                it["kinds"] = [kinds[0]]
-            else:
-                obj = {"meta": meta, "patches": patches}
-                it["kinds"] = sorted(list(set(kinds)))
-            fpath.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
-            it["mode"] = "patch"
-            it["size"] = fpath.stat().st_size
-            changed = True
-        except Exception:
-            continue
-    if changed:
-        _save_index(idx)
-    # Create flag to avoid repeated migration
-    try:
-        flag.write_text("ok", encoding="utf-8")
-    except Exception:
-        pass
+    migrations.run_locked(blocking=True)
 
 
 def _gen_id(existing: set[str]) -> str:
@@ -137,23 +216,11 @@ def _ensure_valid_id(share_id: str) -> None:
         raise HTTPException(status_code=400, detail="无效的分享ID")
 
 
-# ---- API ----
-
+# ---- Storage operations (run on the store executor) ----
 
-@router.post("")
-async def create_share(request: Request) -> Dict[str, Any]:
-    """
-    Accept JSON body with shape:
-    {
-      "meta": {"title": str, "author": str|None, "note": str|None, "baseDataVersion": str|None, "createdAt": str|None},
-      "data": { "cards"?: CardRoot, "pendants"?: PendantRoot }
-    }
-    """
-    try:
-        body = await request.json()
-    except Exception:  # noqa: PIE786
-        raise HTTPException(status_code=400, detail="请求体必须为 JSON")
 
+def _prepare_share(body: Any) -> Dict[str, Any]:
+    """Validate a publish request body and build the normalized package object."""
     if not isinstance(body, dict):
         raise HTTPException(status_code=400, detail="请求体格式错误")
 
@@ -228,38 +295,38 @@ async def create_share(request: Request) -> Dict[str, Any]:
         mode = "patch"
         data = None  # ignore data when patch is present
     else:
-        # Data mode: Validate supported kinds using existing validators
+        # Data mode: reject collections with validation errors; schema warnings are only for the validate routes
         has_any = False
         if "cards" in data and data["cards"] is not None:
             if not isinstance(data["cards"], dict):
                 raise HTTPException(status_code=400, detail="data.cards 必须为对象")
-            res: ValidateResult = validate_payload("card", data["cards"])  # type: ignore[arg-type]
-            if not res.ok:
-                raise HTTPException(status_code=400, detail={"kind": "card", "errors": res.errors})
+            errors = validation.validate("card", data["cards"])
+            if errors:
+                raise HTTPException(status_code=400, detail={"kind": "card", "errors": errors})
             has_any = True
             share_kinds.append("card")
         if "pendants" in data and data["pendants"] is not None:
             if not isinstance(data["pendants"], dict):
                 raise HTTPException(status_code=400, detail="data.pendants 必须为对象")
-            res = validate_payload("pendant", data["pendants"])  # type: ignore[arg-type]
-            if not res.ok:
-                raise HTTPException(status_code=400, detail={"kind": "pendant", "errors": res.errors})
+            errors = validation.validate("pendant", data["pendants"])
+            if errors:
+                raise HTTPException(status_code=400, detail={"kind": "pendant", "errors": errors})
             has_any = True
             share_kinds.append("pendant")
         if "mapEvents" in data and data["mapEvents"] is not None:
             if not isinstance(data["mapEvents"], list):
                 raise HTTPException(status_code=400, detail="data.mapEvents 必须为数组")
-            res = validate_payload("mapevent", data["mapEvents"])  # type: ignore[arg-type]
-            if not res.ok:
-                raise HTTPException(status_code=400, detail={"kind": "mapevent", "errors": res.errors})
+            errors = validation.validate("mapevent", data["mapEvents"])
+            if errors:
+                raise HTTPException(status_code=400, detail={"kind": "mapevent", "errors": errors})
             has_any = True
             share_kinds.append("mapevent")
         if "beginEffects" in data and data["beginEffects"] is not None:
             if not isinstance(data["beginEffects"], list):
                 raise HTTPException(status_code=400, detail="data.beginEffects 必须为数组")
-            res = validate_payload("begineffect", data["beginEffects"])  # type: ignore[arg-type]
-            if not res.ok:
-                raise HTTPException(status_code=400, detail={"kind": "begineffect", "errors": res.errors})
+            errors = validation.validate("begineffect", data["beginEffects"])
+            if errors:
+                raise HTTPException(status_code=400, detail={"kind": "begineffect", "errors": errors})
             has_any = True
             share_kinds.append("begineffect")
         if not has_any:
@@ -284,139 +351,653 @@ async def create_share(request: Request) -> Dict[str, Any]:
             pkg_obj["patch"] = patch
     else:
         pkg_obj["data"] = {k: v for k, v in data.items() if k in ("cards", "pendants", "mapEvents", "beginEffects") and v is not None}
+    return pkg_obj
 
-    # Persist
-    idx = _load_index()
-    existing_ids = {it["id"] for it in idx.get("items", [])}
-    share_id = _gen_id(existing_ids)
-    raw_text = json.dumps(pkg_obj, ensure_ascii=False, indent=2)
-    _ensure_store()
-    fpath = STORE_DIR / f"{share_id}.json"
-    fpath.write_text(raw_text, encoding="utf-8")
-    size = fpath.stat().st_size
+
+def _baseline_lookup(kind: str) -> Any:
+    try:
+        return baseline.get(kind).entities().get
+    except HTTPException:
+        return lambda _eid: None
+
+
+def _summarize(pkg_obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-kind summary of a share package (patch mode: change counts and entities; data mode: entity counts)."""
+    kinds: Dict[str, Any] = {}
+    meta = pkg_obj.get("meta") or {}
+    patches = pkg_obj.get("patches")
+    if not isinstance(patches, list):
+        patches = [pkg_obj["patch"]] if isinstance(pkg_obj.get("patch"), dict) else []
+    for p in patches:
+        if not isinstance(p, dict):
+            continue
+        kind = (p.get("meta") or {}).get("kind") if isinstance(p.get("meta"), dict) else None
+        if not isinstance(kind, str) and len(meta.get("kinds") or []) == 1:
+            kind = meta["kinds"][0]
+        if not isinstance(kind, str):
+            continue
+        kinds[kind.lower()] = summarize_patch(p, _baseline_lookup(kind.lower()))
+    data = pkg_obj.get("data")
+    if isinstance(data, dict):
+        for data_key, kind in LEGACY_DATA_KINDS.items():
+            value = data.get(data_key)
+            if value is None:
+                continue
+            list_key = baseline.LIST_KEYS[kind]
+            items = value.get(list_key) if list_key and isinstance(value, dict) else value
+            kinds[kind] = {"entityCount": len(items) if isinstance(items, list) else 0}
+    return {"kinds": kinds}
+
+
+def _replay_of(claims: List[idempotency.Claim]) -> Optional[idempotency.Replay]:
+    """The share an earlier publish with any of these fingerprints created."""
+    for claim in claims:
+        hit = idempotency_table.lookup(claim)
+        if hit is None:
+            continue
+        if hit.body_digest is not None and hit.body_digest != claim.body_digest:
+            raise HTTPException(status_code=422, detail="该 Idempotency-Key 已用于内容不同的发布")
+        metrics.inc("zgdg_share_publish_replayed_total", via=claim.via)
+        return hit
+    return None
+
+
+def _publish(pkg_obj: Dict[str, Any], claims: Optional[List[idempotency.Claim]] = None) -> Tuple[str, Optional[str], bool]:
+    """Write the payload and its index entry; returns (share_id, manage_token, replayed).
+
+    The token is None for a replay matched by content rather than by key.
+
+    A concurrent publish with the same fingerprint may have finished since the
+    caller looked: under the store lock that one's share is returned instead.
+    """
+    raw = codec.dumps(pkg_obj)
+    meta = pkg_obj["meta"]
+    summary = _summarize(pkg_obj)
 
     # Management token (hash stored in index only)
     manage_token = secrets.token_urlsafe(18)
     token_hash = _hash_token(manage_token)
 
-    entry = {
-        "id": share_id,
-        "title": pkg_obj["meta"]["title"],
-        "author": pkg_obj["meta"].get("author", ""),
-        "description": pkg_obj["meta"].get("description", ""),
-        "baseDataVersion": pkg_obj["meta"].get("baseDataVersion", ""),
-        "createdAt": created_at,
-        "size": size,
-        "downloads": 0,
-        "tokenHash": token_hash,
-        "mode": mode,
-        "kinds": share_kinds,
+    def add_entry(idx: Dict[str, Any]) -> Tuple[str, bool]:
+        items: List[Dict[str, Any]] = idx.get("items", [])
+        existing_ids = {it["id"] for it in items}
+        share_id = _gen_id(existing_ids)
+        store.write_payload_bytes(share_id, raw)
+        items.append({
+            "id": share_id,
+            "title": meta["title"],
+            "author": meta.get("author", ""),
+            "description": meta.get("description", ""),
+            "baseDataVersion": meta.get("baseDataVersion", ""),
+            "createdAt": meta["createdAt"],
+            "size": len(raw),
+            "downloads": 0,
+            "tokenHash": token_hash,
+            "mode": meta["mode"],
+            "kinds": meta["kinds"],
+            "summary": summary,
+        })
+        idx["items"] = items
+        return share_id, _over_quota(items)
+
+    with store.locked():
+        replay = _replay_of(claims or [])
+        if replay is not None:
+            return replay.share_id, replay.manage_token, True
+        share_id, over_quota = store.mutate_index(add_entry, bump=True)
+        if claims:
+            idempotency_table.remember(claims, share_id, manage_token)
+    if over_quota:
+        # Trimming happens in the maintainer, off the publish path
+        maintainer.wake()
+    return share_id, manage_token, False
+
+
+def _over_quota(items: List[Dict[str, Any]]) -> bool:
+    if len(items) > MAX_ITEMS:
+        return True
+    return MAX_BYTES > 0 and sum(int(it.get("size") or 0) for it in items) > MAX_BYTES
+
+
+# ---- Maintenance ----
+
+
+def _evict() -> List[str]:
+    """Trim the index to the configured limits; returns evicted IDs."""
+    with store.locked():
+        idx = _load_index()
+        items: List[Dict[str, Any]] = idx.get("items", [])
+        victims = eviction.select_victims(items, EVICTION_POLICY, MAX_ITEMS, MAX_BYTES)
+        if not victims:
+            return []
+        gone = {id(it) for it in victims}
+        idx["items"] = [it for it in items if id(it) not in gone]
+        _save_index(idx)
+        idempotency_table.forget({it["id"] for it in victims})
+        store.bump_generation()
+    # Files go after the index no longer points at them; a crash in between leaves orphans for the sweep
+    evicted = [it["id"] for it in victims]
+    for sid in evicted:
+        store.remove_payload(sid)
+    metrics.inc("zgdg_share_evicted_total", len(evicted), policy=EVICTION_POLICY)
+    return evicted
+
+
+def _sweep_orphans() -> int:
+    with store.locked():
+        known = {it.get("id") for it in _load_index().get("items", [])}
+        orphans = eviction.find_orphans(store.iter_payload_files(), known, ORPHAN_GRACE_SECONDS)
+        for sid in orphans:
+            store.remove_payload(sid)
+    removed = len(orphans) + store.remove_stale_temp(ORPHAN_GRACE_SECONDS)
+    if removed:
+        metrics.inc("zgdg_share_orphans_removed_total", removed)
+    return removed
+
+
+def _compact_trending() -> bool:
+    with store.locked():
+        known = {it.get("id") for it in _load_index().get("items", [])}
+        return trending_index.compact(known)
+
+
+def run_maintenance() -> Dict[str, Any]:
+    """One eviction + orphan sweep cycle; the summary is kept in maintenance.json."""
+    _ensure_store()
+    t0 = time.perf_counter()
+    evicted = _evict()
+    orphans = _sweep_orphans()
+    compacted = _compact_trending()
+    result = {
+        "finishedAt": _now_iso(),
+        "policy": EVICTION_POLICY,
+        "maxItems": MAX_ITEMS,
+        "maxBytes": MAX_BYTES,
+        "evicted": len(evicted),
+        "orphansRemoved": orphans,
+        "trendingCompacted": compacted,
+        "seconds": round(time.perf_counter() - t0, 3),
     }
+    store.write_state("maintenance.json", result)
+    return result
 
-    items: List[Dict[str, Any]] = idx.get("items", [])
-    items.append(entry)
-    # Cap total items to prevent unbounded growth
-    MAX_ITEMS = 1000
-    if len(items) > MAX_ITEMS:
-        # delete oldest files beyond cap
-        items.sort(key=lambda x: x.get("createdAt", ""))
-        to_remove = items[:-MAX_ITEMS]
-        for it in to_remove:
-            try:
-                (STORE_DIR / f"{it['id']}.json").unlink(missing_ok=True)
-            except Exception:
-                pass
-        items = items[-MAX_ITEMS:]
-    # Persist index
-    idx["items"] = items
-    _save_index(idx)
 
+def maintenance_status() -> Dict[str, Any]:
+    return {"last": store.read_state("maintenance.json"), "error": maintainer.last_error}
+
+
+# ---- Rebase ----
+
+# share ID -> {kind: baseSha256} from the index summaries, rebuilt when the store generation changes
+_base_shas: Dict[str, Any] = {"generation": None, "shas": {}}
+
+
+def _base_shas_of(entry: Dict[str, Any]) -> Optional[Dict[str, Optional[str]]]:
+    if entry.get("mode") != "patch":
+        return {}
+    kinds = (entry.get("summary") or {}).get("kinds")
+    if not isinstance(kinds, dict):
+        return None
+    return {k: v.get("baseSha256") for k, v in kinds.items() if isinstance(v, dict)}
+
+
+def _share_base_shas(share_id: str) -> Optional[Dict[str, Optional[str]]]:
+    """Base hashes of a share's patches, or None if unknown (summary not backfilled yet)."""
+    global _base_shas
+    gen = store.generation()
+    if _base_shas["generation"] != gen:
+        shas = {it["id"]: _base_shas_of(it) for it in _load_index().get("items", []) if it.get("id")}
+        _base_shas = {"generation": gen, "shas": shas}
+    return _base_shas["shas"].get(share_id)
+
+
+def _stale_share_ids() -> List[str]:
+    """Patch shares not based on the current baselines and without a cached rebase."""
+    out: List[str] = []
+    for it in _load_index().get("items", []):
+        shas = _base_shas_of(it)
+        if shas is not None and rebase.is_current(shas):
+            continue
+        sid = it.get("id")
+        if sid and (shas is None or not store.rebased_path(sid, rebase.base_key(shas)).exists()):
+            out.append(sid)
+    return out
+
+
+def run_rebase(on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Rebase all stale shares in a process pool; progress is kept in rebase.json (and passed to `on_progress`)."""
+    _ensure_store()
+    started = _now_iso()
+    ids = _stale_share_ids()
+
+    def progress(state: Dict[str, Any]) -> None:
+        store.write_state("rebase.json", {"state": "running", "startedAt": started, **state})
+        if on_progress is not None:
+            on_progress(state)
+
+    try:
+        progress({"total": len(ids), "done": 0})
+        result = rebase.run_batch(store, ids, rebase.DEFAULT_WORKERS, progress)
+    except BaseException:
+        # E.g. the job running it was cancelled; shares not reached stay stale for the next run
+        store.write_state("rebase.json", {"state": "stopped", "startedAt": started, "finishedAt": _now_iso()})
+        raise
+    store.write_state("rebase.json", {"state": "done", "startedAt": started, "finishedAt": _now_iso(), **result})
+    return result
+
+
+def rebase_status() -> Dict[str, Any]:
+    return {"last": store.read_state("rebase.json"), "error": rebaser.last_error}
+
+
+def _download(share_id: str, want_rebase: bool) -> Optional[Tuple[bytes, Any, Dict[str, str]]]:
+    """Stored bytes to send for a share: the rebased copy when its baselines moved on, else the original."""
+    if want_rebase:
+        shas = _share_base_shas(share_id)
+        if shas is None or not rebase.is_current(shas):
+            res = rebase.rebase_share(store, share_id)
+            if res is not None:
+                return res[0], res[1], {"X-Share-Rebased": "1"}
+    found = store.read_payload_raw(share_id)
+    return None if found is None else (found[0], found[1], {})
+
+
+# ---- Compare ----
+
+# A baseline version as a comparison side: "<kind>@<baseSha256>"
+BASELINE_REF_RE = re.compile(r"^([a-z]+)@([0-9a-f]{64})$")
+
+# Footprints only depend on the (immutable) payload and the baselines, keyed by (ref, baselines)
+_footprints: LRUCache[compare.Footprint] = LRUCache(maxsize=128)
+# (a, b, store generation, baselines) -> serialized comparison
+_comparisons: LRUCache[bytes] = LRUCache(maxsize=256)
+
+
+def _known_share(share_id: str) -> bool:
+    _share_base_shas(share_id)  # refreshes the generation-keyed map
+    return share_id in _base_shas["shas"]
+
+
+def _footprint(ref: str, bkey: str) -> compare.Footprint:
+    m = BASELINE_REF_RE.match(ref)
+    if m is None:
+        _ensure_valid_id(ref)
+        if not _known_share(ref):
+            raise HTTPException(status_code=404, detail=f"未找到分享: {ref}")
+    fp = _footprints.get((ref, bkey))
+    if fp is not None:
+        return fp
+    if m is not None:
+        kind = m.group(1)
+        if kind not in baseline.BASELINE_FILES:
+            raise HTTPException(status_code=400, detail=f"不支持的种类: {kind}")
+        fp = compare.baseline_footprint(kind, m.group(2))
+        if fp is None:
+            raise HTTPException(status_code=404, detail=f"未找到基线版本: {ref}")
+    else:
+        pkg = store.read_payload(ref)
+        if not isinstance(pkg, dict):
+            raise HTTPException(status_code=404, detail=f"未找到分享: {ref}")
+        fp = compare.share_footprint({"id": ref, "title": (pkg.get("meta") or {}).get("title")}, rebase.patches_of(pkg))
+    _footprints.put((ref, bkey), fp)
+    return fp
+
+
+def _compare_bytes(a: str, b: str) -> bytes:
+    bkey = rebase.base_key(baseline.BASELINE_FILES)
+    key = (a, b, store.generation(), bkey)
+    hit = _comparisons.get(key)
+    if hit is not None:
+        metrics.inc("zgdg_share_compare_cache_total", result="hit")
+        return hit
+    metrics.inc("zgdg_share_compare_cache_total", result="miss")
+    body = codec.dumps(compare.compare(_footprint(a, bkey), _footprint(b, bkey)))
+    _comparisons.put(key, body)
+    return body
+
+
+maintainer = PeriodicWorker("zgdg-share-maintenance", MAINTENANCE_INTERVAL, run_maintenance, lock_path=STORE_DIR / "maintenance.lock")
+rebaser = PeriodicWorker("zgdg-share-rebase", REBASE_INTERVAL, run_rebase, lock_path=STORE_DIR / "rebase.lock")
+# A hot-reloaded baseline makes shares stale right away; don't wait for the next interval
+baseline.on_swap.append(lambda kinds: rebaser.wake())
+
+
+# ---- Background jobs ----
+
+
+def _rebase_job(job: jobs.JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebase every stale share now; waits for a periodic run holding the rebase lock to finish first."""
+    out: Dict[str, Any] = {}
+    rebaser.run_once(blocking=True, fn=lambda: out.update(run_rebase(job.progress)))
+    return out
+
+
+def _summary_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {"all": bool(params.get("all"))}
+
+
+def _summary_job(job: jobs.JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute index summaries of shares lacking one, or of every share with `all`."""
+    if params.get("all"):
+        ids = [it["id"] for it in _load_index().get("items", []) if it.get("id")]
+    else:
+        ids = _unsummarized_share_ids()
+    for i, sid in enumerate(ids):
+        job.progress({"total": len(ids), "done": i})
+        _backfill_summary(sid)
+    job.progress({"total": len(ids), "done": len(ids)}, force=True)
+    return {"total": len(ids)}
+
+
+def _bundle_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    ids = params.get("ids")
+    if not isinstance(ids, list) or not ids or len(ids) > BUNDLE_MAX_SHARES:
+        raise HTTPException(status_code=400, detail=f"ids 必须为 1-{BUNDLE_MAX_SHARES} 个分享ID")
+    for sid in ids:
+        _ensure_valid_id(sid)
+    return {"ids": list(dict.fromkeys(ids))}
+
+
+def _bundle_job(job: jobs.JobContext, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Zip the payloads of `ids` plus their index entries (`index.json`), for download from the job."""
+    ids: List[str] = params["ids"]
+    wanted = set(ids)
+    entries = {it["id"]: it for it in _load_index().get("items", []) if it.get("id") in wanted}
+    path = job.artifact_path(".zip")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    packed: List[str] = []
+    try:
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for i, sid in enumerate(ids):
+                job.progress({"total": len(ids), "done": i})
+                raw = store.read_payload_bytes(sid) if sid in entries else None
+                if raw is None:
+                    continue
+                zf.writestr(f"shares/{sid}.json", raw)
+                packed.append(sid)
+            zf.writestr("index.json", codec.dumps({"items": [_public_entry(entries[sid]) for sid in packed]}))
+        job.progress({"total": len(ids), "done": len(ids)}, force=True)
+        if not packed:
+            raise jobs.JobError("没有可导出的分享")
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    done = set(packed)
     return {
-        "id": share_id,
-        "url": f"/api/share/{share_id}",
-        "manageToken": manage_token,
+        "artifact": path.name,
+        "count": len(packed),
+        "missing": [sid for sid in ids if sid not in done],
+        "size": path.stat().st_size,
     }
 
 
-@router.get("")
-def list_shares(q: Optional[str] = Query(None), limit: int = Query(30, ge=1, le=200)) -> Dict[str, Any]:
+job_queue = jobs.JobQueue()
+job_queue.register("rebase", _rebase_job, max_attempts=2)
+job_queue.register("summary-backfill", _summary_job, parse_params=_summary_params)
+job_queue.register("bundle-export", _bundle_job, public=True, parse_params=_bundle_params)
+
+
+def _parse_cursor(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        offset = int(cursor)
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="cursor 无效")
+    return offset
+
+
+def _list(q: Optional[str], limit: int, sort: str = "new", cursor: Optional[str] = None) -> Dict[str, Any]:
+    offset = _parse_cursor(cursor)
     idx = _load_index()
     items: List[Dict[str, Any]] = idx.get("items", [])
-    # filter and sort by createdAt desc
+    # filter and sort (newest first by default); createdAt breaks ties so pages are stable
     if q:
         qs = q.lower()
         items = [it for it in items if qs in str(it.get("title", "")).lower()]
-    items.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
-    # enrich description from file if not present, and strip tokenHash
+    field, desc = LIST_SORTS[sort]
+    if field == "trending":
+        items = _trending_order(items, offset + limit)
+    elif field == "createdAt":
+        items.sort(key=lambda x: x.get("createdAt", ""), reverse=desc)
+    else:
+        items.sort(key=lambda x: (int(x.get(field) or 0), x.get("createdAt", "")), reverse=desc)
+    # strip tokenHash; listings carry only the counts of the stored summary (the preview has the rest)
     out: List[Dict[str, Any]] = []
-    for it in items[:limit]:
-        safe = {k: v for k, v in it.items() if k != "tokenHash"}
-        desc = safe.get("description")
-        if not desc:
-            try:
-                with (STORE_DIR / f"{it['id']}.json").open("r", encoding="utf-8") as f:
-                    obj = json.load(f)
-                    meta = obj.get("meta") or {}
-                    desc = meta.get("description") or meta.get("note") or ""
-            except Exception:
-                desc = ""
-            safe["description"] = desc
+    now = time.time()
+    for it in items[offset:offset + limit]:
+        safe = _public_entry(it)
+        safe["description"] = safe.get("description") or ""
+        safe["summary"] = counts_only(it.get("summary"))
+        if field == "trending":
+            safe["trendingScore"] = round(trending_index.score(str(it.get("id")), now), 3)
         out.append(safe)
-    return {"items": out}
+    page: Dict[str, Any] = {"items": out}
+    if offset + limit < len(items):
+        page["nextCursor"] = str(offset + limit)
+    return page
 
 
-@router.get("/{share_id}")
-def get_share(share_id: str) -> JSONResponse:
-    _ensure_valid_id(share_id)
-    fpath = STORE_DIR / f"{share_id}.json"
-    if not fpath.exists():
-        raise HTTPException(status_code=404, detail="未找到分享")
+def _trending_order(items: List[Dict[str, Any]], needed: int) -> List[Dict[str, Any]]:
+    """Entries in trending order: the maintained ranking first, then never-downloaded shares newest first.
 
-    # read content
-    with fpath.open("r", encoding="utf-8") as f:
-        obj = json.load(f)
+    Only the first `needed` entries are guaranteed to be in order; the rest are just counted.
+    """
+    by_id = {it.get("id"): it for it in items}
+    ranked = [by_id.pop(sid) for sid in trending_index.ranked() if sid in by_id]
+    rest = list(by_id.values())
+    if len(ranked) < needed:
+        head = heapq.nlargest(needed - len(ranked), rest, key=lambda x: x.get("createdAt", ""))
+        picked = {id(it) for it in head}
+        rest = head + [it for it in rest if id(it) not in picked]
+    return ranked + rest
 
-    # bump downloads (best-effort)
-    try:
-        idx = _load_index()
-        changed = False
+
+def _public_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in entry.items() if k != "tokenHash"}
+
+
+def _preview(share_id: str) -> Optional[Dict[str, Any]]:
+    entry = next((it for it in _load_index().get("items", []) if it.get("id") == share_id), None)
+    if entry is None:
+        return None
+    out = _public_entry(entry)
+    if "summary" not in out:
+        # Not backfilled yet; compute without persisting (the v2 migration will)
+        obj = store.read_payload(share_id)
+        out["summary"] = _summarize(obj) if isinstance(obj, dict) else None
+    return out
+
+
+def _list_bytes(q: Optional[str], limit: int, sort: str, cursor: Optional[str]) -> bytes:
+    return codec.dumps(_list(q, limit, sort, cursor))
+
+
+def _transcode(raw: bytes, comp: Any, fmt: wire.WireFormat) -> bytes:
+    return fmt.dumps(codec.loads(comp.decompress(raw)))
+
+
+def _bump_downloads(share_id: str) -> None:
+    trending_index.record(share_id)
+
+    def bump(idx: Dict[str, Any]) -> None:
         for it in idx.get("items", []):
             if it.get("id") == share_id:
                 it["downloads"] = int(it.get("downloads", 0)) + 1
-                changed = True
                 break
-        if changed:
-            _save_index(idx)
-    except Exception:
-        pass
 
-    return JSONResponse(content=obj)
+    store.mutate_index(bump)
+
+
+def _delete(share_id: str, token: str) -> None:
+    def remove(idx: Dict[str, Any]) -> None:
+        items: List[Dict[str, Any]] = idx.get("items", [])
+        pos = None
+        for i, it in enumerate(items):
+            if it.get("id") == share_id:
+                pos = i
+                if it.get("tokenHash") != _hash_token(token):
+                    raise HTTPException(status_code=403, detail="无权限删除该分享")
+                break
+        if pos is None:
+            raise HTTPException(status_code=404, detail="未找到分享")
+        # remove file and index entry
+        store.remove_payload(share_id)
+        del items[pos]
+        idx["items"] = items
+        idempotency_table.forget({share_id})
+
+    store.mutate_index(remove, bump=True)
+
+
+def _spawn(coro: Any) -> None:
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+# ---- API ----
+
+
+@router.post("")
+async def create_share(request: Request) -> Response:
+    """
+    Accept JSON body with shape:
+    {
+      "meta": {"title": str, "author": str|None, "note": str|None, "baseDataVersion": str|None, "createdAt": str|None},
+      "data": { "cards"?: CardRoot, "pendants"?: PendantRoot }
+    }
+    """
+    client = client_key(request)
+    key = request.headers.get("idempotency-key")
+    if key is not None:
+        key = key.strip()
+        if not key or len(key) > idempotency.MAX_KEY_CHARS:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key 长度应为 1-{idempotency.MAX_KEY_CHARS} 个字符")
+    # A retry under a key already seen doesn't spend a rate-limit token
+    known_key = key is not None and await store.run(idempotency_table.lookup, idempotency.key_claim(key, b"")) is not None
+    if not known_key:
+        publish_limiter.check(client)
+    fmt = wire.request_format(request.headers.get("content-type"))
+    async with publish_gate.admit():
+        raw = await read_body_capped(request, MAX_BODY_BYTES)
+        claims = [idempotency.key_claim(key, raw)] if key is not None else []
+        # Same key and body: answered without parsing, validating or writing anything
+        replay = await store.run(_replay_of, claims) if known_key else None
+        if replay is None:
+            async with publish_gate.work():
+                try:
+                    body = await store.run(fmt.loads, raw)
+                except Exception:  # noqa: PIE786
+                    raise HTTPException(status_code=400, detail=f"请求体必须为 {fmt.name}")
+                del raw
+
+                claims.append(await store.run(idempotency.payload_claim, body))
+                replay = await store.run(_replay_of, claims[-1:])
+                if replay is None:
+                    pkg_obj = await store.run(_prepare_share, body)
+                    share_id, manage_token, replayed = await store.run(_publish, pkg_obj, claims)
+        if replay is not None:
+            share_id, manage_token, replayed = replay.share_id, replay.manage_token, True
+
+    out = {
+        "id": share_id,
+        "url": f"/api/share/{share_id}",
+    }
+    # A share matched by content alone may be someone else's: its token only goes to a repeated key
+    if manage_token is not None:
+        out["manageToken"] = manage_token
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return wire.WireResponse(content=out, fmt=wire.response_format(request.headers.get("accept")), headers=headers)
+
+
+@router.get("")
+async def list_shares(
+    q: Optional[str] = Query(None),
+    limit: int = Query(30, ge=1, le=200),
+    sort: str = Query("new", pattern="^(new|old|downloads|trending)$"),
+    cursor: Optional[str] = Query(None),
+) -> Response:
+    key = ((q or "").lower(), limit, sort, cursor or "")
+    # Read the generation before the index so a concurrent publish can't be cached under the new generation
+    gen = store.generation()
+    now = time.monotonic()
+    hit = _list_cache.get(key)
+    if hit is not None and hit[0] == gen and now - hit[1] < LIST_CACHE_TTL:
+        metrics.inc("zgdg_share_list_cache_total", result="hit")
+        return JSONBytesResponse(content=hit[2])
+    metrics.inc("zgdg_share_list_cache_total", result="miss")
+    body = await store.run(_list_bytes, q, limit, sort, cursor)
+    _list_cache.put(key, (gen, now, body))
+    return JSONBytesResponse(content=body)
+
+
+@router.get("/{share_id}/preview")
+async def preview_share(share_id: str) -> Response:
+    """Index entry with the full summary (affected entities, touched fields), without the payload."""
+    _ensure_valid_id(share_id)
+    entry = await store.run(_preview, share_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="未找到分享")
+    return JSONBytesResponse(content=entry)
+
+
+@router.get("/{share_id}/compare")
+async def compare_share(
+    share_id: str,
+    other: str = Query(..., description="another share ID, or <kind>@<baseSha256> for a baseline version"),
+) -> Response:
+    """How two shares (or a share and a baseline version) differ, at the entity and field level."""
+    _ensure_valid_id(share_id)
+    body = await store.run(_compare_bytes, share_id, other)
+    return JSONBytesResponse(content=body)
+
+
+@router.get("/{share_id}")
+async def get_share(
+    share_id: str,
+    accept_encoding: Optional[str] = Header(None),
+    want_rebase: bool = Query(True, alias="rebase", description="rebase the patch onto the current baselines when they changed"),
+    accept: Optional[str] = Header(None),
+) -> Response:
+    _ensure_valid_id(share_id)
+    async with store.share_lock(share_id):
+        found = await store.run(_download, share_id, want_rebase)
+    if found is None:
+        raise HTTPException(status_code=404, detail="未找到分享")
+
+    # bump downloads (best-effort, off the response path)
+    _spawn(store.run(_bump_downloads, share_id))
+
+    raw, comp, extra = found
+    headers = {"Vary": "Accept, Accept-Encoding", **extra}
+    fmt = wire.response_format(accept)
+    if fmt is not wire.JSON:
+        # Payloads are stored as JSON; other formats are transcoded per request
+        raw = await store.run(_transcode, raw, comp, fmt)
+        return Response(content=raw, media_type=fmt.media_type, headers=headers)
+    if comp.content_encoding and accepts(accept_encoding, comp.content_encoding):
+        # Stored compressed bytes go out as-is
+        headers["Content-Encoding"] = comp.content_encoding
+    elif comp.content_encoding:
+        raw = await store.run(comp.decompress, raw)
+    return Response(content=raw, media_type="application/json", headers=headers)
 
 
 @router.delete("/{share_id}")
-def delete_share(share_id: str, manageToken: Optional[str] = Query(None)) -> Dict[str, Any]:
+async def delete_share(share_id: str, manageToken: Optional[str] = Query(None)) -> Dict[str, Any]:
     _ensure_valid_id(share_id)
     token = manageToken
     if not token:
         raise HTTPException(status_code=400, detail="缺少 manageToken")
-    idx = _load_index()
-    items: List[Dict[str, Any]] = idx.get("items", [])
-    pos = None
-    for i, it in enumerate(items):
-        if it.get("id") == share_id:
-            pos = i
-            if it.get("tokenHash") != _hash_token(token):
-                raise HTTPException(status_code=403, detail="无权限删除该分享")
-            break
-    if pos is None:
-        raise HTTPException(status_code=404, detail="未找到分享")
-
-    # remove file and index entry
-    try:
-        (STORE_DIR / f"{share_id}.json").unlink(missing_ok=True)
-    except Exception:
-        pass
-    del items[pos]
-    idx["items"] = items
-    _save_index(idx)
+    async with store.share_lock(share_id):
+        await store.run(_delete, share_id, token)
     return {"ok": True}
+
+
+metrics.describe("zgdg_share_publish_replayed_total", "counter", "Share publishes answered with an earlier share, by fingerprint (key/payload)")
+metrics.describe("zgdg_share_list_cache_total", "counter", "Share listing cache lookups by result (hit/miss)")
+metrics.describe("zgdg_share_compare_cache_total", "counter", "Share comparison cache lookups by result (hit/miss)")
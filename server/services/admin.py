@@ -0,0 +1,26 @@
+"""Admin token handling for operator-only endpoints and request hooks."""
+from __future__ import annotations
+
+import hmac
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+# Admin features (profiling, admin endpoints) stay disabled unless a token is configured
+ADMIN_TOKEN: Optional[str] = os.environ.get("ZGDG_ADMIN_TOKEN") or None
+ADMIN_HEADER = "x-admin-token"
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+
+def require_admin(request: Request) -> None:
+    """FastAPI dependency guarding admin endpoints."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="管理接口未启用")
+    if not is_admin_token(request.headers.get(ADMIN_HEADER)):
+        raise HTTPException(status_code=403, detail="管理令牌无效")
@@ -0,0 +1,141 @@
+"""Read-only, memory-mapped files of pre-serialized bytes.
+
+An arena holds named byte sections (e.g. a baseline's JSON body and its
+MessagePack encoding) plus an indexed run of lines (one per entity). Every
+process that opens the same arena maps the same file, so the bytes live once
+in the page cache, and gunicorn workers share them instead of each keeping
+a private copy. Sections and lines are handed out as zero-copy `memoryview`s.
+
+Layout: magic, u64 header length, JSON header (section offsets, line count),
+then the sections; line `i` spans `lines[offsets[i]:offsets[i + 1]]`, with
+the offsets stored as a u64 section. Arenas are written once to a temporary
+file and renamed into place, and never modified afterwards.
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from . import codec
+
+MAGIC = b"ZGDGARN1"
+_U64 = struct.Struct("<Q")
+_ALIGN = 8
+
+
+class Arena:
+    __slots__ = ("path", "header", "_mm", "_view", "_sections", "_offsets", "_lines")
+
+    def __init__(self, path: Path, mm: mmap.mmap, header: Dict[str, Any]):
+        self.path = path
+        self.header = header
+        self._mm = mm
+        self._view = memoryview(mm)
+        self._sections: Dict[str, memoryview] = {
+            name: self._view[off : off + length] for name, (off, length) in header["sections"].items()
+        }
+        offsets = self._sections.get("lineOffsets")
+        self._offsets = offsets.cast("Q") if offsets is not None and sys.byteorder == "little" else None
+        self._lines = self._sections.get("lines")
+
+    def section(self, name: str) -> Optional[memoryview]:
+        return self._sections.get(name)
+
+    @property
+    def has_lines(self) -> bool:
+        return self._offsets is not None and self._lines is not None
+
+    @property
+    def line_count(self) -> int:
+        return int(self.header.get("lines") or 0) if self.has_lines else 0
+
+    def line(self, i: int) -> memoryview:
+        if not self.has_lines:
+            raise IndexError(i)
+        return self._lines[self._offsets[i] : self._offsets[i + 1]]
+
+
+def write(path: Path, header: Dict[str, Any], sections: Dict[str, Any], lines: Sequence[Any] = ()) -> None:
+    """Write an arena atomically; `sections` and `lines` are bytes-like."""
+    parts: Dict[str, Any] = dict(sections)
+    if lines:
+        offsets = array("Q", [0])
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+        if sys.byteorder != "little":
+            offsets.byteswap()
+        parts["lineOffsets"] = offsets.tobytes()
+        parts["lines"] = b"".join(lines)
+    # Section offsets are relative to the (aligned) end of the header
+    table: Dict[str, List[int]] = {}
+    pos = 0
+    for name, data in parts.items():
+        table[name] = [pos, len(data)]
+        pos = _pad(pos + len(data))
+    hbytes = codec.dumps(dict(header, sections=table, lines=len(lines)))
+    base = _pad(len(MAGIC) + _U64.size + len(hbytes))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with tmp.open("wb") as fh:
+            fh.write(MAGIC + _U64.pack(len(hbytes)) + hbytes)
+            for name, data in parts.items():
+                fh.seek(base + table[name][0])
+                fh.write(data)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _pad(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def open_arena(path: Path) -> Optional[Arena]:
+    """Map an arena read-only; None when missing or not a complete arena."""
+    try:
+        with path.open("rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < len(MAGIC) + _U64.size:
+                return None
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        if mm[: len(MAGIC)] != MAGIC:
+            raise ValueError("bad magic")
+        (hlen,) = _U64.unpack_from(mm, len(MAGIC))
+        start = len(MAGIC) + _U64.size
+        header = codec.loads(mm[start : start + hlen])
+        base = _pad(start + hlen)
+        for sec in header["sections"].values():
+            sec[0] += base
+            if sec[0] + sec[1] > size:
+                raise ValueError("truncated")
+        return Arena(path, mm, header)
+    except (ValueError, KeyError, TypeError, struct.error):
+        mm.close()
+        return None
+
+
+def prune(directory: Path, prefix: str, keep: int, protect: List[Path]) -> None:
+    """Delete all but the `keep` newest `prefix*` arenas; mappings other processes hold stay valid."""
+    try:
+        found = sorted(
+            (p for p in directory.glob(f"{prefix}*.arena") if p not in protect),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True,
+        )
+    except OSError:
+        return
+    for p in found[max(0, keep - len(protect)) :]:
+        try:
+            p.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,77 @@
+"""Periodic maintenance threads shared by all gunicorn workers.
+
+Every worker starts the thread, but when a lock file is given only the
+worker holding its `flock` runs a cycle; the others skip it until the next
+tick. `wake()` runs a cycle early (e.g. right after a publish pushes the
+store over its limit).
+"""
+from __future__ import annotations
+
+import threading
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX dev machines
+    fcntl = None  # type: ignore[assignment]
+
+
+class PeriodicWorker:
+    def __init__(self, name: str, interval: float, fn: Callable[[], Any], lock_path: Optional[Path] = None):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.lock_path = Path(lock_path) if lock_path is not None else None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self, blocking: bool = False, fn: Optional[Callable[[], Any]] = None) -> bool:
+        """Run one cycle (or `fn` instead) under the lock; False if another process holds it."""
+        fn = fn or self.fn
+        if self.lock_path is None or fcntl is None:
+            fn()
+            return True
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock_path.open("a+b") as fh:
+            flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(fh.fileno(), flags)
+            except BlockingIOError:
+                return False
+            try:
+                fn()
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception:
+                self.last_error = traceback.format_exc(limit=3)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
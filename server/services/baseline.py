@@ -0,0 +1,461 @@
+"""Parsed official baseline data, cached per file version.
+
+Each kind is parsed once and kept together with its compact JSON encoding and
+canonical sha256 until the file's mtime or size changes. Cached data is shared
+between requests: callers must treat `Baseline.data` as read-only and
+deepcopy before mutating.
+
+The serialized forms of a version (JSON body, binary encodings, per-entity
+lines) are written once to a memory-mapped arena (see `services/arena.py`)
+keyed by the file's content, so every worker serves the same page-cache
+copy. A worker that finds the arena already built doesn't parse the file at
+all until something needs `data`; parsed trees intern their keys and short
+strings. `preload()` plus `gc.freeze()` before forking (see
+`gunicorn.conf.py`) lets workers share the parsed trees as well.
+
+The loaded baselines form one immutable `Snapshot`. In the server a
+`Watcher` thread re-parses changed files off the request path and swaps the
+snapshot reference in a single assignment; `SnapshotMiddleware` pins the
+snapshot current when a request starts, so in-flight requests finish
+against the version they began with. Without a watcher (tools, benchmarks)
+`get()` checks the file on every call and reloads inline.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from contextvars import ContextVar
+from pathlib import Path
+from sys import intern as _intern
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from . import arena, codec, metrics, wire
+from .arena import Arena
+from .cache import LRUCache
+from .compression import DEFAULT as ARCHIVE_COMPRESSION
+from .compression import by_suffix
+
+try:
+    import watchfiles
+except ImportError:  # pragma: no cover - optional dependency (ships with uvicorn[standard])
+    watchfiles = None  # type: ignore[assignment]
+
+ROOT = Path(__file__).resolve().parents[2]
+# ZGDG_DATA_DIR points the server at another data directory (e.g. synthetic load-test data)
+DATA_DIR = Path(os.environ.get("ZGDG_DATA_DIR") or ROOT / "Data")
+# Every baseline version seen is kept here by sha256 so patches made against it can be rebased later
+ARCHIVE_DIR = Path(os.environ.get("ZGDG_BASELINE_ARCHIVE") or ROOT / "server" / "uploads" / "baselines")
+# Pre-serialized bytes of each loaded version, memory-mapped by every worker; unset or unwritable = private copies
+ARENA_DIR = Path(os.environ.get("ZGDG_BASELINE_ARENA") or ROOT / "server" / "uploads" / "arena")
+# Arenas kept per kind (older ones are deleted; processes still mapping them are unaffected)
+ARENA_KEEP = 4
+# String values up to this length are interned when a file is parsed
+INTERN_MAX_CHARS = 64
+# Poll interval when `watchfiles` is unavailable; also the watch timeout used as a safety net
+POLL_SECONDS = float(os.environ.get("ZGDG_BASELINE_POLL_SECONDS") or 2)
+
+BASELINE_FILES = {
+    "card": "Card.json",
+    "pendant": "Pendant.json",
+    "mapevent": "MapEvent.json",
+    "begineffect": "BeginEffect.json",
+    "disaster": "Disaster.json",
+}
+
+# Key of the entity list inside each file; None for files whose root is the list
+LIST_KEYS: Dict[str, Optional[str]] = {
+    "card": "Cards",
+    "pendant": "Pendant",
+    "mapevent": None,
+    "begineffect": None,
+    "disaster": "Pendant",
+}
+
+
+class Baseline:
+    __slots__ = (
+        "kind", "path", "version", "sha256", "_data", "_body", "_arena",
+        "_entities", "_digests", "_encoded", "_records", "_lines",
+    )
+
+    def __init__(
+        self,
+        kind: str,
+        path: Path,
+        version: Tuple[int, int],
+        sha256: str,
+        data: Any = None,
+        body: Optional[bytes] = None,
+        arena: Optional[Arena] = None,
+    ):
+        self.kind = kind
+        self.path = path
+        self.version = version
+        self.sha256 = sha256
+        self._data = data
+        self._body = body
+        # Shared, memory-mapped bytes (body, encodings, entity lines) when available
+        self._arena = arena
+        self._entities: Optional[Dict[str, Dict[str, Any]]] = None
+        self._digests: Optional[Dict[str, str]] = None
+        self._encoded: Dict[str, bytes] = {}
+        self._records: Optional[List[Dict[str, Any]]] = None
+        self._lines: Optional[List[bytes]] = None
+
+    @property
+    def body(self) -> Union[bytes, memoryview]:
+        """Compact JSON of the whole file."""
+        if self._body is None and self._arena is not None:
+            return self._arena.section("json")  # type: ignore[return-value]
+        return self._body  # type: ignore[return-value]
+
+    @property
+    def data(self) -> Any:
+        """Parsed file with interned strings, built on first use."""
+        if self._data is None:
+            self._data = _compact(codec.loads(self.body))
+        return self._data
+
+    def entities(self) -> Dict[str, Dict[str, Any]]:
+        """Entities keyed by ID, built on first use."""
+        if self._entities is None:
+            out: Dict[str, Dict[str, Any]] = {}
+            for it in self.items():
+                if isinstance(it, dict) and isinstance(it.get("ID"), str) and it["ID"]:
+                    out[it["ID"]] = it
+            self._entities = out
+        return self._entities
+
+    def digests(self) -> Dict[str, str]:
+        """Canonical digest of every entity keyed by ID, built on first use."""
+        if self._digests is None:
+            self._digests = {eid: entity_digest(ent) for eid, ent in self.entities().items()}
+        return self._digests
+
+    def items(self) -> List[Any]:
+        """The kind's entity list, as parsed."""
+        key = LIST_KEYS.get(self.kind)
+        items = self.data.get(key) if key and isinstance(self.data, dict) else self.data
+        return items if isinstance(items, list) else []
+
+    def root(self) -> Optional[Dict[str, Any]]:
+        """The root object without its entity list; None for kinds without one."""
+        if self._data is None and self._arena is not None and "root" in self._arena.header:
+            return self._arena.header["root"]
+        key = LIST_KEYS.get(self.kind)
+        if not key or not isinstance(self.data, dict):
+            return None
+        return {k: v for k, v in self.data.items() if k != key}
+
+    def records(self) -> List[Dict[str, Any]]:
+        """The object entries of `items()`; `line(i)` is the JSON of `records()[i]`."""
+        if self._records is None:
+            self._records = [it for it in self.items() if isinstance(it, dict)]
+        return self._records
+
+    def line_count(self) -> int:
+        if self._arena is not None and self._arena.has_lines:
+            return self._arena.line_count
+        return len(self._line_list())
+
+    def line(self, i: int) -> Union[bytes, memoryview]:
+        """Compact JSON of one entity plus a newline, serialized once per version."""
+        if self._arena is not None and self._arena.has_lines:
+            return self._arena.line(i)
+        return self._line_list()[i]
+
+    def _line_list(self) -> List[bytes]:
+        if self._lines is None:
+            self._lines = [codec.dumps(it) + b"\n" for it in self.records()]
+        return self._lines
+
+    def encoded(self, fmt: wire.WireFormat) -> Union[bytes, memoryview]:
+        """Body in a wire format (JSON is `body`); encoded once per version."""
+        if fmt is wire.JSON:
+            return self.body
+        if self._arena is not None:
+            shared = self._arena.section(fmt.name)
+            if shared is not None:
+                return shared
+        out = self._encoded.get(fmt.name)
+        if out is None:
+            out = self._encoded[fmt.name] = fmt.dumps(self.data)
+        return out
+
+    def attach(self, arena: Arena) -> None:
+        """Serve bytes from `arena` from now on and drop this process's private copies."""
+        self._arena = arena
+        self._body = None
+        self._encoded = {k: v for k, v in self._encoded.items() if arena.section(k) is None}
+        if arena.has_lines:
+            self._lines = None
+
+
+def entity_digest(entity: Any) -> str:
+    return hashlib.sha256(codec.canonical(entity)).hexdigest()[:32]
+
+
+def _compact(obj: Any) -> Any:
+    # Every dict key and short string value becomes one shared object per process
+    if isinstance(obj, dict):
+        return {_intern(k) if isinstance(k, str) else k: _compact(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_compact(v) for v in obj]
+    if isinstance(obj, str) and len(obj) <= INTERN_MAX_CHARS:
+        return _intern(obj)
+    return obj
+
+
+class Snapshot:
+    """Immutable set of loaded baselines; replaced wholesale, never mutated."""
+
+    __slots__ = ("data_dir", "entries")
+
+    def __init__(self, data_dir: Path, entries: Dict[str, Baseline]):
+        self.data_dir = data_dir
+        self.entries = entries
+
+
+_snapshot = Snapshot(DATA_DIR, {})
+# Set per request by SnapshotMiddleware so one request never mixes two baseline versions
+_pinned: ContextVar[Optional[Snapshot]] = ContextVar("zgdg_baseline_snapshot", default=None)
+_lock = threading.Lock()
+# While a watcher runs it owns freshness; otherwise every get() checks the file's mtime/size
+_watching = False
+# Called with the replaced kinds after each swap (e.g. to start rebasing shares)
+on_swap: List[Callable[[List[str]], None]] = []
+
+
+def _version_of(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _arena_path(kind: str, raw_sha256: str) -> Path:
+    # The JSON backend is part of the name: encodings are only byte-identical within one backend
+    return ARENA_DIR / f"{kind}-{raw_sha256[:32]}-{codec.backend.name}.arena"
+
+
+def _load(kind: str, path: Path, version: Tuple[int, int]) -> Baseline:
+    metrics.inc("zgdg_baseline_loads_total", file=path.name)
+    with metrics.timer("zgdg_baseline_load_seconds", file=path.name):
+        raw = path.read_bytes()
+        apath = _arena_path(kind, hashlib.sha256(raw).hexdigest())
+        shared = arena.open_arena(apath)
+        if shared is not None and shared.header.get("kind") == kind:
+            # Another worker (or an earlier run) already serialized this exact file
+            metrics.inc("zgdg_baseline_arena_total", kind=kind, result="hit")
+            return Baseline(kind=kind, path=path, version=version, sha256=shared.header["sha256"], arena=shared)
+        data = _compact(codec.loads(raw))
+        entry = Baseline(
+            kind=kind,
+            path=path,
+            version=version,
+            data=data,
+            body=codec.dumps(data),
+            sha256=hashlib.sha256(codec.canonical(data)).hexdigest(),
+        )
+        sections = {"json": entry.body}
+        for fmt in wire.BINARY:
+            sections[fmt.name] = entry.encoded(fmt)
+        try:
+            header = {"kind": kind, "sha256": entry.sha256, "root": entry.root()}
+            arena.write(apath, header, sections, entry._line_list())
+            shared = arena.open_arena(apath)
+        except OSError:
+            shared = None
+        if shared is not None:
+            entry.attach(shared)
+            arena.prune(ARENA_DIR, f"{kind}-", ARENA_KEEP, [apath])
+        metrics.inc("zgdg_baseline_arena_total", kind=kind, result="built" if shared is not None else "unavailable")
+    return entry
+
+
+def get(kind: str) -> Baseline:
+    fname = BASELINE_FILES.get(kind)
+    if fname is None:
+        raise HTTPException(status_code=400, detail="kind must be 'card' or 'pendant' or 'mapevent' or 'begineffect' or 'disaster'")
+    snap = _pinned.get() or _snapshot
+    entry = snap.entries.get(kind)
+    if entry is not None and snap.data_dir == DATA_DIR:
+        if _watching or entry.version == _version_of(entry.path):
+            metrics.inc("zgdg_baseline_cache_total", kind=kind, result="hit")
+            return entry
+    path = DATA_DIR / fname
+    if _version_of(path) is None:
+        raise HTTPException(status_code=404, detail=f"Not found: {path.name}")
+    metrics.inc("zgdg_baseline_cache_total", kind=kind, result="miss")
+    refresh([kind])
+    entry = _snapshot.entries.get(kind)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Not found: {path.name}")
+    return entry
+
+
+def refresh(kinds: Optional[List[str]] = None) -> List[str]:
+    """Reload changed baseline files and swap in a new snapshot; returns the kinds that changed.
+
+    Files that fail to parse (e.g. caught mid-write) keep their previous
+    version until the next refresh.
+    """
+    global _snapshot
+    with _lock:
+        snap = _snapshot
+        same_dir = snap.data_dir == DATA_DIR
+        entries = dict(snap.entries) if same_dir else {}
+        changed: List[str] = []
+        for kind in kinds or list(BASELINE_FILES):
+            path = DATA_DIR / BASELINE_FILES[kind]
+            version = _version_of(path)
+            old = entries.get(kind)
+            if version is None:
+                if old is not None:
+                    del entries[kind]
+                    changed.append(kind)
+                continue
+            if old is not None and old.version == version:
+                continue
+            try:
+                entries[kind] = _load(kind, path, version)
+            except (OSError, ValueError):
+                metrics.inc("zgdg_baseline_load_errors_total", file=path.name)
+                continue
+            changed.append(kind)
+        if not changed and same_dir:
+            return []
+        _snapshot = Snapshot(DATA_DIR, entries)
+        metrics.inc("zgdg_baseline_swaps_total")
+    for kind in changed:
+        if kind in entries:
+            _archive(entries[kind])
+    # First loads aren't changes anyone needs to react to
+    replaced = [k for k in changed if same_dir and k in snap.entries]
+    for cb in on_swap if replaced else ():
+        try:
+            cb(replaced)
+        except Exception:
+            pass
+    return changed
+
+
+def preload() -> None:
+    """Load every baseline and build what each worker would otherwise build for itself; call before forking."""
+    refresh()
+    for entry in _snapshot.entries.values():
+        entry.digests()
+        entry.records()
+
+
+class SnapshotMiddleware:
+    """Pin the current snapshot for the duration of each request."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _pinned.set(_snapshot)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _pinned.reset(token)
+
+
+class Watcher:
+    """Keeps this process's snapshot current: inotify via `watchfiles` when installed, else polling.
+
+    Each gunicorn worker runs its own watcher, so every worker swaps
+    independently as soon as it sees the change.
+    """
+
+    def __init__(self, poll_seconds: float = POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _loop(self) -> None:
+        global _watching
+        # Warm every kind off the request path before declaring the cache authoritative
+        refresh()
+        _watching = True
+        try:
+            if watchfiles is not None and DATA_DIR.is_dir():
+                try:
+                    for _ in watchfiles.watch(DATA_DIR, stop_event=self._stop, debounce=500, yield_on_timeout=True, rust_timeout=int(self.poll_seconds * 1000)):
+                        # Also runs on timeouts, which covers changes the watch missed (e.g. the directory was replaced)
+                        refresh()
+                    return
+                except Exception:
+                    pass
+            while not self._stop.wait(self.poll_seconds):
+                refresh()
+        finally:
+            _watching = False
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="zgdg-baseline-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+
+def _archive_path(kind: str, sha256: str) -> Path:
+    return ARCHIVE_DIR / kind / f"{sha256}.json{ARCHIVE_COMPRESSION.suffix}"
+
+
+def _archive(entry: Baseline) -> None:
+    path = _archive_path(entry.kind, entry.sha256)
+    if path.exists():
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(ARCHIVE_COMPRESSION.compress(entry.body))
+        os.replace(tmp, path)
+    except OSError:
+        # Read-only deployments just lose the ability to three-way rebase against this version
+        pass
+
+
+_archived: LRUCache[Baseline] = LRUCache(maxsize=8)
+
+
+def archived(kind: str, sha256: Optional[str]) -> Optional[Baseline]:
+    """A previous baseline version by its canonical sha256, if it was ever served here."""
+    if not sha256 or not all(c in "0123456789abcdef" for c in sha256):
+        return None
+    current = _snapshot.entries.get(kind)
+    if current is not None and current.sha256 == sha256:
+        return current
+    hit = _archived.get((kind, sha256))
+    if hit is not None:
+        return hit
+    for path in sorted((ARCHIVE_DIR / kind).glob(f"{sha256}.json*")):
+        comp = by_suffix(path.name[len(sha256) + 5:])
+        if comp is None:
+            continue
+        body = comp.decompress(path.read_bytes())
+        entry = Baseline(kind=kind, path=path, version=(0, len(body)), body=body, sha256=sha256)
+        _archived.put((kind, sha256), entry)
+        return entry
+    return None
+
+
+metrics.describe("zgdg_baseline_cache_total", "counter", "Baseline cache lookups by kind and result (hit/miss)")
+metrics.describe("zgdg_baseline_arena_total", "counter", "Baseline loads by kind and arena result (hit/built/unavailable)")
+metrics.describe("zgdg_baseline_swaps_total", "counter", "Baseline snapshots swapped in after a data change")
+metrics.describe("zgdg_baseline_load_errors_total", "counter", "Baseline files that failed to parse during a reload")
@@ -0,0 +1,124 @@
+"""JSON codec used for parsing, canonical hashing, storage and response bodies.
+
+Picks the fastest available backend — orjson, then msgspec, then the stdlib
+`json` module — or the one named by `ZGDG_JSON_BACKEND`. All backends emit
+compact UTF-8 without ASCII escaping, and `canonical()` (sorted keys) is
+byte-identical across backends for the game data, so hashes such as
+`baseSha256` don't change with the backend.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Callable, Dict, Optional, Union
+
+from fastapi import Response
+
+Bytes = Union[bytes, bytearray, memoryview, str]
+
+
+class Backend:
+    def __init__(self, name: str, loads: Callable[[Bytes], Any], dumps: Callable[[Any], bytes], canonical: Callable[[Any], bytes]):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.canonical = canonical
+
+
+def _std_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _std_canonical(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _std_loads(data: Bytes) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+BACKENDS: Dict[str, Backend] = {"json": Backend("json", _std_loads, _std_dumps, _std_canonical)}
+
+try:
+    import orjson
+
+    def _orjson_dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers beyond 64 bits or non-string keys
+            return _std_dumps(obj)
+
+    def _orjson_canonical(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            return _std_canonical(obj)
+
+    BACKENDS["orjson"] = Backend("orjson", orjson.loads, _orjson_dumps, _orjson_canonical)
+except ImportError:  # pragma: no cover - optional dependency
+    pass
+
+try:
+    import msgspec
+
+    _ms_encoder = msgspec.json.Encoder()
+    _ms_sorted = msgspec.json.Encoder(order="sorted")
+
+    def _msgspec_dumps(obj: Any) -> bytes:
+        try:
+            return _ms_encoder.encode(obj)
+        except (TypeError, OverflowError):
+            return _std_dumps(obj)
+
+    def _msgspec_canonical(obj: Any) -> bytes:
+        try:
+            return _ms_sorted.encode(obj)
+        except (TypeError, OverflowError):
+            return _std_canonical(obj)
+
+    BACKENDS["msgspec"] = Backend("msgspec", msgspec.json.decode, _msgspec_dumps, _msgspec_canonical)
+except (ImportError, TypeError):  # pragma: no cover - optional dependency / old msgspec without `order`
+    pass
+
+
+def _select(name: Optional[str]) -> Backend:
+    if name and name in BACKENDS:
+        return BACKENDS[name]
+    for cand in ("orjson", "msgspec", "json"):
+        if cand in BACKENDS:
+            return BACKENDS[cand]
+    return BACKENDS["json"]
+
+
+backend = _select(os.environ.get("ZGDG_JSON_BACKEND"))
+
+
+def loads(data: Bytes) -> Any:
+    return backend.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON."""
+    return backend.dumps(obj)
+
+
+def canonical(obj: Any) -> bytes:
+    """Sorted-key compact JSON for hashing and structural comparison."""
+    return backend.canonical(obj)
+
+
+class JSONBytesResponse(Response):
+    """JSON response rendered by the codec instead of FastAPI's `jsonable_encoder`.
+
+    Accepts either a JSON-compatible object or pre-serialized bytes.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
@@ -0,0 +1,147 @@
+"""Patch-level comparison of shares and baseline versions.
+
+Each side of a comparison is reduced to a `Footprint`: the entities it makes
+different from the current baselines, each with the state it ends up in
+(`None` when deleted) and that state's digest. Shares are applied with the
+same rules as `/api/patch/apply` (`diff.apply_changes`), and the changes
+that skips are kept as the footprint's conflicts. Entities neither side touches
+are never looked at, and entities both sides leave in the same state are
+matched by digest alone; only real disagreements are compared field by
+field.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from . import baseline, codec
+from .baseline import entity_digest
+from .diff import apply_changes
+
+# Entities listed per kind and category; counts always cover everything
+MAX_LISTED = 100
+
+
+class Footprint:
+    __slots__ = ("label", "entities", "digests", "skipped")
+
+    def __init__(self, label: Dict[str, Any]):
+        self.label = label
+        # kind -> ID -> applied entity (None = deleted)
+        self.entities: Dict[str, Dict[str, Optional[Dict[str, Any]]]] = {}
+        # kind -> ID -> digest of the applied entity (None = deleted)
+        self.digests: Dict[str, Dict[str, Optional[str]]] = {}
+        # kind -> changes applying the share skips, as `/api/patch/apply` reports them in `conflicts`
+        self.skipped: Dict[str, List[Dict[str, Any]]] = {}
+
+    def set(self, kind: str, eid: str, entity: Optional[Dict[str, Any]]) -> None:
+        self.entities.setdefault(kind, {})[eid] = entity
+        self.digests.setdefault(kind, {})[eid] = entity_digest(entity) if entity is not None else None
+
+
+def _current_entities(kind: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        return baseline.get(kind).entities()
+    except HTTPException:
+        return {}
+
+
+def share_footprint(label: Dict[str, Any], patches: List[Tuple[str, Dict[str, Any]]]) -> Footprint:
+    """What applying each `(kind, patch)` to the current baselines produces."""
+    fp = Footprint(label)
+    for kind, patch in patches:
+        current = _current_entities(kind)
+        # Later patches of a kind apply on top of the earlier ones
+        state = fp.entities.get(kind, {})
+        applied = apply_changes(lambda eid: state[eid] if eid in state else current.get(eid), patch.get("changes") or {})
+        for eid, entity in applied.entities.items():
+            fp.set(kind, eid, entity)
+        if applied.conflicts:
+            fp.skipped.setdefault(kind, []).extend(applied.conflicts)
+        # Entities that end up where the baseline already is don't count as touching it
+        digests = baseline.get(kind).digests() if current else {}
+        for eid, dg in list(fp.digests.get(kind, {}).items()):
+            if digests.get(eid) == dg:
+                del fp.digests[kind][eid]
+                del fp.entities[kind][eid]
+    return fp
+
+
+def baseline_footprint(kind: str, sha256: str) -> Optional[Footprint]:
+    """What going back to baseline version `sha256` of `kind` changes, relative to the current one."""
+    old = baseline.archived(kind, sha256)
+    if old is None:
+        return None
+    cur = baseline.get(kind)
+    fp = Footprint({"kind": kind, "baseSha256": sha256})
+    old_dg, cur_dg = old.digests(), cur.digests()
+    old_ent = old.entities()
+    for eid, dg in old_dg.items():
+        if cur_dg.get(eid) != dg:
+            fp.entities.setdefault(kind, {})[eid] = old_ent[eid]
+            fp.digests.setdefault(kind, {})[eid] = dg
+    for eid in cur_dg.keys() - old_dg.keys():
+        fp.set(kind, eid, None)
+    return fp
+
+
+def _same(a: Any, b: Any) -> bool:
+    return a == b and codec.canonical(a) == codec.canonical(b)
+
+
+def _name(*entities: Optional[Dict[str, Any]]) -> Optional[str]:
+    for ent in entities:
+        if isinstance(ent, dict) and isinstance(ent.get("Name"), str):
+            return ent["Name"]
+    return None
+
+
+def _capped(items: List[Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"count": len(items), "items": items[:MAX_LISTED]}
+    if len(items) > MAX_LISTED:
+        out["truncated"] = True
+    return out
+
+
+def compare(a: Footprint, b: Footprint) -> Dict[str, Any]:
+    """Overlap of two footprints: entities both change identically, conflicts, one-sided changes and skipped changes."""
+    kinds: Dict[str, Any] = {}
+    overlap = conflicts = 0
+    for kind in sorted(set(a.digests) | set(b.digests) | set(a.skipped) | set(b.skipped)):
+        da = a.digests.get(kind, {})
+        db = b.digests.get(kind, {})
+        current = _current_entities(kind)
+        same: List[str] = []
+        differ: List[Dict[str, Any]] = []
+        for eid in sorted(da.keys() & db.keys()):
+            if da[eid] == db[eid]:
+                same.append(eid)
+                continue
+            ea = a.entities[kind][eid]
+            eb = b.entities[kind][eid]
+            item: Dict[str, Any] = {"id": eid, "name": _name(ea, eb, current.get(eid))}
+            if ea is None or eb is None:
+                item["type"] = "deleted_a" if ea is None else "deleted_b"
+            else:
+                item["type"] = "fields"
+                item["fields"] = {
+                    key: {"a": ea.get(key), "b": eb.get(key)}
+                    for key in sorted(ea.keys() | eb.keys())
+                    if not _same(ea.get(key), eb.get(key))
+                }
+            differ.append(item)
+        only_a = sorted(da.keys() - db.keys())
+        only_b = sorted(db.keys() - da.keys())
+        overlap += len(same) + len(differ)
+        conflicts += len(differ)
+        kinds[kind] = {
+            "same": _capped(same),
+            "conflicts": _capped(differ),
+            "onlyA": _capped(only_a),
+            "onlyB": _capped(only_b),
+            "skippedA": _capped(a.skipped.get(kind, [])),
+            "skippedB": _capped(b.skipped.get(kind, [])),
+        }
+    skipped = {"a": sum(len(v) for v in a.skipped.values()), "b": sum(len(v) for v in b.skipped.values())}
+    return {"a": a.label, "b": b.label, "overlap": overlap, "conflicts": conflicts, "skipped": skipped, "kinds": kinds}
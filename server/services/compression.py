@@ -0,0 +1,88 @@
+"""Payload compression for the share store.
+
+Stored payloads use zstd when the `zstandard` package is installed and zlib
+otherwise (`ZGDG_SHARE_COMPRESSION=zstd|zlib|none` overrides). zlib streams
+are exactly what HTTP calls `Content-Encoding: deflate`, so either format can
+be sent to clients unchanged when their `Accept-Encoding` allows it.
+"""
+from __future__ import annotations
+
+import os
+import zlib
+from typing import Callable, Dict, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None  # type: ignore[assignment]
+
+
+class Compression:
+    def __init__(self, name: str, suffix: str, content_encoding: Optional[str], compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes]):
+        self.name = name
+        # File name suffix after ".json"
+        self.suffix = suffix
+        self.content_encoding = content_encoding
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _identity(data: bytes) -> bytes:
+    return data
+
+
+COMPRESSIONS: Dict[str, Compression] = {
+    "none": Compression("none", "", None, _identity, _identity),
+    "zlib": Compression("zlib", ".z", "deflate", lambda b: zlib.compress(b, 6), zlib.decompress),
+}
+
+if zstandard is not None:
+
+    def _zstd_compress(data: bytes) -> bytes:
+        # Compressor objects aren't thread-safe; they're cheap enough to create per call
+        return zstandard.ZstdCompressor(level=10).compress(data)
+
+    def _zstd_decompress(data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    COMPRESSIONS["zstd"] = Compression("zstd", ".zst", "zstd", _zstd_compress, _zstd_decompress)
+
+
+def by_suffix(suffix: str) -> Optional[Compression]:
+    for comp in COMPRESSIONS.values():
+        if comp.suffix == suffix:
+            return comp
+    return None
+
+
+def _select(name: Optional[str]) -> Compression:
+    if name:
+        if name not in COMPRESSIONS:
+            raise RuntimeError(f"ZGDG_SHARE_COMPRESSION must be one of {sorted(COMPRESSIONS)}, got {name!r}")
+        return COMPRESSIONS[name]
+    return COMPRESSIONS["zstd"] if "zstd" in COMPRESSIONS else COMPRESSIONS["zlib"]
+
+
+DEFAULT = _select(os.environ.get("ZGDG_SHARE_COMPRESSION"))
+
+
+def accepts(accept_encoding: Optional[str], encoding: str) -> bool:
+    """Whether an `Accept-Encoding` header allows `encoding` (q=0 counts as refused)."""
+    if not accept_encoding:
+        return False
+    wildcard = False
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token == encoding:
+            return q > 0
+        if token == "*":
+            wildcard = q > 0
+    return wildcard
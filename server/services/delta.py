@@ -0,0 +1,155 @@
+"""Baseline delta sync for returning clients.
+
+`/api/baseline/{kind}?since=<baseSha256>` answers with a patch (the
+`/api/patch/diff` format) from the client's cached version to the current
+one. Only recent versions are eligible: the newest `HISTORY` versions in the
+baseline archive. Their deltas to the current version are precomputed when
+the watcher swaps in new data; older or unknown versions get the full file.
+
+Deltas compare per-entity digests first, so only entities that actually
+changed are diffed field by field. A patch only says which entities were
+added, updated or deleted, so a delta is only sent when that's enough to
+rebuild the new version exactly: same root object, surviving entities in
+the same order with the adds after them, and no fields
+added to or dropped from an updated entity. Anything else gets the full
+file.
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import baseline, codec, metrics, wire
+from .cache import LRUCache
+from .diff import diff_entities
+
+HISTORY = int(os.environ.get("ZGDG_BASELINE_DELTA_VERSIONS") or 8)
+
+
+class Delta:
+    """A cached delta; `patch` is None when the version needs the full file."""
+
+    __slots__ = ("patch", "_encoded")
+
+    def __init__(self, patch: Optional[Dict[str, Any]]):
+        self.patch = patch
+        self._encoded: Dict[str, bytes] = {}
+
+    def encoded(self, fmt: wire.WireFormat) -> bytes:
+        out = self._encoded.get(fmt.name)
+        if out is None:
+            out = self._encoded[fmt.name] = fmt.dumps(self.patch)
+        return out
+
+
+# (kind, from sha, to sha) -> Delta
+_deltas: LRUCache[Delta] = LRUCache(maxsize=max(1, HISTORY) * len(baseline.BASELINE_FILES))
+# kind -> (archive dir mtime, recent shas newest first)
+_recent: Dict[str, Tuple[int, List[str]]] = {}
+
+
+def recent_versions(kind: str) -> List[str]:
+    """Hashes of the newest `HISTORY` archived versions of `kind`, newest first."""
+    d = baseline.ARCHIVE_DIR / kind
+    try:
+        mtime = d.stat().st_mtime_ns
+    except OSError:
+        return []
+    hit = _recent.get(kind)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    found: List[Tuple[int, str]] = []
+    with os.scandir(d) as it:
+        for de in it:
+            sha, sep, _ = de.name.partition(".json")
+            if sep and len(sha) == 64 and not de.name.startswith("."):
+                try:
+                    found.append((de.stat().st_mtime_ns, sha))
+                except OSError:
+                    continue
+    shas = [sha for _, sha in sorted(found, reverse=True)[:HISTORY]]
+    _recent[kind] = (mtime, shas)
+    return shas
+
+
+def _ids(entry: baseline.Baseline) -> Optional[List[str]]:
+    """Entity IDs in file order, or None when some item has no usable or a repeated ID."""
+    ids = [it.get("ID") if isinstance(it, dict) else None for it in entry.items()]
+    if not all(isinstance(i, str) and i for i in ids) or len(set(ids)) != len(ids):
+        return None
+    return ids
+
+
+def _rebuilds(old: baseline.Baseline, new: baseline.Baseline, changes: Dict[str, Any]) -> bool:
+    """Whether applying `changes` to `old` the way clients do yields exactly `new`."""
+    if codec.canonical(old.root()) != codec.canonical(new.root()):
+        return False
+    old_ids, new_ids = _ids(old), _ids(new)
+    if old_ids is None or new_ids is None:
+        return False
+    deleted = {d["id"] for d in changes["deletes"]}
+    if [i for i in old_ids if i not in deleted] + [a["id"] for a in changes["adds"]] != new_ids:
+        return False
+    oe, ne = old.entities(), new.entities()
+    return all(oe[u["id"]].keys() == ne[u["id"]].keys() for u in changes["updates"])
+
+
+def compute(old: baseline.Baseline, new: baseline.Baseline) -> Optional[Dict[str, Any]]:
+    """Patch from `old` to `new` in the `compute_diff` format plus `targetSha256`, or None when it can't rebuild `new`."""
+    od, nd = old.digests(), new.digests()
+    oe, ne = old.entities(), new.entities()
+    changes = diff_entities(
+        {eid: oe[eid] for eid, dg in od.items() if nd.get(eid) != dg},
+        {eid: ne[eid] for eid, dg in nd.items() if od.get(eid) != dg},
+    )
+    new_ids = _ids(new)
+    if new_ids is not None:
+        # Adds listed in file order rather than by ID, since clients append them as listed
+        pos = {eid: i for i, eid in enumerate(new_ids)}
+        changes["adds"].sort(key=lambda a: pos[a["id"]])
+    if not _rebuilds(old, new, changes):
+        return None
+    meta = {"schema": 1, "kind": new.kind, "baseSha256": old.sha256, "targetSha256": new.sha256}
+    return {"meta": meta, "changes": changes}
+
+
+def get(kind: str, since: str, current: baseline.Baseline) -> Optional[Delta]:
+    """Delta from version `since` to `current`, or None when the client needs the full file."""
+    key = (kind, since, current.sha256)
+    hit = _deltas.get(key)
+    if hit is not None:
+        metrics.inc("zgdg_baseline_delta_total", kind=kind, result="hit" if hit.patch is not None else "full")
+        return hit if hit.patch is not None else None
+    if since != current.sha256 and since not in recent_versions(kind):
+        metrics.inc("zgdg_baseline_delta_total", kind=kind, result="unknown")
+        return None
+    old = current if since == current.sha256 else baseline.archived(kind, since)
+    if old is None:
+        metrics.inc("zgdg_baseline_delta_total", kind=kind, result="unknown")
+        return None
+    delta = Delta(compute(old, current))
+    # Remembered either way, so a version that needs the full file isn't diffed again on every request
+    _deltas.put(key, delta)
+    if delta.patch is None:
+        metrics.inc("zgdg_baseline_delta_total", kind=kind, result="full")
+        return None
+    metrics.inc("zgdg_baseline_delta_total", kind=kind, result="miss")
+    delta.encoded(wire.JSON)
+    return delta
+
+
+def precompute(kinds: List[str]) -> None:
+    """Deltas from each recent version to the new current one, built right after a swap."""
+    for kind in kinds:
+        try:
+            current = baseline.get(kind)
+        except Exception:
+            continue
+        for sha in recent_versions(kind):
+            if sha != current.sha256:
+                get(kind, sha, current)
+
+
+baseline.on_swap.append(precompute)
+
+metrics.describe("zgdg_baseline_delta_total", "counter", "Baseline delta requests by kind and result (hit/miss/unknown, or full when a patch can't rebuild the current version)")
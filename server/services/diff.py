@@ -0,0 +1,204 @@
+"""Entity-level diffs between two versions of a data file.
+
+Patches list adds, deletes and field-level updates (`{"from", "to"}`) keyed
+by entity ID; this is the format `/api/patch/diff` returns, shares store and
+baseline delta sync serves.
+"""
+from __future__ import annotations
+
+import hashlib
+from copy import deepcopy
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from . import codec
+
+
+def sha256_of_obj(obj: Any) -> str:
+    # Deterministic hash: stable JSON form
+    return hashlib.sha256(codec.canonical(obj)).hexdigest()
+
+
+def kind_shape(kind: str) -> Tuple[str, str | None]:
+    """Return (mode, list_key) where mode is 'object_list' or 'array_root'."""
+    k = kind.lower()
+    if k in {"card", "pendant", "disaster"}:
+        # Card.json: { Name, Cards: [...] }
+        # Pendant.json / Disaster.json: { Name, Pendant: [...] }
+        return ("object_list", "Cards" if k == "card" else "Pendant")
+    if k in {"mapevent", "begineffect"}:
+        return ("array_root", None)
+    raise HTTPException(status_code=400, detail=f"不支持的种类: {kind}")
+
+
+def list_from_data(kind: str, data: Any) -> List[Dict[str, Any]]:
+    mode, list_key = kind_shape(kind)
+    if mode == "object_list":
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=400, detail="数据应为对象")
+        lst = data.get(list_key or "")
+        if not isinstance(lst, list):
+            raise HTTPException(status_code=400, detail=f"缺少 {list_key} 列表")
+        return lst
+    # array_root
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="数据应为数组")
+    return data
+
+
+def entity_map(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        eid = it.get("ID")
+        if isinstance(eid, str) and eid:
+            out[eid] = it
+    return out
+
+
+def diff_entities(base: Dict[str, Any], edited: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute adds/updates/deletes for entity maps keyed by ID.
+    Updates are reported as field-level changes (no deep pathing)."""
+    adds: List[Dict[str, Any]] = []
+    deletes: List[Dict[str, Any]] = []
+    updates: List[Dict[str, Any]] = []
+
+    base_ids = set(base.keys())
+    edited_ids = set(edited.keys())
+
+    for new_id in sorted(edited_ids - base_ids):
+        adds.append({"id": new_id, "data": deepcopy(edited[new_id])})
+
+    for old_id in sorted(base_ids - edited_ids):
+        deletes.append({"id": old_id})
+
+    for same_id in sorted(base_ids & edited_ids):
+        before = base[same_id]
+        after = edited[same_id]
+        # field-level shallow diff excluding ID
+        fields_changed: Dict[str, Dict[str, Any]] = {}
+        keys = set(before.keys()) | set(after.keys())
+        for key in keys:
+            if key == "ID":
+                continue
+            b = before.get(key, None)
+            a = after.get(key, None)
+            if value_equal(b, a):
+                continue
+            fields_changed[key] = {"from": deepcopy(b), "to": deepcopy(a)}
+        if fields_changed:
+            updates.append({"id": same_id, "fields": fields_changed})
+
+    return {"adds": adds, "updates": updates, "deletes": deletes}
+
+
+def value_equal(a: Any, b: Any) -> bool:
+    if a is b:
+        return True
+    # Normalize via JSON where possible for structural types
+    if isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+        if a != b:
+            # Canonical forms can only match when the values already compare equal
+            return False
+        try:
+            return codec.canonical(a) == codec.canonical(b)
+        except Exception:
+            return a == b
+    return a == b
+
+
+class Applied:
+    """Outcome of `apply_changes`."""
+
+    __slots__ = ("entities", "deleted", "added", "stats", "conflicts")
+
+    def __init__(self) -> None:
+        # ID -> entity after the patch (None = deleted), for every ID the patch changed
+        self.entities: Dict[str, Optional[Dict[str, Any]]] = {}
+        # IDs that existed and were deleted; IDs added, in order (an ID can be deleted and added back)
+        self.deleted: List[str] = []
+        self.added: List[str] = []
+        self.stats = {"addsApplied": 0, "updatesApplied": 0, "deletesApplied": 0}
+        # Changes skipped because they don't fit the entities they were applied to
+        self.conflicts: List[Dict[str, Any]] = []
+
+
+def apply_changes(lookup: Callable[[str], Optional[Dict[str, Any]]], chg: Dict[str, Any]) -> Applied:
+    """Apply a patch's changes to the entities `lookup(id)` finds (None when absent), without modifying them.
+
+    Deletes go first, then adds, then updates. An add whose ID exists, an
+    update of a missing entity and a field whose `from` doesn't match are
+    skipped and reported in `conflicts`. `/api/patch/apply` and share
+    comparison both apply patches through here.
+    """
+    out = Applied()
+
+    def find(eid: str) -> Optional[Dict[str, Any]]:
+        return out.entities[eid] if eid in out.entities else lookup(eid)
+
+    for d in chg.get("deletes") or []:
+        eid = d.get("id") if isinstance(d, dict) else None
+        if not isinstance(eid, str) or find(eid) is None:
+            continue
+        out.entities[eid] = None
+        out.deleted.append(eid)
+        out.stats["deletesApplied"] += 1
+
+    for a in chg.get("adds") or []:
+        eid = a.get("id") if isinstance(a, dict) else None
+        data_obj = a.get("data") if isinstance(a, dict) else None
+        if not isinstance(eid, str) or not isinstance(data_obj, dict):
+            continue
+        if find(eid) is not None:
+            out.conflicts.append({"id": eid, "type": "add_exists"})
+            continue
+        out.entities[eid] = deepcopy(data_obj)
+        out.added.append(eid)
+        out.stats["addsApplied"] += 1
+
+    for u in chg.get("updates") or []:
+        eid = u.get("id") if isinstance(u, dict) else None
+        fields = (u.get("fields") or {}) if isinstance(u, dict) else None
+        if not isinstance(eid, str) or not isinstance(fields, dict):
+            continue
+        obj = find(eid)
+        if obj is None:
+            out.conflicts.append({"id": eid, "type": "update_missing"})
+            continue
+        if not isinstance(obj, dict):
+            out.conflicts.append({"id": eid, "type": "update_not_object"})
+            continue
+        for key, ft in fields.items():
+            if not isinstance(ft, dict) or "to" not in ft:
+                continue
+            expected = ft.get("from", None)
+            current = obj.get(key, None)
+            if expected is not None and not value_equal(current, expected):
+                out.conflicts.append({"id": eid, "field": key, "type": "conflict", "current": deepcopy(current), "expected": deepcopy(expected)})
+                continue
+            if eid not in out.entities:
+                # Copied on first write; the looked-up entity stays as it was
+                obj = out.entities[eid] = dict(obj)
+            obj[key] = deepcopy(ft.get("to"))
+            out.stats["updatesApplied"] += 1
+
+    return out
+
+
+def compute_diff(kind_l: str, base_data: Any, edited: Any, base_sha: Optional[str] = None) -> Dict[str, Any]:
+    """Patch from `base_data` to `edited`; shared by the diff route and share migrations."""
+    base_list = list_from_data(kind_l, base_data)
+    edited_list = list_from_data(kind_l, edited)
+
+    base_map = entity_map(base_list)
+    edited_map = entity_map(edited_list)
+
+    changes = diff_entities(base_map, edited_map)
+    meta = {
+        "schema": 1,
+        "kind": kind_l,
+        "baseSha256": base_sha or sha256_of_obj(base_data),
+    }
+    return {"meta": meta, "changes": changes}
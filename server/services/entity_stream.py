@@ -0,0 +1,168 @@
+"""NDJSON streaming of a baseline's entities.
+
+The first line carries the kind's root metadata (the root object without its
+entity list, the version hash and the number of entities that will follow);
+every further line is one entity. Entity lines come from the bytes each
+`Baseline` serializes once per version (memory-mapped and shared between
+workers when the arena is available), so a response only ever holds one
+chunk of output on top of the shared cache, and clients can render the first
+rows before the rest arrives.
+
+Filters and orderings select and permute references into that cache; the
+entities themselves are never copied.
+
+With `elide`, fields equal to their default in the profiled data schema are
+left out of each line (a second per-version cache), and the defaults
+actually used are sent in the metadata line for clients to fill back in.
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from . import baseline, codec, metrics, schema
+from .cache import LRUCache
+
+CHUNK_BYTES = int(os.environ.get("ZGDG_STREAM_CHUNK_BYTES") or 64 * 1024)
+
+# (kind, sha, field, descending) -> line indexes in that order
+_orders: LRUCache[List[int]] = LRUCache(maxsize=64)
+# (kind, sha, schema generation) -> (defaults used, elided line per entry of `records()`)
+_elided: LRUCache[Tuple[Dict[str, Any], List[Any]]] = LRUCache(maxsize=len(baseline.BASELINE_FILES) * 2)
+
+
+def parse_filters(raw: List[str]) -> List[Tuple[str, str]]:
+    """`Field=value` pairs; every pair must match for an entity to be sent."""
+    out: List[Tuple[str, str]] = []
+    for item in raw:
+        field, sep, value = item.partition("=")
+        if not sep or not field.strip():
+            raise HTTPException(status_code=400, detail=f"过滤条件格式应为 字段=值: {item}")
+        out.append((field.strip(), value))
+    return out
+
+
+def _scalar_text(v: Any) -> Optional[str]:
+    if isinstance(v, bool):
+        return "true" if v else "false"
+    if isinstance(v, (str, int, float)):
+        return str(v)
+    return None
+
+
+def _matches(ent: Dict[str, Any], q: str, filters: List[Tuple[str, str]]) -> bool:
+    for field, value in filters:
+        if _scalar_text(ent.get(field)) != value:
+            return False
+    if q:
+        for key in ("ID", "Name"):
+            v = ent.get(key)
+            if isinstance(v, str) and q in v.lower():
+                return True
+        return False
+    return True
+
+
+def _sort_key(field: str):
+    # Numbers before strings before everything else; missing values last
+    def key(item: Tuple[int, Dict[str, Any]]) -> Tuple[int, Any]:
+        v = item[1].get(field)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return (0, v)
+        if isinstance(v, str):
+            return (1, v)
+        if v is None:
+            return (3, "")
+        return (2, codec.canonical(v))
+
+    return key
+
+
+def order_of(b: baseline.Baseline, order: str) -> List[int]:
+    """Line indexes of `b` sorted by a field (`-Field` for descending); cached per version."""
+    desc = order.startswith("-")
+    field = order[1:] if desc else order
+    if not field:
+        raise HTTPException(status_code=400, detail="排序字段不能为空")
+    key = (b.kind, b.sha256, field, desc)
+    hit = _orders.get(key)
+    if hit is None:
+        ordered = sorted(enumerate(b.records()), key=_sort_key(field))
+        if desc:
+            # Keep entities lacking the field at the end either way
+            present = [i for i, ent in ordered if ent.get(field) is not None]
+            missing = [i for i, ent in ordered if ent.get(field) is None]
+            hit = present[::-1] + missing
+        else:
+            hit = [i for i, _ in ordered]
+        _orders.put(key, hit)
+    return hit
+
+
+def elided_lines(b: baseline.Baseline) -> Tuple[Dict[str, Any], List[Any]]:
+    """Entity lines without fields that hold their schema default; cached per version and schema."""
+    key = (b.kind, b.sha256, schema.generation())
+    hit = _elided.get(key)
+    if hit is None:
+        records = b.records()
+        # Only fields every entity has: a client filling defaults back in must not add fields that were absent
+        defaults = {
+            k: v for k, v in schema.defaults(b.kind).items() if all(k in ent for ent in records)
+        }
+        out: List[Any] = []
+        for i, ent in enumerate(records):
+            drop = [k for k, v in defaults.items() if ent[k] == v and codec.canonical(ent[k]) == codec.canonical(v)]
+            out.append(codec.dumps({k: v for k, v in ent.items() if k not in drop}) + b"\n" if drop else b.line(i))
+        hit = (defaults, out)
+        _elided.put(key, hit)
+    return hit
+
+
+def meta_line(b: baseline.Baseline, count: int, defaults: Optional[Dict[str, Any]] = None) -> bytes:
+    meta: Dict[str, Any] = {"kind": b.kind, "sha256": b.sha256, "count": count}
+    if defaults is not None:
+        meta["defaults"] = defaults
+    root = b.root()
+    if root is not None:
+        meta["root"] = root
+        meta["listKey"] = baseline.LIST_KEYS[b.kind]
+    return codec.dumps(meta) + b"\n"
+
+
+def select(b: baseline.Baseline, q: str = "", filters: Optional[List[Tuple[str, str]]] = None, order: str = "") -> Sequence[int]:
+    """Indexes into `b.records()` of the entities to send, in sending order."""
+    q = q.strip().lower()
+    # The unfiltered stream needs no parsed data at all: only the line count
+    indexes: Sequence[int] = order_of(b, order) if order else range(b.line_count())
+    if q or filters:
+        records = b.records()
+        indexes = [i for i in indexes if _matches(records[i], q, filters or [])]
+    return indexes
+
+
+def stream(b: baseline.Baseline, indexes: Sequence[int], elide: bool = False) -> Iterator[bytes]:
+    """Metadata line, then the selected entity lines, joined into chunks of about `CHUNK_BYTES`."""
+    metrics.inc("zgdg_entity_stream_total", kind=b.kind)
+    if elide:
+        defaults, elided = elided_lines(b)
+        line_at = elided.__getitem__
+        yield meta_line(b, len(indexes), defaults)
+    else:
+        line_at = b.line
+        yield meta_line(b, len(indexes))
+    buf: List[Any] = []
+    size = 0
+    for i in indexes:
+        line = line_at(i)
+        buf.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+metrics.describe("zgdg_entity_stream_total", "counter", "NDJSON entity streams served, by kind")
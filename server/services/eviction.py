@@ -0,0 +1,94 @@
+"""Share eviction policies and orphan detection.
+
+A policy maps an index entry to a sort key; entries with the smallest keys
+are evicted first. Victims are taken from a heap, so trimming a handful of
+entries from a large index is O(n + k log n) rather than a full sort.
+"""
+from __future__ import annotations
+
+import calendar
+import heapq
+import math
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import metrics
+
+Entry = Dict[str, Any]
+PolicyKey = Callable[[Entry, float], Tuple[Any, ...]]
+
+DECAY_HALF_LIFE_HOURS = 72.0
+
+
+def _created_ts(entry: Entry) -> float:
+    try:
+        return float(calendar.timegm(time.strptime(str(entry.get("createdAt", "")), "%Y-%m-%dT%H:%M:%SZ")))
+    except ValueError:
+        return 0.0
+
+
+def _oldest(entry: Entry, now: float) -> Tuple[Any, ...]:
+    return (str(entry.get("createdAt", "")),)
+
+
+def _least_downloaded(entry: Entry, now: float) -> Tuple[Any, ...]:
+    return (int(entry.get("downloads") or 0), str(entry.get("createdAt", "")))
+
+
+def _decayed(entry: Entry, now: float) -> Tuple[Any, ...]:
+    # Downloads + 1 so a fresh share starts level with a popular-but-stale one and has to earn its keep
+    age_h = max(0.0, now - _created_ts(entry)) / 3600.0
+    score = (int(entry.get("downloads") or 0) + 1) * math.pow(0.5, age_h / DECAY_HALF_LIFE_HOURS)
+    return (score, str(entry.get("createdAt", "")))
+
+
+def _largest(entry: Entry, now: float) -> Tuple[Any, ...]:
+    return (-int(entry.get("size") or 0), str(entry.get("createdAt", "")))
+
+
+POLICIES: Dict[str, PolicyKey] = {
+    "oldest": _oldest,
+    "least-downloaded": _least_downloaded,
+    "decayed": _decayed,
+    "largest": _largest,
+}
+
+
+def select_victims(
+    items: List[Entry],
+    policy: str,
+    max_items: int,
+    max_bytes: int = 0,
+    now: Optional[float] = None,
+) -> List[Entry]:
+    """Entries to evict so at most `max_items` remain and (if set) their sizes sum to `max_bytes` or less."""
+    key = POLICIES[policy]
+    now = time.time() if now is None else now
+    count = len(items)
+    total = sum(int(it.get("size") or 0) for it in items) if max_bytes > 0 else 0
+    if count <= max_items and (max_bytes <= 0 or total <= max_bytes):
+        return []
+    if max_bytes <= 0:
+        return heapq.nsmallest(count - max_items, items, key=lambda it: key(it, now))
+    heap = [(key(it, now), i) for i, it in enumerate(items)]
+    heapq.heapify(heap)
+    victims: List[Entry] = []
+    while heap and (count > max_items or total > max_bytes):
+        _, i = heapq.heappop(heap)
+        victims.append(items[i])
+        count -= 1
+        total -= int(items[i].get("size") or 0)
+    return victims
+
+
+def find_orphans(files: Iterable[Tuple[str, float]], known_ids: Set[str], grace_seconds: float, now: Optional[float] = None) -> List[str]:
+    """IDs of payload files (id, mtime) that no index entry references and are older than the grace period.
+
+    The grace period covers writers that create the file just before adding its entry.
+    """
+    now = time.time() if now is None else now
+    return [sid for sid, mtime in files if sid not in known_ids and now - mtime > grace_seconds]
+
+
+metrics.describe("zgdg_share_evicted_total", "counter", "Shares evicted by the maintainer, by policy")
+metrics.describe("zgdg_share_orphans_removed_total", "counter", "Unreferenced share files removed by the orphan sweep")
@@ -0,0 +1,137 @@
+"""Replay of repeated share publishes.
+
+A publish retried after a dropped connection should get back the share the
+first attempt created instead of a second copy. Every publish is remembered
+for `TTL_SECONDS` under two fingerprints:
+
+- the client's `Idempotency-Key` header, with a digest of the raw body, so
+  a key reused for different content is rejected rather than replayed;
+- the canonical payload (which includes `meta.author`), for clients that
+  send no key.
+
+Only a repeated key gets the original manage token back: the key is a
+random secret of the client that published, whereas a payload can be copied
+by anyone from `GET /api/share/{id}`. A payload match answers with the
+existing share's ID alone, and payload entries store no token at all.
+
+The table is `idempotency.json` in the share store, so every worker sees what
+the others wrote. It is only written under the store lock, in the same
+critical section as the index entry it points at, and read without the lock
+(re-parsed only when the file changes). Key entries hold the manage token
+sealed with a pad derived from the key, so the file alone doesn't reveal it.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+from . import codec, metrics
+from .share_store import ShareStore
+
+TTL_SECONDS = float(os.environ.get("ZGDG_SHARE_IDEMPOTENCY_TTL") or 24 * 3600)
+MAX_ENTRIES = int(os.environ.get("ZGDG_SHARE_IDEMPOTENCY_MAX") or 10000)
+MAX_KEY_CHARS = 255
+STATE_NAME = "idempotency.json"
+
+
+class Claim(NamedTuple):
+    """One fingerprint of a publish request: `via` is "key" or "payload"."""
+
+    via: str
+    material: bytes
+    body_digest: Optional[str] = None
+
+
+class Replay(NamedTuple):
+    share_id: str
+    # Only for key claims
+    manage_token: Optional[str]
+    body_digest: Optional[str]
+
+
+def key_claim(key: str, raw: bytes) -> Claim:
+    return Claim("key", b"key\0" + key.encode("utf-8"), hashlib.sha256(raw).hexdigest())
+
+
+def payload_claim(body: Any) -> Claim:
+    return Claim("payload", b"payload\0" + hashlib.sha256(codec.canonical(body)).digest())
+
+
+def _fingerprint(material: bytes) -> str:
+    return hashlib.sha256(b"fingerprint\0" + material).hexdigest()
+
+
+def _seal(token: str, material: bytes) -> str:
+    raw = token.encode("utf-8")
+    pad = hashlib.shake_256(b"token\0" + material).digest(len(raw))
+    return bytes(a ^ b for a, b in zip(raw, pad)).hex()
+
+
+def _unseal(sealed: str, material: bytes) -> str:
+    raw = bytes.fromhex(sealed)
+    pad = hashlib.shake_256(b"token\0" + material).digest(len(raw))
+    return bytes(a ^ b for a, b in zip(raw, pad)).decode("utf-8")
+
+
+class IdempotencyTable:
+    def __init__(self, store: ShareStore, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (st_ino, st_mtime_ns, st_size) of the file last parsed, and its entries
+        self._cached: Tuple[Optional[Tuple[int, int, int]], Dict[str, Dict[str, Any]]] = (None, {})
+
+    def _entries(self) -> Dict[str, Dict[str, Any]]:
+        """Fingerprint -> entry, oldest first; shared, never mutate."""
+        try:
+            st = (self.store.root / STATE_NAME).stat()
+            stamp: Optional[Tuple[int, int, int]] = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        with self._lock:
+            if self._cached[0] != stamp or stamp is None:
+                state = self.store.read_state(STATE_NAME) if stamp is not None else None
+                entries = state.get("entries") if isinstance(state, dict) else None
+                self._cached = (stamp, entries if isinstance(entries, dict) else {})
+            return self._cached[1]
+
+    def lookup(self, claim: Claim) -> Optional[Replay]:
+        """The share a live entry for this fingerprint points at."""
+        entry = self._entries().get(_fingerprint(claim.material))
+        if entry is None or float(entry.get("expires") or 0) <= time.time():
+            return None
+        token = _unseal(entry["token"], claim.material) if claim.via == "key" and "token" in entry else None
+        return Replay(entry["id"], token, entry.get("body"))
+
+    def remember(self, claims: Iterable[Claim], share_id: str, manage_token: str) -> None:
+        """Record a new share under each fingerprint; the caller holds the store lock."""
+        now = time.time()
+        entries = {fp: e for fp, e in self._entries().items() if float(e.get("expires") or 0) > now}
+        for claim in claims:
+            fp = _fingerprint(claim.material)
+            entry: Dict[str, Any] = {"id": share_id, "expires": round(now + self.ttl, 3)}
+            if claim.via == "key":
+                entry["token"] = _seal(manage_token, claim.material)
+            if claim.body_digest is not None:
+                entry["body"] = claim.body_digest
+            # Re-inserted at the end: insertion order is age order
+            entries.pop(fp, None)
+            entries[fp] = entry
+        while len(entries) > self.max_entries:
+            del entries[next(iter(entries))]
+            metrics.inc("zgdg_share_idempotency_evicted_total")
+        self.store.write_state(STATE_NAME, {"entries": entries})
+
+    def forget(self, share_ids: Set[str]) -> None:
+        """Drop entries of deleted shares, so a retry publishes anew; the caller holds the store lock."""
+        entries = self._entries()
+        kept = {fp: e for fp, e in entries.items() if e.get("id") not in share_ids}
+        if len(kept) != len(entries):
+            self.store.write_state(STATE_NAME, {"entries": kept})
+
+
+metrics.describe("zgdg_share_idempotency_evicted_total", "counter", "Idempotency entries dropped before their TTL to stay within ZGDG_SHARE_IDEMPOTENCY_MAX")
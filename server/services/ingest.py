@@ -0,0 +1,182 @@
+"""Admission control for write-heavy endpoints (share publishing).
+
+Three layers, cheapest first, so an overloaded worker rejects work before
+buffering or parsing it:
+
+- `TokenBucket` — per-client rate limit, answered with 429 + Retry-After;
+- `read_body_capped` — streams the request body and stops at a byte cap (413);
+- `IngestGate` — a bounded number of admitted requests (503 when full), of
+  which only `concurrency` run the CPU-heavy part at once, so publishes never
+  occupy every storage worker that reads also depend on.
+
+All state is per process; with several gunicorn workers the effective
+limits scale with the worker count.
+
+Forwarding headers are only believed from the proxies listed in
+`ZGDG_TRUSTED_PROXIES` (addresses or CIDRs, comma-separated; empty by
+default, so the socket peer is the client).
+"""
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import math
+import os
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Sequence, Tuple, Union
+
+from fastapi import HTTPException, Request
+
+from . import metrics
+
+
+def _reject(status: int, detail: str, reason: str, retry_after: Optional[float] = None) -> HTTPException:
+    metrics.inc("zgdg_ingest_rejected_total", reason=reason)
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after is not None else None
+    return HTTPException(status_code=status, detail=detail, headers=headers)
+
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_proxies(spec: str) -> List[Network]:
+    out: List[Network] = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            out.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            raise RuntimeError(f"ZGDG_TRUSTED_PROXIES: not an address or CIDR: {item!r}")
+    return out
+
+
+TRUSTED_PROXIES = parse_proxies(os.environ.get("ZGDG_TRUSTED_PROXIES") or "")
+
+
+def _trusted(addr: str, proxies: Sequence[Network]) -> bool:
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    return any(ip in net for net in proxies)
+
+
+def client_key(request: Request, proxies: Sequence[Network] = TRUSTED_PROXIES) -> str:
+    """Best-effort client address.
+
+    Headers count only when the socket peer is a trusted proxy. Each proxy
+    appends the address it received from to `X-Forwarded-For`, so walking the
+    hops from the right, the first one that isn't a trusted proxy is the
+    client; anything left of it is client-supplied and ignored.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if not _trusted(peer, proxies):
+        return peer
+    hops = [h.strip() for h in (request.headers.get("x-forwarded-for") or "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop, proxies):
+            return hop
+    if hops:
+        return hops[0]
+    real_ip = (request.headers.get("x-real-ip") or "").strip()
+    return real_ip or peer
+
+
+class TokenBucket:
+    """Per-key token bucket: `rate` tokens per second, at most `burst` banked."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, cost: float = 1.0) -> float:
+        """Consume `cost` tokens; returns 0 on success, else seconds until enough are available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            # Evict the least recently seen client; it starts over with a full bucket
+            self._buckets.popitem(last=False)
+        return wait
+
+    def check(self, key: str) -> None:
+        wait = self.take(key)
+        if wait > 0:
+            raise _reject(429, "请求过于频繁，请稍后重试", "rate_limited", wait)
+
+
+async def read_body_capped(request: Request, max_bytes: int) -> bytes:
+    """Read the request body, failing with 413 as soon as it exceeds `max_bytes`."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise _reject(413, f"请求体过大（最多 {max_bytes // 1024} KiB）", "too_large")
+    buf = bytearray()
+    async for chunk in request.stream():
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise _reject(413, f"请求体过大（最多 {max_bytes // 1024} KiB）", "too_large")
+    return bytes(buf)
+
+
+class _GateState:
+    def __init__(self, concurrency: int):
+        self.admitted = 0
+        self.running = asyncio.Semaphore(concurrency)
+
+
+class IngestGate:
+    def __init__(self, concurrency: int, queue: int, wait_seconds: float):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.wait_seconds = wait_seconds
+        self._states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _GateState]" = weakref.WeakKeyDictionary()
+
+    def _state(self) -> _GateState:
+        loop = asyncio.get_running_loop()
+        st = self._states.get(loop)
+        if st is None:
+            st = self._states[loop] = _GateState(self.concurrency)
+        return st
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Claim one of `concurrency + queue` seats, or fail fast with 503."""
+        st = self._state()
+        if st.admitted >= self.concurrency + self.queue:
+            raise _reject(503, "服务繁忙，请稍后重试", "queue_full", self.wait_seconds)
+        st.admitted += 1
+        try:
+            yield
+        finally:
+            st.admitted -= 1
+
+    @asynccontextmanager
+    async def work(self) -> AsyncIterator[None]:
+        """Wait (bounded) for one of the `concurrency` processing slots."""
+        st = self._state()
+        try:
+            await asyncio.wait_for(st.running.acquire(), timeout=self.wait_seconds)
+        except asyncio.TimeoutError:
+            raise _reject(503, "服务繁忙，请稍后重试", "queue_timeout", self.wait_seconds)
+        try:
+            yield
+        finally:
+            st.running.release()
+
+
+metrics.describe("zgdg_ingest_rejected_total", "counter", "Write requests rejected by admission control, by reason")
@@ -0,0 +1,403 @@
+"""Persistent background jobs for work too slow for a request.
+
+Jobs are rows in a SQLite database (`jobs.sqlite3` in `ZGDG_JOBS_DIR`) that
+every gunicorn worker shares. Each worker runs `ZGDG_JOBS_CONCURRENCY`
+runner threads. A runner claims the oldest due job in an immediate
+transaction, so exactly one process runs it, and holds it under a lease
+that its process renews. Jobs of a worker that died are queued again
+(or failed, after their last attempt) once the lease runs out.
+
+A handler gets a `JobContext` and the job's parameters and returns a JSON
+result. `progress()` publishes progress and, like `check()`, raises
+`JobCancelled` once cancellation was requested, so cancelling a running
+job is cooperative (a queued one is cancelled at once). Other exceptions
+are retried with exponential backoff up to the kind's `max_attempts`;
+`JobError` fails the job at once. Finished jobs and their files are
+deleted after `ZGDG_JOBS_RETENTION_HOURS`.
+"""
+from __future__ import annotations
+
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from . import codec, metrics
+
+ROOT = Path(__file__).resolve().parents[2]
+JOBS_DIR = Path(os.environ.get("ZGDG_JOBS_DIR") or ROOT / "server" / "uploads" / "jobs")
+# Runner threads per worker process
+CONCURRENCY = int(os.environ.get("ZGDG_JOBS_CONCURRENCY") or 1)
+POLL_SECONDS = float(os.environ.get("ZGDG_JOBS_POLL_SECONDS") or 2)
+RETENTION_SECONDS = float(os.environ.get("ZGDG_JOBS_RETENTION_HOURS") or 168) * 3600
+# A running job whose process stopped renewing its lease for this long is taken over
+LEASE_SECONDS = 60.0
+RETRY_BASE_SECONDS = 5.0
+# Progress of one job is written at most this often
+PROGRESS_SECONDS = 1.0
+
+STATES = ("queued", "running", "done", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    run_after REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, run_after);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobError(Exception):
+    """Permanent failure: the job is not retried."""
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts)) if ts is not None else None
+
+
+class JobKind:
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[["JobContext", Dict[str, Any]], Any],
+        max_attempts: int,
+        public: bool,
+        parse_params: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]],
+    ):
+        self.name = name
+        self.handler = handler
+        self.max_attempts = max_attempts
+        # Anyone may submit these; other kinds need the admin token
+        self.public = public
+        # Validates and normalizes submitted parameters (raising HTTPException), before anything is queued
+        self.parse_params = parse_params or (lambda params: params)
+
+
+class JobContext:
+    def __init__(self, queue: "JobQueue", job_id: str, kind: str):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self._written = 0.0
+
+    def check(self) -> None:
+        """Raise `JobCancelled` if cancellation was requested."""
+        if self.id in self.queue._cancelled:
+            raise JobCancelled()
+
+    def progress(self, state: Dict[str, Any], force: bool = False) -> None:
+        """Publish progress (e.g. `{"total": 10, "done": 3}`); also a cancellation point."""
+        self.check()
+        now = time.monotonic()
+        if force or now - self._written >= PROGRESS_SECONDS:
+            self._written = now
+            with self.queue._connect() as db:
+                db.execute("UPDATE jobs SET progress = ? WHERE id = ?", (codec.dumps(state).decode("utf-8"), self.id))
+                row = db.execute("SELECT cancel FROM jobs WHERE id = ?", (self.id,)).fetchone()
+            if row is not None and row[0]:
+                self.queue._cancelled.add(self.id)
+                raise JobCancelled()
+
+    def artifact_path(self, suffix: str) -> Path:
+        """Where the job writes a file for clients to download (see `JobQueue.artifact`)."""
+        return self.queue.artifact_dir / f"{self.id}{suffix}"
+
+
+class JobQueue:
+    def __init__(self, directory: Path = JOBS_DIR, concurrency: int = CONCURRENCY):
+        self.directory = Path(directory)
+        self.db_path = self.directory / "jobs.sqlite3"
+        self.artifact_dir = self.directory / "files"
+        self.concurrency = concurrency
+        self.kinds: Dict[str, JobKind] = {}
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._ready = False
+        self._init_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # Jobs this process runs, and those of them asked to stop (refreshed by the heartbeat)
+        self._running: Set[str] = set()
+        self._cancelled: Set[str] = set()
+        self._pruned = 0.0
+
+    def register(
+        self,
+        name: str,
+        handler: Callable[[JobContext, Dict[str, Any]], Any],
+        max_attempts: int = 3,
+        public: bool = False,
+        parse_params: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> None:
+        self.kinds[name] = JobKind(name, handler, max_attempts, public, parse_params)
+
+    # ---- storage ----
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    self.directory.mkdir(parents=True, exist_ok=True)
+                    db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+                    try:
+                        db.execute("PRAGMA journal_mode=WAL")
+                        db.executescript(_SCHEMA)
+                    finally:
+                        db.close()
+                    self._ready = True
+        # Autocommit: every statement is its own transaction unless one is opened explicitly
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        job_kind = self.kinds[kind]
+        job_id = secrets.token_urlsafe(12).replace("_", "-")
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, kind, params, state, max_attempts, created_at, run_after) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, codec.dumps(params).decode("utf-8"), job_kind.max_attempts, now, now),
+            )
+        metrics.inc("zgdg_jobs_submitted_total", kind=kind)
+        self._wake.set()
+        return self.get(job_id) or {}
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _public(row) if row is not None else None
+
+    def recent(self, state: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first."""
+        with self._connect() as db:
+            if state:
+                rows = db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY created_at DESC LIMIT ?", (state, limit)).fetchall()
+            else:
+                rows = db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [_public(r) for r in rows]
+
+    def count(self, state: str) -> int:
+        with self._connect() as db:
+            return int(db.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)).fetchone()[0])
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel a queued job now, or ask a running one to stop at its next progress update."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT kind, state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                db.execute("ROLLBACK")
+                return None
+            if row["state"] == "queued":
+                db.execute("UPDATE jobs SET state = 'cancelled', cancel = 1, finished_at = ? WHERE id = ?", (now, job_id))
+                metrics.inc("zgdg_jobs_finished_total", kind=row["kind"], state="cancelled")
+            elif row["state"] == "running":
+                db.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,))
+            db.execute("COMMIT")
+        if job_id in self._running:
+            self._cancelled.add(job_id)
+        return self.get(job_id)
+
+    def artifact(self, job: Dict[str, Any]) -> Optional[Path]:
+        """The file a finished job produced, if it still exists."""
+        name = (job.get("result") or {}).get("artifact") if isinstance(job.get("result"), dict) else None
+        if job.get("state") != "done" or not isinstance(name, str):
+            return None
+        path = self.artifact_dir / Path(name).name
+        return path if path.is_file() else None
+
+    # ---- running ----
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            # Jobs of a process that stopped renewing its lease: run again, or give up after the last attempt
+            db.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+                "error = 'worker lost', owner = NULL, "
+                "finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE ? END "
+                "WHERE state = 'running' AND lease_until < ?",
+                (now, now),
+            )
+            row = db.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' AND run_after <= ? ORDER BY run_after, created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, started_at = ?, lease_until = ?, owner = ? WHERE id = ?",
+                    (now, now + LEASE_SECONDS, self.owner, row["id"]),
+                )
+                self._running.add(row["id"])
+            db.execute("COMMIT")
+        return row
+
+    def _finish(self, job_id: str, state: str, result: Any = None, error: Optional[str] = None, retry_in: Optional[float] = None) -> None:
+        now = time.time()
+        with self._connect() as db:
+            if retry_in is not None:
+                db.execute(
+                    "UPDATE jobs SET state = 'queued', error = ?, run_after = ?, lease_until = NULL, owner = NULL WHERE id = ?",
+                    (error, now + retry_in, job_id),
+                )
+            else:
+                db.execute(
+                    "UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                    (state, codec.dumps(result).decode("utf-8") if result is not None else None, error, now, job_id),
+                )
+
+    def _run(self, row: sqlite3.Row) -> None:
+        job_id, kind = row["id"], row["kind"]
+        ctx = JobContext(self, job_id, kind)
+        job_kind = self.kinds.get(kind)
+        t0 = time.perf_counter()
+        try:
+            if job_kind is None:
+                raise JobError(f"unknown job kind {kind!r}")
+            ctx.check()
+            result = job_kind.handler(ctx, codec.loads(row["params"]))
+            self._finish(job_id, "done", result)
+            state = "done"
+        except JobCancelled:
+            self._finish(job_id, "cancelled")
+            state = "cancelled"
+        except JobError as e:
+            self._finish(job_id, "failed", error=str(e))
+            state = "failed"
+        except Exception:
+            error = traceback.format_exc(limit=3)
+            if row["attempts"] + 1 < row["max_attempts"]:
+                self._finish(job_id, "queued", error=error, retry_in=RETRY_BASE_SECONDS * 2 ** row["attempts"])
+                state = "retried"
+            else:
+                self._finish(job_id, "failed", error=error)
+                state = "failed"
+        finally:
+            self._running.discard(job_id)
+            self._cancelled.discard(job_id)
+        metrics.inc("zgdg_jobs_finished_total", kind=kind, state=state)
+        metrics.observe("zgdg_job_seconds", time.perf_counter() - t0, kind=kind)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self._run(row)
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(LEASE_SECONDS / 4):
+            try:
+                self._renew()
+                if time.monotonic() - self._pruned >= 3600:
+                    self._pruned = time.monotonic()
+                    self.prune()
+            except sqlite3.Error:
+                pass
+
+    def _renew(self) -> None:
+        running = list(self._running)
+        if not running:
+            return
+        marks = ",".join("?" * len(running))
+        with self._connect() as db:
+            db.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND state = 'running' AND id IN ({marks})",
+                (time.time() + LEASE_SECONDS, self.owner, *running),
+            )
+            rows = db.execute(f"SELECT id FROM jobs WHERE cancel = 1 AND id IN ({marks})", running).fetchall()
+        self._cancelled.update(r["id"] for r in rows)
+
+    def prune(self, older_than: float = RETENTION_SECONDS) -> int:
+        """Delete finished jobs (and their files) older than `older_than` seconds."""
+        cutoff = time.time() - older_than
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE state IN ('done', 'failed', 'cancelled') AND finished_at < ?", (cutoff,)
+            ).fetchall()
+            db.execute("DELETE FROM jobs WHERE state IN ('done', 'failed', 'cancelled') AND finished_at < ?", (cutoff,))
+        gone = {r["id"] for r in rows}
+        if self.artifact_dir.is_dir():
+            for path in self.artifact_dir.iterdir():
+                if path.name.split(".", 1)[0] in gone:
+                    path.unlink(missing_ok=True)
+        return len(gone)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if any(t.is_alive() for t in self._threads):
+            return
+        self._stop.clear()
+        # The pid changes across the gunicorn fork
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads = [threading.Thread(target=self._loop, name=f"zgdg-jobs-{i}", daemon=True) for i in range(max(1, self.concurrency))]
+        self._threads.append(threading.Thread(target=self._heartbeat, name="zgdg-jobs-heartbeat", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        # A job still running is left to its thread; if the process exits first, it is taken over after its lease
+        for t in self._threads:
+            t.join(timeout=timeout)
+
+
+def _public(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "state": row["state"],
+        "params": codec.loads(row["params"]),
+        "progress": codec.loads(row["progress"]) if row["progress"] else None,
+        "result": codec.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "attempts": row["attempts"],
+        "maxAttempts": row["max_attempts"],
+        "cancelRequested": bool(row["cancel"]),
+        "createdAt": _iso(row["created_at"]),
+        "startedAt": _iso(row["started_at"]),
+        "finishedAt": _iso(row["finished_at"]),
+    }
+
+
+metrics.describe("zgdg_jobs_submitted_total", "counter", "Background jobs submitted, by kind")
+metrics.describe("zgdg_jobs_finished_total", "counter", "Background job attempts ended, by kind and state (done/failed/cancelled/retried)")
+metrics.describe("zgdg_job_seconds", "histogram", "Time spent running one background job attempt")
@@ -0,0 +1,355 @@
+"""Process-local metrics with a file-backed multiprocess collector.
+
+Each worker keeps counters, gauges and histograms in memory and periodically
+writes a snapshot to `{METRICS_DIR}/{pid}.json`. Rendering merges the
+snapshots of all workers into Prometheus text format, so `/api/metrics`
+reports the same totals whichever gunicorn worker serves the scrape.
+
+When a worker exits its counters and histograms are folded into
+`exited.json` and its snapshot is deleted (`fold`, from gunicorn's
+`child_exit`; `sweep` catches the ones that hook missed). The directory
+stays at one file per live worker, and a new process that reuses the pid
+can't overwrite an old worker's totals.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX dev machines
+    fcntl = None  # type: ignore[assignment]
+
+METRICS_DIR = Path(os.environ.get("ZGDG_METRICS_DIR") or Path(tempfile.gettempdir()) / "zgdg-metrics")
+FLUSH_INTERVAL = float(os.environ.get("ZGDG_METRICS_FLUSH_SECONDS") or 5.0)
+EXITED_NAME = "exited.json"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# name -> (type, help, buckets)
+_registry: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+_counters: Dict[Tuple[str, LabelKey], float] = {}
+_gauges: Dict[Tuple[str, LabelKey], float] = {}
+_hists: Dict[Tuple[str, LabelKey], List[float]] = {}  # bucket counts..., sum, count
+_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def describe(name: str, mtype: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+    _registry[name] = (mtype, help_text, tuple(buckets))
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, LabelKey]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """Gauges are merged across workers by taking the maximum."""
+    with _lock:
+        _gauges[_key(name, labels)] = float(value)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    buckets = _registry.get(name, ("histogram", "", LATENCY_BUCKETS))[2]
+    k = _key(name, labels)
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = [0.0] * (len(buckets) + 2)
+        for i, b in enumerate(buckets):
+            if value <= b:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+@contextmanager
+def timer(name: str, **labels: Any) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+def reset() -> None:
+    """Forget everything recorded so far, e.g. what a forked worker inherited from its parent."""
+    global _last_flush
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _hists.clear()
+    _last_flush = 0.0
+
+
+# ---- multiprocess snapshot files ----
+
+
+def _snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "counters": [[n, dict(lk), v] for (n, lk), v in _counters.items()],
+            "gauges": [[n, dict(lk), v] for (n, lk), v in _gauges.items()],
+            "hists": [[n, dict(lk), list(h)] for (n, lk), h in _hists.items()],
+        }
+
+
+def _write(path: Path, snap: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(snap, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _read(path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        snap = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return snap if isinstance(snap, dict) else None
+
+
+def flush() -> None:
+    global _last_flush
+    _last_flush = time.monotonic()
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        _write(METRICS_DIR / f"{os.getpid()}.json", _snapshot())
+    except OSError:
+        pass
+
+
+def maybe_flush() -> None:
+    if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def _flush_at_exit() -> None:
+    # Only processes that have been serving (and thus flushing) leave a snapshot behind
+    if _last_flush:
+        flush()
+
+
+atexit.register(_flush_at_exit)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def _dir_locked() -> Iterator[None]:
+    """Exclusive access to `exited.json` across the master and the workers."""
+    if fcntl is None:
+        yield
+        return
+    with (METRICS_DIR / "exited.lock").open("a+b") as fh:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def _add(total: Dict[str, Any], snap: Dict[str, Any]) -> None:
+    """Add `snap`'s counters and histograms into `total`, both in snapshot form."""
+    counters = {_key(n, labels): v for n, labels, v in total.get("counters", [])}
+    hists = {_key(n, labels): h for n, labels, h in total.get("hists", [])}
+    for n, labels, v in snap.get("counters", []):
+        k = _key(n, labels)
+        counters[k] = counters.get(k, 0.0) + v
+    for n, labels, h in snap.get("hists", []):
+        k = _key(n, labels)
+        cur = hists.get(k)
+        hists[k] = list(h) if cur is None or len(cur) != len(h) else [a + b for a, b in zip(cur, h)]
+    total["counters"] = [[n, dict(lk), v] for (n, lk), v in counters.items()]
+    total["hists"] = [[n, dict(lk), h] for (n, lk), h in hists.items()]
+
+
+def fold(pid: int) -> None:
+    """Move an exited worker's counters and histograms into `exited.json` and delete its snapshot."""
+    path = METRICS_DIR / f"{pid}.json"
+    try:
+        with _dir_locked():
+            snap = _read(path)
+            if snap is not None:
+                total = _read(METRICS_DIR / EXITED_NAME) or {}
+                _add(total, snap)
+                _write(METRICS_DIR / EXITED_NAME, total)
+            path.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def sweep() -> None:
+    """Fold the snapshots of processes that are gone, e.g. workers killed before `child_exit` ran."""
+    for path in METRICS_DIR.glob("*.json"):
+        if not path.stem.isdigit():
+            continue
+        pid = int(path.stem)
+        # Our own pid with no flush yet: the file is from an earlier process that had this pid
+        if (pid == os.getpid() and not _last_flush) or not _pid_alive(pid):
+            fold(pid)
+
+
+def _merged() -> Tuple[Dict[Tuple[str, LabelKey], float], Dict[Tuple[str, LabelKey], float], Dict[Tuple[str, LabelKey], List[float]]]:
+    flush()
+    counters: Dict[Tuple[str, LabelKey], float] = {}
+    gauges: Dict[Tuple[str, LabelKey], float] = {}
+    hists: Dict[Tuple[str, LabelKey], List[float]] = {}
+    for path in METRICS_DIR.glob("*.json"):
+        snap = _read(path)
+        if snap is None:
+            continue
+        # Counters and histograms of exited workers (exited.json, or a snapshot not folded yet) still count; gauges don't
+        alive = path.stem.isdigit() and _pid_alive(int(path.stem))
+        for n, labels, v in snap.get("counters", []):
+            k = _key(n, labels)
+            counters[k] = counters.get(k, 0.0) + v
+        if alive:
+            for n, labels, v in snap.get("gauges", []):
+                k = _key(n, labels)
+                gauges[k] = max(gauges.get(k, v), v)
+        for n, labels, h in snap.get("hists", []):
+            k = _key(n, labels)
+            cur = hists.get(k)
+            if cur is None or len(cur) != len(h):
+                hists[k] = list(h)
+            else:
+                hists[k] = [a + b for a, b in zip(cur, h)]
+    return counters, gauges, hists
+
+
+# ---- Prometheus text format ----
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(lk: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(lk) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(int(v)) if float(v).is_integer() else repr(v)
+
+
+def render() -> str:
+    counters, gauges, hists = _merged()
+    by_name: Dict[str, List[str]] = {}
+
+    for (n, lk), v in sorted(counters.items()):
+        by_name.setdefault(n, []).append(f"{n}{_fmt_labels(lk)} {_fmt_value(v)}")
+    for (n, lk), v in sorted(gauges.items()):
+        by_name.setdefault(n, []).append(f"{n}{_fmt_labels(lk)} {_fmt_value(v)}")
+    for (n, lk), h in sorted(hists.items()):
+        buckets = _registry.get(n, ("histogram", "", LATENCY_BUCKETS))[2]
+        lines = by_name.setdefault(n, [])
+        for b, c in zip(buckets, h):
+            lines.append(f"{n}_bucket{_fmt_labels(lk, ('le', _fmt_value(b)))} {_fmt_value(c)}")
+        lines.append(f"{n}_bucket{_fmt_labels(lk, ('le', '+Inf'))} {_fmt_value(h[-1])}")
+        lines.append(f"{n}_sum{_fmt_labels(lk)} {_fmt_value(h[-2])}")
+        lines.append(f"{n}_count{_fmt_labels(lk)} {_fmt_value(h[-1])}")
+
+    out: List[str] = []
+    for n in sorted(by_name):
+        mtype, help_text, _ = _registry.get(n, ("untyped", "", ()))
+        if help_text:
+            out.append(f"# HELP {n} {help_text}")
+        out.append(f"# TYPE {n} {mtype}")
+        out.extend(by_name[n])
+    return "\n".join(out) + "\n"
+
+
+# ---- ASGI middleware ----
+
+
+class MetricsMiddleware:
+    """Records count, latency, request/response bytes and errors per route template."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        req_bytes = 0
+        resp_bytes = 0
+        status = 500
+
+        async def receive_wrapper() -> Dict[str, Any]:
+            nonlocal req_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                req_bytes += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status, resp_bytes
+            if message["type"] == "http.response.start":
+                status = int(message["status"])
+            elif message["type"] == "http.response.body":
+                resp_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so arbitrary URLs can't blow up cardinality
+            template = getattr(route, "path", None) or "<unmatched>"
+            method = scope.get("method", "")
+            elapsed = time.perf_counter() - t0
+            inc("zgdg_http_requests_total", method=method, route=template, status=status)
+            if status >= 500:
+                inc("zgdg_http_request_errors_total", method=method, route=template)
+            observe("zgdg_http_request_duration_seconds", elapsed, method=method, route=template)
+            observe("zgdg_http_request_size_bytes", req_bytes, method=method, route=template)
+            observe("zgdg_http_response_size_bytes", resp_bytes, method=method, route=template)
+            maybe_flush()
+
+
+describe("zgdg_http_requests_total", "counter", "HTTP requests by method, route template and status code")
+describe("zgdg_http_request_errors_total", "counter", "HTTP requests that failed with a 5xx status")
+describe("zgdg_http_request_duration_seconds", "histogram", "HTTP request latency in seconds")
+describe("zgdg_http_request_size_bytes", "histogram", "HTTP request body size in bytes", SIZE_BUCKETS)
+describe("zgdg_http_response_size_bytes", "histogram", "HTTP response body size in bytes", SIZE_BUCKETS)
+describe("zgdg_baseline_loads_total", "counter", "Baseline data files parsed from disk")
+describe("zgdg_baseline_load_seconds", "histogram", "Time spent reading and parsing a baseline file")
+describe("zgdg_share_index_load_seconds", "histogram", "Time spent loading the share index")
+describe("zgdg_share_migration_status", "gauge", "Share migration state: 1 done, 0 pending, -1 failed")
+describe("zgdg_share_migration_seconds", "gauge", "Duration of the last share migration run in seconds")
@@ -0,0 +1,214 @@
+"""Versioned, resumable background migrations.
+
+Each migration lists the keys (e.g. share IDs) it has to visit and applies a
+per-key step. Progress is checkpointed to `migrations.json` so a restarted
+worker resumes where the previous one stopped, and an `flock` on
+`migrations.lock` ensures only one gunicorn worker runs them; the others
+just wait for the recorded version to catch up. Worker startup never blocks
+on the size of the store.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX dev machines
+    fcntl = None  # type: ignore[assignment]
+
+from . import metrics
+
+CHECKPOINT_EVERY = 25
+CHECKPOINT_SECONDS = 2.0
+WAIT_POLL_SECONDS = 10.0
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    keys: Callable[[], List[str]]
+    step: Callable[[str], None]
+    # Recognizes stores migrated before versioning existed (e.g. a legacy flag file)
+    already_applied: Optional[Callable[[], bool]] = None
+
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class MigrationRunner:
+    def __init__(self, state_dir: Path, migrations: List[Migration]):
+        self.state_dir = Path(state_dir)
+        self.state_path = self.state_dir / "migrations.json"
+        self.lock_path = self.state_dir / "migrations.lock"
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def target_version(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    # ---- state file ----
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"version": 0, "history": []}
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_name(f".{self.state_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    def status(self) -> Dict[str, Any]:
+        state = self._load_state()
+        running = state.get("running")
+        version = int(state.get("version", 0))
+        if running:
+            phase = "running"
+        elif state.get("error"):
+            phase = "failed"
+        elif version >= self.target_version:
+            phase = "done"
+        else:
+            phase = "pending"
+        out: Dict[str, Any] = {
+            "state": phase,
+            "version": version,
+            "target": self.target_version,
+            "history": state.get("history", []),
+        }
+        if running:
+            out["running"] = {k: v for k, v in running.items() if k != "doneKeys"}
+        if state.get("error"):
+            out["error"] = state["error"]
+        metrics.set_gauge("zgdg_share_migration_status", {"done": 1, "failed": -1}.get(phase, 0))
+        return out
+
+    # ---- execution ----
+
+    def run_pending(self) -> None:
+        """Apply all pending migrations in this thread; caller must hold the run lock."""
+        state = self._load_state()
+        for mig in self.migrations:
+            if self._stop.is_set():
+                return
+            if int(state.get("version", 0)) >= mig.version:
+                continue
+            if mig.already_applied is not None and mig.already_applied():
+                state["version"] = mig.version
+                state.pop("running", None)
+                self._save_state(state)
+                continue
+            self._run_one(mig, state)
+            if int(state.get("version", 0)) < mig.version:
+                # Stopped or failed; later versions must wait
+                return
+
+    def _run_one(self, mig: Migration, state: Dict[str, Any]) -> None:
+        running = state.get("running")
+        if not running or running.get("version") != mig.version:
+            running = {"version": mig.version, "name": mig.name, "startedAt": _now_iso(), "doneKeys": [], "failed": 0}
+        running["pid"] = os.getpid()
+        state["running"] = running
+        state.pop("error", None)
+        done = set(running.get("doneKeys") or [])
+        t0 = time.perf_counter()
+        try:
+            keys = mig.keys()
+            running["total"] = len(keys)
+            running["done"] = len(done)
+            self._save_state(state)
+            last_ckpt = time.monotonic()
+            since_ckpt = 0
+            for key in keys:
+                if self._stop.is_set():
+                    break
+                if key in done:
+                    continue
+                try:
+                    mig.step(key)
+                except Exception:
+                    # Per-item failures are skipped, as the inline migration always did
+                    running["failed"] = int(running.get("failed", 0)) + 1
+                done.add(key)
+                running["doneKeys"].append(key)
+                running["done"] = len(done)
+                since_ckpt += 1
+                if since_ckpt >= CHECKPOINT_EVERY or time.monotonic() - last_ckpt >= CHECKPOINT_SECONDS:
+                    running["updatedAt"] = _now_iso()
+                    self._save_state(state)
+                    last_ckpt = time.monotonic()
+                    since_ckpt = 0
+            else:
+                state["version"] = mig.version
+                state.pop("running", None)
+                state.setdefault("history", []).append({
+                    "version": mig.version,
+                    "name": mig.name,
+                    "finishedAt": _now_iso(),
+                    "items": len(done),
+                    "failed": int(running.get("failed", 0)),
+                })
+                metrics.set_gauge("zgdg_share_migration_seconds", time.perf_counter() - t0)
+        except Exception:
+            state["error"] = traceback.format_exc(limit=3)
+        running["updatedAt"] = _now_iso()
+        self._save_state(state)
+
+    def run_locked(self, blocking: bool = True) -> bool:
+        """Run pending migrations under the cross-process lock.
+
+        Returns False without doing anything when another process holds the
+        lock and `blocking` is False.
+        """
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            self.run_pending()
+            return True
+        with self.lock_path.open("a+b") as fh:
+            flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(fh.fileno(), flags)
+            except BlockingIOError:
+                return False
+            try:
+                self.run_pending()
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            if int(self._load_state().get("version", 0)) >= self.target_version:
+                break
+            if self.run_locked(blocking=False):
+                if self._load_state().get("error"):
+                    break
+                continue
+            # Another worker is migrating; check again later in case it dies
+            self._stop.wait(WAIT_POLL_SECONDS)
+        self.status()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="zgdg-migrations", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
@@ -0,0 +1,358 @@
+"""On-demand request profiling.
+
+A request carrying `X-Profile: 1` and a valid `X-Admin-Token` runs under a
+sampling profiler. Sync handlers execute on threadpool threads, so instead of
+cProfile (which only sees the calling thread) a sampler thread periodically
+captures the stacks of the threads running that request: the event loop
+thread while one of the request's tasks is running on it, and worker threads
+while they run work the request handed them through `call`/`bind` (sync
+endpoints via `Route`, `ShareStore.run`, the validation thread pool).
+Concurrent requests, background workers and worker processes stay out of the
+profile.
+
+The middleware is only installed when an admin token is configured, so there
+is no overhead at all when profiling is off. Stored profiles are bounded in
+number (`ZGDG_PROFILE_MAX_COUNT`) and size (`ZGDG_PROFILE_MAX_BYTES`).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, TypeVar
+
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+from . import admin
+
+ROOT = Path(__file__).resolve().parents[2]
+SERVER_DIR = str(ROOT / "server")
+PROFILE_DIR = Path(os.environ.get("ZGDG_PROFILE_DIR") or ROOT / "server" / "uploads" / "profiles")
+MAX_PROFILES = int(os.environ.get("ZGDG_PROFILE_MAX_COUNT") or 50)
+MAX_PROFILE_BYTES = int(os.environ.get("ZGDG_PROFILE_MAX_BYTES") or 1024 * 1024)
+SAMPLE_INTERVAL = float(os.environ.get("ZGDG_PROFILE_INTERVAL_MS") or 2.0) / 1000.0
+MAX_SAMPLES = 20000
+MAX_DEPTH = 96
+PROFILE_HEADER = "x-profile"
+
+T = TypeVar("T")
+
+
+class Sampler(threading.Thread):
+    """Collects folded stacks (`outer;...;inner` -> count) of the threads running one request."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, max_samples: int = MAX_SAMPLES):
+        super().__init__(name="zgdg-profiler", daemon=True)
+        self.interval = interval
+        self.max_samples = max_samples
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        # Names of every thread that ran part of the request, for the profile's metadata
+        self.thread_names: Set[str] = set()
+        self._stop_evt = threading.Event()
+        self._lock = threading.Lock()
+        # Worker thread ident -> nesting depth of the request's calls running on it
+        self._attached: Dict[int, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._prev_factory: Any = None
+
+    def watch(self, task: asyncio.Task) -> None:
+        """Sample the event loop thread while `task`, or a task created in its context, is running."""
+        loop = task.get_loop()
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self.thread_names.add(threading.current_thread().name)
+        self._tasks.add(task)
+        # Subtasks (e.g. a streaming body's sender) copy the creator's context, so _active tells whose they are
+        self._prev_factory = loop.get_task_factory()
+        loop.set_task_factory(self._task_factory)
+
+    def unwatch(self) -> None:
+        if self._loop is not None:
+            self._loop.set_task_factory(self._prev_factory)
+            self._loop = None
+        self._tasks.clear()
+
+    def _task_factory(self, loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any) -> asyncio.Future:
+        if self._prev_factory is not None:
+            task = self._prev_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        ctx = kwargs.get("context")
+        if (ctx.get(_active) if ctx is not None else _active.get()) is self:
+            self._tasks.add(task)
+        return task
+
+    @contextmanager
+    def attached(self) -> Iterator[None]:
+        """Sample the calling thread until the block exits."""
+        tid = threading.get_ident()
+        with self._lock:
+            self._attached[tid] = self._attached.get(tid, 0) + 1
+            self.thread_names.add(threading.current_thread().name)
+        try:
+            yield
+        finally:
+            with self._lock:
+                depth = self._attached.pop(tid) - 1
+                if depth:
+                    self._attached[tid] = depth
+
+    def run(self) -> None:
+        while not self._stop_evt.wait(self.interval) and self.samples < self.max_samples:
+            frames = sys._current_frames()
+            with self._lock:
+                tids = set(self._attached)
+            loop = self._loop
+            if loop is not None and asyncio.current_task(loop) in self._tasks:
+                tids.add(self._loop_thread)
+            for tid in tids:
+                frame = frames.get(tid)
+                names: List[str] = []
+                f: Any = frame
+                while f is not None and len(names) < MAX_DEPTH:
+                    code = f.f_code
+                    names.append(f"{code.co_name} ({_short(code.co_filename)}:{code.co_firstlineno})")
+                    f = f.f_back
+                if names:
+                    self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+        self.join(timeout=1.0)
+
+
+# The sampler of the request being profiled, in that request's context (and the tasks and threads it carries into)
+_active: contextvars.ContextVar[Optional[Sampler]] = contextvars.ContextVar("zgdg_profile_sampler", default=None)
+
+
+def _run_attached(sampler: Sampler, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    with sampler.attached():
+        return fn(*args, **kwargs)
+
+
+def bind(fn: Callable[..., T]) -> Callable[..., T]:
+    """`fn`, sampled wherever it runs if the calling context is a profiled request.
+
+    For executors that don't carry context variables into their threads.
+    """
+    sampler = _active.get()
+    return fn if sampler is None else functools.partial(_run_attached, sampler, fn)
+
+
+def call(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run `fn` on this thread, sampled if the current context is a profiled request."""
+    return bind(fn)(*args, **kwargs)
+
+
+class Route(APIRoute):
+    """Runs sync endpoints through `call`, so the threadpool thread they land on is sampled."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _sampled(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _sampled(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    # functools.wraps keeps the signature FastAPI reads parameters from
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return call(endpoint, *args, **kwargs)
+
+    return wrapper
+
+
+def _short(filename: str) -> str:
+    if filename.startswith(SERVER_DIR):
+        return filename[len(SERVER_DIR) + 1:]
+    parts = filename.replace("\\", "/").rsplit("/", 2)
+    return "/".join(parts[-2:])
+
+
+def _top_functions(stacks: Counter, limit: int = 40) -> List[Dict[str, Any]]:
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, n in stacks.items():
+        frames = stack.split(";")
+        self_counts[frames[-1]] += n
+        for fr in set(frames):
+            total_counts[fr] += n
+    return [
+        {"function": fn, "total": total_counts[fn], "self": self_counts.get(fn, 0)}
+        for fn, _ in total_counts.most_common(limit)
+    ]
+
+
+# ---- storage ----
+
+
+def _new_id() -> str:
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime()) + "-" + secrets.token_hex(3)
+
+
+def _save(name: str, meta: Dict[str, Any], stacks: Counter) -> None:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    meta = dict(meta, id=name, top=_top_functions(stacks))
+    # Keep the heaviest stacks that fit within the size budget
+    kept: Dict[str, int] = {}
+    budget = MAX_PROFILE_BYTES - len(json.dumps(meta, ensure_ascii=False).encode("utf-8")) - 64
+    for stack, n in stacks.most_common():
+        cost = len(stack.encode("utf-8")) + 16
+        if cost > budget:
+            meta["truncated"] = True
+            break
+        kept[stack] = n
+        budget -= cost
+    (PROFILE_DIR / f"{name}.json").write_text(json.dumps({"meta": meta, "stacks": kept}, ensure_ascii=False), encoding="utf-8")
+    _prune()
+
+
+def _prune() -> None:
+    files = sorted(PROFILE_DIR.glob("*.json"))
+    for p in files[:-MAX_PROFILES] if len(files) > MAX_PROFILES else []:
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    if not PROFILE_DIR.exists():
+        return out
+    for p in sorted(PROFILE_DIR.glob("*.json"), reverse=True):
+        try:
+            meta = json.loads(p.read_text(encoding="utf-8")).get("meta") or {}
+        except (OSError, ValueError):
+            continue
+        meta.pop("top", None)
+        meta["bytes"] = p.stat().st_size
+        out.append(meta)
+    return out
+
+
+def load_profile(name: str) -> Optional[Dict[str, Any]]:
+    path = PROFILE_DIR / f"{name}.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def folded(profile: Dict[str, Any]) -> str:
+    """Brendan Gregg folded-stack format, consumable by flamegraph tools and speedscope."""
+    return "".join(f"{stack} {n}\n" for stack, n in (profile.get("stacks") or {}).items())
+
+
+# ---- ASGI middleware ----
+
+
+class ProfilingMiddleware:
+    """Profiles requests that opt in with `X-Profile: 1` plus a valid admin token.
+
+    Only one request per worker is profiled at a time; concurrent opt-ins run
+    normally and get `X-Profile: busy` back.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        flag = headers.get(PROFILE_HEADER.encode("latin-1"))
+        if flag not in (b"1", b"true") or not admin.is_admin_token(headers.get(admin.ADMIN_HEADER.encode("latin-1"), b"").decode("latin-1")):
+            await self.app(scope, receive, send)
+            return
+        if not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, _with_header(send, b"busy"))
+            return
+        try:
+            await self._profile(scope, receive, send)
+        finally:
+            self._busy.release()
+
+    async def _profile(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        req_bytes = 0
+        resp_bytes = 0
+        status = 500
+        first_byte: Optional[float] = None
+        name = _new_id()
+
+        async def receive_wrapper() -> Dict[str, Any]:
+            nonlocal req_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                req_bytes += len(message.get("body", b""))
+            return message
+
+        sampler = Sampler()
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status, resp_bytes, first_byte
+            if message["type"] == "http.response.start":
+                status = int(message["status"])
+                first_byte = time.perf_counter() - t0
+                message = dict(message, headers=list(message.get("headers") or []) + [(b"x-profile-id", name.encode("latin-1"))])
+            elif message["type"] == "http.response.body":
+                resp_bytes += len(message.get("body", b""))
+            await send(message)
+
+        sampler.watch(asyncio.current_task())
+        token = _active.set(sampler)
+        sampler.start()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            sampler.stop()
+            sampler.unwatch()
+            _active.reset(token)
+            total = time.perf_counter() - t0
+            route = scope.get("route")
+            meta = {
+                "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "method": scope.get("method", ""),
+                "route": getattr(route, "path", None) or "<unmatched>",
+                "path": scope.get("path", ""),
+                "query": (scope.get("query_string") or b"").decode("latin-1"),
+                "status": status,
+                "requestBytes": req_bytes,
+                "responseBytes": resp_bytes,
+                "durationMs": round(total * 1000.0, 3),
+                "firstByteMs": round(first_byte * 1000.0, 3) if first_byte is not None else None,
+                "samples": sampler.samples,
+                "intervalMs": sampler.interval * 1000.0,
+                "pid": os.getpid(),
+                "threads": sorted(sampler.thread_names),
+            }
+            try:
+                # Serializing, writing and pruning are file work; keep them off the event loop
+                await run_in_threadpool(_save, name, meta, sampler.stacks)
+            except OSError:
+                pass
+
+
+def _with_header(send: Any, value: bytes) -> Any:
+    async def wrapped(message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            message = dict(message, headers=list(message.get("headers") or []) + [(b"x-profile", value)])
+        await send(message)
+
+    return wrapped
@@ -0,0 +1,271 @@
+"""Rebase stored patches onto the current baselines.
+
+A patch records, for every updated field, the value it started from
+(`from`) and the value it sets (`to`). Together with the current baseline
+that is a field-level three-way merge:
+
+- upstream still has `from` -> the change applies cleanly (`from` is rewritten);
+- upstream already has `to` -> the change is dropped as redundant;
+- anything else -> a true conflict, kept unchanged and reported.
+
+Adds and deletes are reconciled by ID. When the patch's original baseline
+is in the archive (`baseline.archived`), deletes of entities that upstream
+has since modified are reported as conflicts as well.
+
+`rebase_package` works on a whole share payload; `run_batch` rebases many
+shares in a process pool, writing results to the store's rebased cache.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from . import baseline, codec, metrics
+from .share_store import ShareStore
+
+
+def _same(a: Any, b: Any) -> bool:
+    if a is b:
+        return True
+    # `==` alone conflates 1, 1.0 and True; canonical JSON does not
+    return a == b and codec.canonical(a) == codec.canonical(b)
+
+
+def _current(kind: str) -> Optional[baseline.Baseline]:
+    try:
+        return baseline.get(kind)
+    except HTTPException:
+        return None
+
+
+def rebase_patch(kind: str, patch: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Rebase one kind's patch onto the current baseline; returns (patch, report)."""
+    meta = patch.get("meta") if isinstance(patch.get("meta"), dict) else {}
+    old_sha = meta.get("baseSha256")
+    cur = _current(kind)
+    report: Dict[str, Any] = {"kind": kind, "from": old_sha, "conflicts": [], "dropped": 0}
+    if cur is None or old_sha == cur.sha256:
+        report["to"] = old_sha
+        report["upToDate"] = True
+        return patch, report
+
+    theirs = cur.entities()
+    old = baseline.archived(kind, old_sha)
+    old_entities = old.entities() if old is not None else None
+    chg = patch.get("changes") or {}
+    conflicts: List[Dict[str, Any]] = report["conflicts"]
+    adds: List[Dict[str, Any]] = []
+    updates: List[Dict[str, Any]] = []
+    deletes: List[Dict[str, Any]] = []
+    dropped = 0
+
+    for a in chg.get("adds") or []:
+        eid = a.get("id") if isinstance(a, dict) else None
+        upstream = theirs.get(eid) if isinstance(eid, str) else None
+        if upstream is None:
+            adds.append(a)
+        elif _same(upstream, a.get("data")):
+            dropped += 1
+        else:
+            # Both sides created this ID with different contents
+            conflicts.append({"id": eid, "type": "add_exists"})
+            adds.append(a)
+
+    for u in chg.get("updates") or []:
+        eid = u.get("id") if isinstance(u, dict) else None
+        fields = u.get("fields") if isinstance(u, dict) else None
+        if not isinstance(eid, str) or not isinstance(fields, dict):
+            updates.append(u)
+            continue
+        upstream = theirs.get(eid)
+        if upstream is None:
+            conflicts.append({"id": eid, "type": "update_deleted"})
+            updates.append(u)
+            continue
+        merged: Dict[str, Any] = {}
+        for key, ft in fields.items():
+            if not isinstance(ft, dict) or "to" not in ft:
+                merged[key] = ft
+                continue
+            current = upstream.get(key)
+            if _same(current, ft["to"]):
+                dropped += 1
+            elif "from" not in ft or _same(current, ft.get("from")):
+                merged[key] = {"from": current, "to": ft["to"]}
+            else:
+                conflicts.append({"id": eid, "field": key, "type": "conflict", "base": ft.get("from"), "theirs": current, "ours": ft["to"]})
+                merged[key] = ft
+        if merged:
+            updates.append({**u, "fields": merged})
+
+    for d in chg.get("deletes") or []:
+        eid = d.get("id") if isinstance(d, dict) else None
+        if isinstance(eid, str) and eid not in theirs:
+            dropped += 1
+            continue
+        if old_entities is not None and isinstance(eid, str) and eid in old_entities and not _same(old_entities[eid], theirs[eid]):
+            conflicts.append({"id": eid, "type": "delete_modified"})
+        deletes.append(d)
+
+    report["to"] = cur.sha256
+    report["dropped"] = dropped
+    report["baseKnown"] = old is not None
+    report["upToDate"] = False
+    new_meta = {**meta, "baseSha256": cur.sha256, "rebasedFrom": old_sha}
+    return {**patch, "meta": new_meta, "changes": {"adds": adds, "updates": updates, "deletes": deletes}}, report
+
+
+def patches_of(pkg: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """`(kind, patch)` pairs of a share payload; empty for data-mode payloads."""
+    meta = pkg.get("meta") or {}
+    raw = pkg.get("patches")
+    if not isinstance(raw, list):
+        raw = [pkg["patch"]] if isinstance(pkg.get("patch"), dict) else []
+    out: List[Tuple[str, Dict[str, Any]]] = []
+    for p in raw:
+        if not isinstance(p, dict):
+            continue
+        kind = (p.get("meta") or {}).get("kind") if isinstance(p.get("meta"), dict) else None
+        if not isinstance(kind, str) and len(meta.get("kinds") or []) == 1:
+            kind = meta["kinds"][0]
+        if isinstance(kind, str):
+            out.append((kind.lower(), p))
+    return out
+
+
+def base_key(kinds: Iterable[str]) -> str:
+    """Identifies the current baseline versions of `kinds`; rebased results are cached under it."""
+    parts = []
+    for kind in sorted(set(kinds)):
+        cur = _current(kind)
+        parts.append(f"{kind}:{cur.sha256 if cur else '-'}")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def is_current(base_shas: Dict[str, Optional[str]]) -> bool:
+    """Whether every `kind -> baseSha256` pair matches the current baseline."""
+    for kind, sha in base_shas.items():
+        cur = _current(kind)
+        if cur is not None and cur.sha256 != sha:
+            return False
+    return True
+
+
+def rebase_package(pkg: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Rebase every patch in a share payload; data-mode payloads come back unchanged."""
+    reports: List[Dict[str, Any]] = []
+    rebased: List[Dict[str, Any]] = []
+    for kind, p in patches_of(pkg):
+        new_p, rep = rebase_patch(kind, p)
+        rebased.append(new_p)
+        reports.append(rep)
+    summary = {
+        "upToDate": all(r["upToDate"] for r in reports),
+        "conflicts": sum(len(r["conflicts"]) for r in reports),
+        "kinds": reports,
+    }
+    if summary["upToDate"]:
+        return pkg, summary
+    out = dict(pkg)
+    out["meta"] = {**(pkg.get("meta") or {}), "rebase": summary}
+    if isinstance(pkg.get("patches"), list):
+        out["patches"] = rebased
+    else:
+        out["patch"] = rebased[0]
+    return out, summary
+
+
+def rebase_share(store: ShareStore, share_id: str) -> Optional[Tuple[bytes, Any, Dict[str, Any]]]:
+    """Rebased payload of a share, from the cache or computed and cached.
+
+    Returns (stored bytes, compression, report), or None when the share is
+    missing or already based on the current baselines. The report is empty
+    for cache hits.
+    """
+    pkg = store.read_payload(share_id)
+    if not isinstance(pkg, dict):
+        return None
+    patches = patches_of(pkg)
+    key = base_key(kind for kind, _ in patches)
+    hit = store.read_rebased_raw(share_id, key)
+    if hit is not None:
+        metrics.inc("zgdg_share_rebase_total", result="cached")
+        return hit[0], hit[1], {}
+    with metrics.timer("zgdg_share_rebase_seconds"):
+        out, report = rebase_package(pkg)
+    if report["upToDate"]:
+        return None
+    stored, comp = store.write_rebased(share_id, key, codec.dumps(out))
+    metrics.inc("zgdg_share_rebase_total", result="conflicts" if report["conflicts"] else "clean")
+    return stored, comp, report
+
+
+# ---- batch ----
+
+_child_store: Optional[ShareStore] = None
+
+
+def _child_init(store_root: str, data_dir: str, archive_dir: str) -> None:
+    global _child_store
+    baseline.DATA_DIR = Path(data_dir)
+    baseline.ARCHIVE_DIR = Path(archive_dir)
+    _child_store = ShareStore(Path(store_root))
+
+
+def _child_rebase(share_id: str) -> Tuple[str, str, int]:
+    assert _child_store is not None
+    try:
+        res = rebase_share(_child_store, share_id)
+    except Exception:
+        return share_id, "failed", 0
+    if res is None:
+        return share_id, "current", 0
+    report = res[2]
+    if not report:
+        return share_id, "cached", 0
+    return share_id, "rebased", int(report.get("conflicts") or 0)
+
+
+def run_batch(
+    store: ShareStore,
+    share_ids: List[str],
+    workers: int,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Rebase `share_ids` in `workers` processes; returns counts. `progress` gets periodic snapshots."""
+    state: Dict[str, Any] = {"total": len(share_ids), "done": 0, "rebased": 0, "cached": 0, "current": 0, "failed": 0, "conflicts": 0}
+    if not share_ids:
+        return state
+    t0 = time.perf_counter()
+    last = time.monotonic()
+    # spawn: forking a threaded server process can inherit held locks
+    ctx = get_context("spawn")
+    init_args = (str(store.root), str(baseline.DATA_DIR), str(baseline.ARCHIVE_DIR))
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx, initializer=_child_init, initargs=init_args) as pool:
+        try:
+            for _, status, conflicts in pool.map(_child_rebase, share_ids, chunksize=max(1, len(share_ids) // (workers * 8) or 1)):
+                state["done"] += 1
+                state[status] += 1
+                state["conflicts"] += conflicts
+                if progress is not None and time.monotonic() - last >= 2.0:
+                    progress(dict(state))
+                    last = time.monotonic()
+        except BaseException:
+            # E.g. `progress` cancelled the batch: drop the shares not started yet instead of waiting for them
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+    state["seconds"] = round(time.perf_counter() - t0, 3)
+    return state
+
+
+DEFAULT_WORKERS = int(os.environ.get("ZGDG_REBASE_WORKERS") or min(4, os.cpu_count() or 1))
+
+metrics.describe("zgdg_share_rebase_total", "counter", "Rebased share payloads served or built, by result (cached/clean/conflicts)")
+metrics.describe("zgdg_share_rebase_seconds", "histogram", "Time spent rebasing one share payload")
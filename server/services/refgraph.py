@@ -0,0 +1,317 @@
+"""Cross-entity reference graph parsed from effect strings.
+
+Effect strings point at other entities in three ways:
+
+- by ID: `ID'Is'Animals-9`, `ID;Is;Neutral-1`, `MapEventTurn(Bingo-1;false)`;
+- by name: `BagIn(粑粑;1)`, `HandIn(...)`, `AddPendant(冰箱)`, `Transfer(...;金青蛙雕像)`;
+- by group: `Category;Is;Spell`, `Type'Is'Plant`, `Combo'Is'Animals`.
+
+Each of these is a *target*. Every entity *provides* the targets that
+resolve to it (its ID, its name, its group values) and *refers* to the
+targets found in its own effect strings. Impact follows ID and name
+references transitively; group references only count where a patch changes
+group membership.
+
+The graph is built once per set of baseline versions; `with_patch` overlays
+a patch on it without copying, so `impact` only touches the entities a patch
+reaches.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, MutableMapping, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from . import baseline, metrics
+from .cache import LRUCache
+
+Node = Tuple[str, str]  # (kind, ID)
+Target = Tuple[str, ...]  # ("id", ID) | ("name", group, Name) | ("field", Field, value)
+
+_EMPTY: FrozenSet[Any] = frozenset()
+
+_ID_REF = re.compile(r"\bID['; ]*Is['; ]*([A-Za-z0-9][\w\-]*)")
+_EVENT_REF = re.compile(r"\bMapEventTurn\(\s*([\w\-]+)")
+_FIELD_REF = re.compile(r"\b(Category|Type|Combo)['; ]*Is['; ]*([A-Za-z0-9][\w\-]*)")
+_NAME_REF = re.compile(r"\b(BagIn|HandIn|CreateItemAround|RandomForcePlace|AddPendant)\(\s*([^;()\[\]]+?)\s*[;)]")
+_TRANSFER_REF = re.compile(r"\bTransfer\([^;]*;\s*([^;()\[\]]+?)\s*\)")
+
+# Fields whose values feed effect parsing, and fields that decide what an entity resolves as
+EFFECT_FIELDS = frozenset({"EffectString", "TemplateEffectString", "Choices"})
+PROVIDE_FIELDS = frozenset({"Name", "Category", "Type", "Combo"})
+# Group filters select cards
+GROUP_KINDS = frozenset({"card"})
+
+
+def _name_group(kind: str) -> Optional[str]:
+    if kind == "card":
+        return "card"
+    if kind in {"pendant", "disaster"}:
+        return "pendant"
+    return None
+
+
+def _effect_strings(kind: str, entity: Dict[str, Any]) -> Iterable[str]:
+    if kind == "mapevent":
+        for ch in entity.get("Choices") or []:
+            if isinstance(ch, dict) and isinstance(ch.get("Effect"), str):
+                yield ch["Effect"]
+        return
+    for key in ("EffectString", "TemplateEffectString"):
+        s = entity.get(key)
+        if isinstance(s, str) and s:
+            yield s
+
+
+def refers_to(kind: str, entity: Dict[str, Any]) -> FrozenSet[Target]:
+    out: Set[Target] = set()
+    for s in _effect_strings(kind, entity):
+        out.update(("id", m) for m in _ID_REF.findall(s))
+        out.update(("id", m) for m in _EVENT_REF.findall(s))
+        out.update(("field", f, v) for f, v in _FIELD_REF.findall(s))
+        for fn, name in _NAME_REF.findall(s):
+            out.add(("name", "pendant" if fn == "AddPendant" else "card", name))
+        out.update(("name", "card", name) for name in _TRANSFER_REF.findall(s))
+    eid = entity.get("ID")
+    out.discard(("id", eid))
+    return frozenset(out)
+
+
+def provides(kind: str, entity: Dict[str, Any]) -> FrozenSet[Target]:
+    out: Set[Target] = {("id", entity["ID"])}
+    group = _name_group(kind)
+    if group is not None and isinstance(entity.get("Name"), str) and entity["Name"]:
+        out.add(("name", group, entity["Name"]))
+    if kind in GROUP_KINDS:
+        for f in ("Category", "Type", "Combo"):
+            v = entity.get(f)
+            if isinstance(v, str) and v:
+                out.add(("field", f, v))
+    return frozenset(out)
+
+
+def target_label(t: Target) -> str:
+    return ":".join(t)
+
+
+def _link(index: MutableMapping[Target, FrozenSet[Node]], targets: Iterable[Target], node: Node, add: bool) -> None:
+    for t in targets:
+        cur = index.get(t, _EMPTY)
+        index[t] = cur | {node} if add else cur - {node}
+
+
+_MISSING = object()
+
+
+class _Overlay(dict):  # type: ignore[type-arg]
+    """Writes land here; reads fall through to `base` (cheaper than ChainMap on the hot path)."""
+
+    __slots__ = ("base",)
+
+    def __init__(self, base: Mapping[Any, Any]):
+        super().__init__()
+        self.base = base
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        v = dict.get(self, key, _MISSING)
+        return self.base.get(key, default) if v is _MISSING else v
+
+
+class RefGraph:
+    __slots__ = ("key", "entities", "refs", "referrers", "provided", "providers")
+
+    def __init__(
+        self,
+        key: Tuple[Tuple[str, str], ...],
+        entities: Mapping[Node, Optional[Dict[str, Any]]],
+        refs: Mapping[Node, FrozenSet[Target]],
+        referrers: Mapping[Target, FrozenSet[Node]],
+        provided: Mapping[Node, FrozenSet[Target]],
+        providers: Mapping[Target, FrozenSet[Node]],
+    ):
+        self.key = key
+        # None marks an entity deleted by an overlaid patch
+        self.entities = entities
+        self.refs = refs
+        self.referrers = referrers
+        self.provided = provided
+        self.providers = providers
+
+    @classmethod
+    def build(cls, key: Tuple[Tuple[str, str], ...], baselines: Iterable[baseline.Baseline]) -> "RefGraph":
+        entities: Dict[Node, Optional[Dict[str, Any]]] = {}
+        refs: Dict[Node, FrozenSet[Target]] = {}
+        provided: Dict[Node, FrozenSet[Target]] = {}
+        referrers: Dict[Target, Set[Node]] = {}
+        providers: Dict[Target, Set[Node]] = {}
+        for b in baselines:
+            for eid, ent in b.entities().items():
+                node = (b.kind, eid)
+                entities[node] = ent
+                refs[node] = r = refers_to(b.kind, ent)
+                provided[node] = p = provides(b.kind, ent)
+                for t in r:
+                    referrers.setdefault(t, set()).add(node)
+                for t in p:
+                    providers.setdefault(t, set()).add(node)
+        return cls(
+            key,
+            entities,
+            refs,
+            {t: frozenset(v) for t, v in referrers.items()},
+            provided,
+            {t: frozenset(v) for t, v in providers.items()},
+        )
+
+    def with_patch(self, kind: str, patch: Dict[str, Any]) -> Tuple["RefGraph", Dict[Node, str]]:
+        """Overlay one kind's patch; returns (patched graph, changed node -> op).
+
+        Only the entries the patch touches are written, into maps layered over
+        this graph's, so the cost is proportional to the patch size.
+        """
+        entities = _Overlay(self.entities)
+        refs = _Overlay(self.refs)
+        referrers = _Overlay(self.referrers)
+        provided = _Overlay(self.provided)
+        providers = _Overlay(self.providers)
+        changed: Dict[Node, str] = {}
+
+        def put(node: Node, ent: Optional[Dict[str, Any]], reindex: bool) -> None:
+            entities[node] = ent
+            if not reindex:
+                return
+            _link(referrers, refs.get(node, _EMPTY), node, add=False)
+            _link(providers, provided.get(node, _EMPTY), node, add=False)
+            refs[node] = r = refers_to(kind, ent) if ent is not None else _EMPTY
+            provided[node] = p = provides(kind, ent) if ent is not None else _EMPTY
+            _link(referrers, r, node, add=True)
+            _link(providers, p, node, add=True)
+
+        chg = (patch or {}).get("changes") or patch or {}
+        for d in chg.get("deletes") or []:
+            eid = d.get("id") if isinstance(d, dict) else None
+            if isinstance(eid, str) and entities.get((kind, eid)) is not None:
+                put((kind, eid), None, reindex=True)
+                changed[(kind, eid)] = "delete"
+        for a in chg.get("adds") or []:
+            eid = a.get("id") if isinstance(a, dict) else None
+            data = a.get("data") if isinstance(a, dict) else None
+            if isinstance(eid, str) and isinstance(data, dict):
+                put((kind, eid), {**data, "ID": eid}, reindex=True)
+                changed[(kind, eid)] = "add"
+        for u in chg.get("updates") or []:
+            eid = u.get("id") if isinstance(u, dict) else None
+            fields = u.get("fields") if isinstance(u, dict) else None
+            if not isinstance(eid, str) or not isinstance(fields, dict):
+                continue
+            node = (kind, eid)
+            old = entities.get(node)
+            if old is None:
+                continue
+            new = dict(old)
+            for key, ft in fields.items():
+                if isinstance(ft, dict) and "to" in ft and key != "ID":
+                    new[key] = ft["to"]
+            put(node, new, reindex=not (EFFECT_FIELDS.isdisjoint(fields) and PROVIDE_FIELDS.isdisjoint(fields)))
+            changed[node] = "update"
+
+        return RefGraph(self.key, entities, refs, referrers, provided, providers), changed
+
+    def impact(self, base: "RefGraph", changed: Dict[Node, str], max_depth: Optional[int] = None) -> Dict[str, Any]:
+        """Entities affected, directly or transitively, by `changed` nodes of this (patched) graph.
+
+        `base` is the graph before the patch; targets a changed entity used to
+        provide count as touched too, so renames and deletes reach their old
+        referrers.
+        """
+        seen: Dict[Node, Tuple[int, Node]] = {}
+        frontier: List[Node] = list(changed)
+        depth = 0
+        touched: Dict[Node, FrozenSet[Target]] = {}
+        for node in changed:
+            before = base.provided.get(node, _EMPTY)
+            after = self.provided.get(node, _EMPTY)
+            # Group referrers care about membership, not about what members do
+            touched[node] = frozenset(t for t in before | after if t[0] != "field") | (before ^ after)
+
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            nxt: List[Node] = []
+            for src in frontier:
+                targets = touched.get(src)
+                if targets is None:
+                    targets = frozenset(t for t in self.provided.get(src, _EMPTY) if t[0] != "field")
+                for t in targets:
+                    for ref in self.referrers.get(t, _EMPTY):
+                        if ref in changed or ref in seen:
+                            continue
+                        seen[ref] = (depth, src)
+                        nxt.append(ref)
+            frontier = nxt
+
+        # References that resolved before the patch and no longer do
+        broken: List[Dict[str, Any]] = []
+        for t in sorted(frozenset().union(*touched.values())):
+            if self.providers.get(t) or not base.providers.get(t):
+                continue
+            for ref in sorted(self.referrers.get(t, _EMPTY)):
+                broken.append({**self._describe(ref), "target": target_label(t)})
+
+        impacted = [
+            {**self._describe(node), "depth": d, "via": {"kind": via[0], "id": via[1]}}
+            for node, (d, via) in sorted(seen.items(), key=lambda kv: (kv[1][0], kv[0]))
+        ]
+        return {
+            "changed": [{**self._describe(node, base), "op": op} for node, op in sorted(changed.items())],
+            "impacted": impacted,
+            "broken": broken,
+            "total": len(impacted),
+        }
+
+    def _describe(self, node: Node, fallback: Optional["RefGraph"] = None) -> Dict[str, Any]:
+        ent = self.entities.get(node)
+        if ent is None and fallback is not None:
+            ent = fallback.entities.get(node)
+        name = ent.get("Name") if isinstance(ent, dict) else None
+        return {"kind": node[0], "id": node[1], "name": name if isinstance(name, str) else None}
+
+
+_graphs: LRUCache[RefGraph] = LRUCache(maxsize=4)
+_build_lock = threading.Lock()
+
+
+def current() -> RefGraph:
+    """Graph of the current baselines, built once per combination of versions."""
+    loaded: List[baseline.Baseline] = []
+    for kind in baseline.BASELINE_FILES:
+        try:
+            loaded.append(baseline.get(kind))
+        except HTTPException:
+            continue
+    key = tuple((b.kind, b.sha256) for b in loaded)
+    graph = _graphs.get(key)
+    if graph is not None:
+        return graph
+    with _build_lock:
+        graph = _graphs.get(key)
+        if graph is None:
+            with metrics.timer("zgdg_refgraph_build_seconds"):
+                graph = RefGraph.build(key, loaded)
+            _graphs.put(key, graph)
+    return graph
+
+
+def patch_impact(kind: str, patch: Dict[str, Any], max_depth: Optional[int] = None) -> Dict[str, Any]:
+    base = current()
+    with metrics.timer("zgdg_patch_impact_seconds"):
+        patched, changed = base.with_patch(kind, patch)
+        return patched.impact(base, changed, max_depth)
+
+
+# Rebuild off the request path when the watcher swaps in new baselines
+baseline.on_swap.append(lambda kinds: current())
+
+metrics.describe("zgdg_refgraph_build_seconds", "histogram", "Time to build the cross-entity reference graph")
+metrics.describe("zgdg_patch_impact_seconds", "histogram", "Time to compute a patch's impact set on the reference graph")
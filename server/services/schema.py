@@ -0,0 +1,107 @@
+"""Data schema profiled by `tools/profile_schema.py`.
+
+The artifact records, per data file and variant (release / demo), which
+fields entities carry, the JSON types seen for each and the field's default
+value when one dominates. The server uses it for non-blocking validation
+warnings (unknown fields, unexpected types) and to elide default values from
+entity streams. Without the artifact both are simply skipped.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import baseline, codec
+
+SCHEMA_PATH = Path(os.environ.get("ZGDG_SCHEMA_PATH") or baseline.ROOT / "server" / "data_schema.json")
+SCHEMA_VERSION = 1
+
+_lock = threading.Lock()
+# (artifact mtime_ns, parsed artifact or None)
+_loaded: Tuple[Optional[int], Optional[Dict[str, Any]]] = (None, None)
+
+
+def load() -> Optional[Dict[str, Any]]:
+    """The parsed artifact, re-read when the file changes; None when missing or unreadable."""
+    global _loaded
+    try:
+        mtime: Optional[int] = SCHEMA_PATH.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    if _loaded[0] == mtime:
+        return _loaded[1]
+    with _lock:
+        data: Optional[Dict[str, Any]] = None
+        if mtime is not None:
+            try:
+                parsed = codec.loads(SCHEMA_PATH.read_bytes())
+            except (OSError, ValueError):
+                parsed = None
+            if isinstance(parsed, dict) and parsed.get("schema") == SCHEMA_VERSION:
+                data = parsed
+        _loaded = (mtime, data)
+    return data
+
+
+def generation() -> Optional[int]:
+    """Changes whenever the artifact does; for keying caches derived from it."""
+    load()
+    return _loaded[0]
+
+
+def profile(kind: str, variant: str = "release") -> Optional[Dict[str, Any]]:
+    """Profile of a baseline kind's file, e.g. `Card.json` for `card`."""
+    data = load()
+    fname = baseline.BASELINE_FILES.get(kind)
+    if data is None or fname is None:
+        return None
+    entry = (data.get("files") or {}).get(Path(fname).stem) or {}
+    return (entry.get("variants") or {}).get(variant)
+
+
+def defaults(kind: str) -> Dict[str, Any]:
+    """Field -> default value for a kind; empty without a schema."""
+    prof = profile(kind)
+    if prof is None:
+        return {}
+    return {key: f["default"] for key, f in (prof.get("fields") or {}).items() if "default" in f}
+
+
+def _type_name(v: Any) -> str:
+    if v is None:
+        return "null"
+    if isinstance(v, bool):
+        return "bool"
+    if isinstance(v, int):
+        return "int"
+    if isinstance(v, float):
+        return "float"
+    if isinstance(v, str):
+        return "string"
+    if isinstance(v, list):
+        return "list"
+    return "object"
+
+
+def warnings(kind: str, items: List[Any], prefix: str = "") -> List[str]:
+    """Fields the profiled data never had, or values of a type it never held; `Cards[3].Foo unknown field`."""
+    prof = profile(kind)
+    if prof is None:
+        return []
+    fields: Dict[str, Any] = prof.get("fields") or {}
+    out: List[str] = []
+    for i, it in enumerate(items):
+        if not isinstance(it, dict):
+            continue
+        for key, v in it.items():
+            f = fields.get(key)
+            if f is None:
+                out.append(f"{prefix}[{i}].{key} unknown field")
+                continue
+            t = _type_name(v)
+            types = f.get("types") or []
+            if t not in types and not (t == "int" and "float" in types):
+                out.append(f"{prefix}[{i}].{key} is {t}, expected {'/'.join(types)}")
+    return out
@@ -0,0 +1,370 @@
+"""Share storage: payload files plus `index.json`, usable from async handlers.
+
+Payloads are compressed (see `services.compression`) and sharded into
+subdirectories by ID prefix; reads also find files in the old flat layout.
+
+The sync methods do the actual file work and are safe to call from any
+thread; index read-modify-write cycles are serialized with a thread lock and,
+where available, an `flock` on `index.lock` so gunicorn workers don't lose
+each other's updates. Files are replaced atomically, so readers never see a
+partially written index or payload.
+
+The async layer runs that work on a bounded executor. A per-event-loop
+semaphore caps queued storage jobs (backpressure), and per-share locks keep
+reads and deletes of one share ordered, so a large publish never blocks the
+event loop that also serves baseline fetches.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX dev machines
+    fcntl = None  # type: ignore[assignment]
+
+from . import codec, metrics, profiling
+from .compression import COMPRESSIONS, Compression, by_suffix
+from .compression import DEFAULT as DEFAULT_COMPRESSION
+
+T = TypeVar("T")
+
+# Store bookkeeping files that live next to the payloads
+RESERVED_NAMES = {"index.json", "migrations.json", "maintenance.json", "rebase.json", "idempotency.json"}
+# Subdirectory for derived files; not a payload shard
+REBASED_DIR = "rebased"
+
+IO_WORKERS = int(os.environ.get("ZGDG_SHARE_IO_WORKERS") or 4)
+IO_MAX_PENDING = int(os.environ.get("ZGDG_SHARE_IO_PENDING") or 64)
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp.open("wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class _LoopState:
+    """asyncio primitives are bound to one event loop; keep a set per loop."""
+
+    def __init__(self, max_pending: int):
+        self.pending = asyncio.Semaphore(max_pending)
+        self.share_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+class ShareStore:
+    def __init__(
+        self,
+        root: Path,
+        max_workers: int = IO_WORKERS,
+        max_pending: int = IO_MAX_PENDING,
+        compression: Optional[Compression] = None,
+    ):
+        self.root = Path(root)
+        self.compression = compression or DEFAULT_COMPRESSION
+        self.index_path = self.root / "index.json"
+        self.lock_path = self.root / "index.lock"
+        self.generation_path = self.root / "generation"
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread_lock = threading.RLock()
+        self._local = threading.local()
+        self._loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+    # ---- sync layer ----
+
+    def ensure(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not self.index_path.exists():
+            with self.locked():
+                if not self.index_path.exists():
+                    self.save_index({"items": []})
+
+    # Payloads live in `<root>/<first two ID chars, lowercased>/<id>.json[.z|.zst]`. Files from the
+    # old flat layout (`<root>/<id>.json`) are still read until tools/migrate_share_layout.py moves them.
+
+    def shard_dir(self, share_id: str) -> Path:
+        return self.root / share_id[:2].lower()
+
+    def payload_path(self, share_id: str, comp: Optional[Compression] = None) -> Path:
+        """Where a payload is written: sharded, with the suffix of the store's compression."""
+        return self.shard_dir(share_id) / f"{share_id}.json{(comp or self.compression).suffix}"
+
+    def legacy_payload_path(self, share_id: str) -> Path:
+        return self.root / f"{share_id}.json"
+
+    def _candidates(self, share_id: str) -> List[Tuple[Path, Compression]]:
+        comps = [self.compression] + [c for c in COMPRESSIONS.values() if c is not self.compression]
+        out = [(self.payload_path(share_id, c), c) for c in comps]
+        out.append((self.legacy_payload_path(share_id), COMPRESSIONS["none"]))
+        return out
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Exclusive access to the index across threads and worker processes."""
+        with self._thread_lock:
+            depth = getattr(self._local, "depth", 0)
+            if fcntl is None or depth:
+                # Re-entrant use: the file lock is already held by this thread
+                self._local.depth = depth + 1
+                try:
+                    yield
+                finally:
+                    self._local.depth = depth
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            with self.lock_path.open("a+b") as fh:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                self._local.depth = 1
+                try:
+                    yield
+                finally:
+                    self._local.depth = 0
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def load_index(self) -> Dict[str, Any]:
+        self.ensure()
+        with metrics.timer("zgdg_share_index_load_seconds"):
+            return codec.loads(self.index_path.read_bytes())
+
+    def save_index(self, idx: Dict[str, Any]) -> None:
+        _atomic_write(self.index_path, codec.dumps(idx))
+
+    def mutate_index(self, fn: Callable[[Dict[str, Any]], T], bump: bool = False) -> T:
+        """Run `fn(idx)` under the index lock and persist the (mutated) index afterwards.
+
+        `bump` advances the store generation once the new index is in place,
+        for changes that must invalidate cached listings.
+        """
+        with self.locked():
+            idx = self.load_index()
+            result = fn(idx)
+            self.save_index(idx)
+            if bump:
+                self.bump_generation()
+            return result
+
+    def generation(self) -> int:
+        """Counter shared by all workers, advanced whenever the set of shares changes."""
+        try:
+            return int(self.generation_path.read_bytes() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump_generation(self) -> int:
+        with self.locked():
+            gen = self.generation() + 1
+            _atomic_write(self.generation_path, str(gen).encode("ascii"))
+            return gen
+
+    def read_payload_raw(self, share_id: str) -> Optional[Tuple[bytes, Compression]]:
+        """Stored bytes of a payload and the compression they use, without decompressing."""
+        for path, comp in self._candidates(share_id):
+            try:
+                return path.read_bytes(), comp
+            except FileNotFoundError:
+                continue
+        return None
+
+    def read_payload_bytes(self, share_id: str) -> Optional[bytes]:
+        found = self.read_payload_raw(share_id)
+        if found is None:
+            return None
+        raw, comp = found
+        return comp.decompress(raw)
+
+    def read_payload(self, share_id: str) -> Optional[Any]:
+        raw = self.read_payload_bytes(share_id)
+        return None if raw is None else codec.loads(raw)
+
+    def write_payload_bytes(self, share_id: str, data: bytes, comp: Optional[Compression] = None) -> int:
+        """Compress and atomically write a payload, dropping copies in other layouts; returns the JSON size."""
+        comp = comp or self.compression
+        target = self.payload_path(share_id, comp)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write(target, comp.compress(data))
+        for path, _ in self._candidates(share_id):
+            if path != target:
+                path.unlink(missing_ok=True)
+        return len(data)
+
+    def relocate_payload(self, share_id: str, comp: Optional[Compression] = None, flat: bool = False) -> bool:
+        """Rewrite a payload into the sharded layout with `comp`, or back to a flat uncompressed file.
+
+        Returns False when it is already stored that way (or missing).
+        """
+        with self.locked():
+            found = None
+            for path, cur in self._candidates(share_id):
+                if path.exists():
+                    found = (path, cur)
+                    break
+            if found is None:
+                return False
+            target = self.legacy_payload_path(share_id) if flat else self.payload_path(share_id, comp)
+            if found[0] == target:
+                return False
+            data = found[1].decompress(found[0].read_bytes())
+            if flat:
+                _atomic_write(target, data)
+                for path, _ in self._candidates(share_id):
+                    if path != target:
+                        path.unlink(missing_ok=True)
+            else:
+                self.write_payload_bytes(share_id, data, comp)
+            return True
+
+    def write_payload(self, share_id: str, obj: Any) -> int:
+        """Serialize and atomically write a payload; returns its JSON size in bytes."""
+        return self.write_payload_bytes(share_id, codec.dumps(obj))
+
+    def remove_payload(self, share_id: str) -> None:
+        for path, _ in self._candidates(share_id):
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                pass
+        self._remove_rebased(share_id)
+
+    # Rebased copies of a payload, one per set of baseline versions (`key`), in
+    # `<root>/rebased/<shard>/<id>.<key>.json[.z|.zst]`.
+
+    def rebased_path(self, share_id: str, key: str) -> Path:
+        return self.root / REBASED_DIR / share_id[:2].lower() / f"{share_id}.{key}.json{self.compression.suffix}"
+
+    def read_rebased_raw(self, share_id: str, key: str) -> Optional[Tuple[bytes, Compression]]:
+        for comp in [self.compression] + [c for c in COMPRESSIONS.values() if c is not self.compression]:
+            path = self.root / REBASED_DIR / share_id[:2].lower() / f"{share_id}.{key}.json{comp.suffix}"
+            try:
+                return path.read_bytes(), comp
+            except FileNotFoundError:
+                continue
+        return None
+
+    def write_rebased(self, share_id: str, key: str, data: bytes) -> Tuple[bytes, Compression]:
+        """Store a rebased payload, replacing copies made for other baseline versions; returns what was stored."""
+        target = self.rebased_path(share_id, key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        stored = self.compression.compress(data)
+        _atomic_write(target, stored)
+        self._remove_rebased(share_id, keep=target)
+        return stored, self.compression
+
+    def _remove_rebased(self, share_id: str, keep: Optional[Path] = None) -> None:
+        shard = self.root / REBASED_DIR / share_id[:2].lower()
+        try:
+            entries = list(os.scandir(shard))
+        except FileNotFoundError:
+            return
+        for de in entries:
+            if de.name.startswith(f"{share_id}.") and de.path != str(keep):
+                try:
+                    os.unlink(de.path)
+                except OSError:
+                    pass
+
+    def _scan_dirs(self) -> Iterator[Tuple[str, os.DirEntry]]:
+        """(directory kind, entry) for the root and every shard directory; kind is "root" or "shard"."""
+        try:
+            top = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return
+        for de in top:
+            if de.name == REBASED_DIR:
+                continue
+            if de.is_dir(follow_symlinks=False):
+                try:
+                    for sub in os.scandir(de.path):
+                        yield "shard", sub
+                except FileNotFoundError:
+                    continue
+            else:
+                yield "root", de
+
+    def iter_payload_files(self) -> Iterator[Tuple[str, float]]:
+        """(share_id, mtime) for every payload file on disk, referenced or not, in either layout."""
+        for where, de in self._scan_dirs():
+            name = de.name
+            if name.startswith(".") or (where == "root" and (name in RESERVED_NAMES or not name.endswith(".json"))):
+                continue
+            sid, sep, suffix = name.partition(".json")
+            if not sep or by_suffix(suffix) is None:
+                continue
+            try:
+                yield sid, de.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+    def remove_stale_temp(self, older_than: float) -> int:
+        """Delete temp files left behind by crashed atomic writes; returns the count."""
+        removed = 0
+        cutoff = time.time() - older_than
+        for _, de in self._scan_dirs():
+            if de.name.startswith(".") and de.name.endswith(".tmp"):
+                try:
+                    if de.stat().st_mtime < cutoff:
+                        os.unlink(de.path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def read_state(self, name: str) -> Optional[Any]:
+        """Small JSON bookkeeping file in the store root (e.g. maintenance.json)."""
+        try:
+            return codec.loads((self.root / name).read_bytes())
+        except (OSError, ValueError):
+            return None
+
+    def write_state(self, name: str, obj: Any) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        _atomic_write(self.root / name, codec.dumps(obj))
+
+    # ---- async layer ----
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        st = self._loop_states.get(loop)
+        if st is None:
+            st = self._loop_states[loop] = _LoopState(self.max_pending)
+        return st
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._thread_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="share-io")
+        return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run blocking storage or CPU work on the bounded executor.
+
+        At most `max_pending` jobs per event loop are queued; further callers
+        wait here instead of piling work onto the executor.
+        """
+        st = self._state()
+        async with st.pending:
+            loop = asyncio.get_running_loop()
+            # Carry context variables (e.g. the request's pinned baseline snapshot, or its profiler) into the worker thread
+            ctx = contextvars.copy_context()
+            return await loop.run_in_executor(self._get_executor(), partial(ctx.run, profiling.call, fn, *args, **kwargs))
+
+    def share_lock(self, share_id: str) -> asyncio.Lock:
+        st = self._state()
+        lock = st.share_locks.get(share_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            st.share_locks[share_id] = lock
+        return lock
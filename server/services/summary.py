@@ -0,0 +1,78 @@
+"""Compact, precomputed description of what a patch changes.
+
+Summaries are stored in the share index at publish time so listings and
+previews never have to open payload files.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional
+
+# Affected entities listed per kind; counts always cover everything
+MAX_ENTITIES = 50
+
+
+def _name_of(entity: Any) -> Optional[str]:
+    if isinstance(entity, dict):
+        name = entity.get("Name")
+        if isinstance(name, str):
+            return name
+    return None
+
+
+def summarize_patch(patch: Dict[str, Any], lookup: Callable[[str], Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Counts, affected entities and touched fields of one kind's patch.
+
+    `lookup(id)` returns the baseline entity, used to name updated and
+    deleted entities.
+    """
+    chg = (patch or {}).get("changes") or {}
+    adds = chg.get("adds") or []
+    updates = chg.get("updates") or []
+    deletes = chg.get("deletes") or []
+
+    entities: List[Dict[str, Any]] = []
+    fields = set()
+
+    def note(op: str, eid: Any, name: Optional[str]) -> None:
+        if len(entities) < MAX_ENTITIES and isinstance(eid, str):
+            entities.append({"id": eid, "name": name, "op": op})
+
+    for a in adds:
+        if isinstance(a, dict):
+            note("add", a.get("id"), _name_of(a.get("data")))
+    for u in updates:
+        if not isinstance(u, dict):
+            continue
+        eid = u.get("id")
+        changed = u.get("fields") if isinstance(u.get("fields"), dict) else {}
+        fields.update(k for k in changed if isinstance(k, str))
+        renamed = changed.get("Name")
+        name = renamed.get("to") if isinstance(renamed, dict) and isinstance(renamed.get("to"), str) else None
+        note("update", eid, name or (_name_of(lookup(eid)) if isinstance(eid, str) else None))
+    for d in deletes:
+        if isinstance(d, dict):
+            eid = d.get("id")
+            note("delete", eid, _name_of(lookup(eid)) if isinstance(eid, str) else None)
+
+    out: Dict[str, Any] = {
+        "adds": len(adds),
+        "updates": len(updates),
+        "deletes": len(deletes),
+        "entities": entities,
+        "fields": sorted(fields),
+        "baseSha256": ((patch or {}).get("meta") or {}).get("baseSha256"),
+    }
+    if len(adds) + len(updates) + len(deletes) > len(entities):
+        out["entitiesTruncated"] = True
+    return out
+
+
+def counts_only(summary: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Per-kind counts only, the part of a summary included in listings."""
+    if not isinstance(summary, dict):
+        return None
+    return {
+        kind: {k: v for k, v in s.items() if isinstance(v, int) and not isinstance(v, bool)}
+        for kind, s in (summary.get("kinds") or {}).items()
+        if isinstance(s, dict)
+    }
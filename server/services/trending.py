@@ -0,0 +1,169 @@
+"""Trending shares: download counts with exponential time decay.
+
+A download at time `t` adds `2 ** ((t - EPOCH) / half_life)` to its share's
+score. Every score decays by the same factor as time passes, so the ranking
+never changes on its own: only a download moves its share. A score update is
+O(1) and the share's place in the sorted ranking is fixed up by bisection,
+so listing the top shares never re-sorts anything. Scores are kept as log2
+to stay within float range.
+
+Events are appended to a log in the share store that all worker processes
+share. Each process reads the lines added since it last looked before it
+answers, and the log doubles as the persistent state. Maintenance compacts
+it into one absolute-score line per live share, dropping shares whose score
+has decayed to nothing. Downloads that race with a compaction may be lost,
+as with the `downloads` counter.
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import metrics
+
+HALF_LIFE_HOURS = float(os.environ.get("ZGDG_TRENDING_HALF_LIFE_HOURS") or 24)
+# Compact the log once it grows past this
+COMPACT_BYTES = int(os.environ.get("ZGDG_TRENDING_COMPACT_BYTES") or 256 * 1024)
+# Fixed origin of the exponent; any constant works since only differences matter
+EPOCH = 1_700_000_000.0
+# Shares whose score fell below 2**-PRUNE_HALF_LIVES of one fresh download are dropped on compaction
+PRUNE_HALF_LIVES = 20.0
+
+
+def _logaddexp2(a: float, b: float) -> float:
+    hi, lo = (a, b) if a >= b else (b, a)
+    return hi + math.log2(1.0 + 2.0 ** (lo - hi))
+
+
+class Trending:
+    def __init__(self, path: Path, half_life_hours: float = HALF_LIFE_HOURS):
+        self.path = path
+        self.half_life = half_life_hours * 3600.0
+        self._lock = threading.Lock()
+        # share ID -> log2 of its score relative to EPOCH
+        self._scores: Dict[str, float] = {}
+        # (-log2 score, share ID), best first
+        self._order: List[Tuple[float, str]] = []
+        # (st_dev, st_ino) of the log file read so far, and how far
+        self._file: Optional[Tuple[int, int]] = None
+        self._offset = 0
+        self._partial = b""
+
+    def _exponent(self, at: float) -> float:
+        return (at - EPOCH) / self.half_life
+
+    def record(self, share_id: str, at: Optional[float] = None) -> None:
+        """Append one download; visible to every process on its next `refresh`."""
+        line = f"d\t{time.time() if at is None else at:.3f}\t{share_id}\n".encode("utf-8")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # O_APPEND: concurrent single-line writes from several processes don't interleave
+        with self.path.open("ab") as fh:
+            fh.write(line)
+        metrics.inc("zgdg_trending_events_total")
+
+    def _set(self, share_id: str, value: float) -> None:
+        old = self._scores.get(share_id)
+        if old is not None:
+            i = bisect_left(self._order, (-old, share_id))
+            if i < len(self._order) and self._order[i][1] == share_id:
+                del self._order[i]
+        self._scores[share_id] = value
+        insort(self._order, (-value, share_id))
+
+    def _apply(self, line: bytes) -> None:
+        parts = line.split(b"\t")
+        if len(parts) != 3:
+            return
+        op, raw, sid = parts
+        try:
+            value = float(raw)
+            share_id = sid.decode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            return
+        if op == b"d":
+            x = self._exponent(value)
+            old = self._scores.get(share_id)
+            self._set(share_id, x if old is None else _logaddexp2(old, x))
+        elif op == b"=":
+            self._set(share_id, value)
+
+    def refresh(self) -> None:
+        """Apply log lines written since the last call (by any process)."""
+        with self._lock:
+            try:
+                fh = self.path.open("rb")
+            except FileNotFoundError:
+                if self._file is not None:
+                    self._reset(None)
+                return
+            with fh:
+                st = os.fstat(fh.fileno())
+                ident = (st.st_dev, st.st_ino)
+                if ident != self._file:
+                    # First read, or the log was compacted: rebuild from the new file
+                    self._reset(ident)
+                if st.st_size <= self._offset:
+                    return
+                fh.seek(self._offset)
+                data = fh.read()
+            self._offset += len(data)
+            lines = (self._partial + data).split(b"\n")
+            self._partial = lines.pop()
+            for line in lines:
+                self._apply(line)
+
+    def _reset(self, ident: Optional[Tuple[int, int]]) -> None:
+        self._scores.clear()
+        self._order.clear()
+        self._file = ident
+        self._offset = 0
+        self._partial = b""
+
+    def ranked(self) -> List[str]:
+        """Share IDs with any downloads, most trending first."""
+        self.refresh()
+        with self._lock:
+            return [sid for _, sid in self._order]
+
+    def score(self, share_id: str, now: Optional[float] = None) -> float:
+        """Current decayed score: about the number of downloads in the last half-life."""
+        log2 = self._scores.get(share_id)
+        if log2 is None:
+            return 0.0
+        return 2.0 ** (log2 - self._exponent(time.time() if now is None else now))
+
+    def compact(self, keep: Set[str], force: bool = False) -> bool:
+        """Rewrite the log as one score line per live share; the caller holds the store lock."""
+        try:
+            if not force and self.path.stat().st_size < COMPACT_BYTES:
+                return False
+        except FileNotFoundError:
+            return False
+        self.refresh()
+        floor = self._exponent(time.time()) - PRUNE_HALF_LIVES
+        with self._lock:
+            written = dict(self._scores)
+            lines = [f"=\t{-neg!r}\t{sid}\n" for neg, sid in self._order if sid in keep and -neg >= floor]
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text("".join(lines), encoding="utf-8")
+        # Carry over downloads appended while the new file was written
+        self.refresh()
+        with self._lock:
+            changed = [
+                f"=\t{v!r}\t{sid}\n" for sid, v in self._scores.items() if written.get(sid) != v and sid in keep
+            ]
+        if changed:
+            with tmp.open("a", encoding="utf-8") as fh:
+                fh.write("".join(changed))
+        os.replace(tmp, self.path)
+        metrics.inc("zgdg_trending_compactions_total")
+        return True
+
+
+metrics.describe("zgdg_trending_events_total", "counter", "Share downloads recorded for the trending ranking")
+metrics.describe("zgdg_trending_compactions_total", "counter", "Trending log compactions")
@@ -0,0 +1,183 @@
+"""Structural validation of edited asset files.
+
+Every kind is described by a `Spec`: where its entity list lives and which
+optional fields must have which type. Error messages are paths into the
+payload, built the same way for every kind: `Cards[3].Level must be int`,
+`[2].Choices[0].Effect must be string`.
+
+`schema_warnings` adds non-blocking findings against the profiled data
+schema (see `services/schema.py`): fields the game data never had and values
+of a type it never held.
+
+`validate_many` checks several kinds in a process pool so a full mod
+(cards, pendants, map events, begin effects, disasters) validates in
+parallel instead of on one request thread.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Type
+
+from . import codec, metrics, profiling, schema
+
+_TYPE_NAMES = {str: "string", int: "int", list: "list"}
+
+
+class Spec:
+    def __init__(self, list_key: Optional[str], fields: Dict[str, Type[Any]], array_label: str = "", choices: bool = False):
+        # Key of the entity list in the root object; None when the payload is the list itself
+        self.list_key = list_key
+        self.fields = fields
+        self.array_label = array_label
+        # Map events: validate Choices[].Description/Effect as well
+        self.choices = choices
+
+
+SPECS: Dict[str, Spec] = {
+    "card": Spec("Cards", {"Name": str, "Level": int}),
+    "pendant": Spec("Pendant", {"Name": str, "Level": int}),
+    "disaster": Spec("Pendant", {"Name": str, "Level": int, "Character": str, "Combo": str, "EffectDescription": str, "EffectString": str}),
+    "mapevent": Spec(None, {"Name": str, "LimitStage": int, "Character": str, "Content": str, "Choices": list}, "events", choices=True),
+    "begineffect": Spec(
+        None,
+        {"EffectDescription": str, "EffectString": str, "UnLocked": int, "UnlockCondition": str, "StarCount": int},
+        "begin effects",
+    ),
+}
+
+UNKNOWN_KIND = "kind must be 'card' or 'pendant' or 'mapevent' or 'begineffect' or 'disaster'"
+
+
+def _check_choices(path: str, choices: List[Any], errors: List[str]) -> None:
+    for j, ch in enumerate(choices):
+        if not isinstance(ch, dict):
+            errors.append(f"{path}.Choices[{j}] must be object")
+            continue
+        for key in ("Description", "Effect"):
+            v = ch.get(key)
+            if v is not None and not isinstance(v, str):
+                errors.append(f"{path}.Choices[{j}].{key} must be string")
+
+
+def validate(kind: str, payload: Any) -> List[str]:
+    """Errors found in `payload` as a `kind` file; empty when valid."""
+    spec = SPECS.get(kind)
+    if spec is None:
+        return [UNKNOWN_KIND]
+    errors: List[str] = []
+    prefix = ""
+    if spec.list_key is not None:
+        if not isinstance(payload, dict):
+            return ["payload must be an object"]
+        if not isinstance(payload.get("Name"), str):
+            errors.append("Name must be string")
+        items = payload.get(spec.list_key)
+        if not isinstance(items, list):
+            errors.append(f"{spec.list_key} must be list")
+            return errors
+        prefix = spec.list_key
+    else:
+        items = payload
+        if not isinstance(items, list):
+            return [f"payload must be an array of {spec.array_label}"]
+
+    ids = set()
+    for i, it in enumerate(items):
+        path = f"{prefix}[{i}]"
+        if not isinstance(it, dict):
+            errors.append(f"{path} must be object")
+            continue
+        eid = it.get("ID")
+        if not isinstance(eid, str) or not eid:
+            errors.append(f"{path}.ID required")
+        elif eid in ids:
+            errors.append(f"Duplicate ID: {eid}")
+        else:
+            ids.add(eid)
+        for key, typ in spec.fields.items():
+            v = it.get(key)
+            if v is not None and not isinstance(v, typ):
+                errors.append(f"{path}.{key} must be {_TYPE_NAMES[typ]}")
+        if spec.choices and isinstance(it.get("Choices"), list):
+            _check_choices(path, it["Choices"], errors)
+    return errors
+
+
+# Schema warnings listed per payload
+MAX_WARNINGS = 100
+
+
+def schema_warnings(kind: str, payload: Any) -> List[str]:
+    """Schema findings for `payload`; empty without a profiled schema or when the structure is invalid."""
+    spec = SPECS.get(kind)
+    if spec is None:
+        return []
+    items = payload.get(spec.list_key) if spec.list_key is not None and isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return []
+    out = schema.warnings(kind, items, spec.list_key or "")
+    if len(out) > MAX_WARNINGS:
+        out = out[:MAX_WARNINGS] + [f"... {len(out) - MAX_WARNINGS} more"]
+    return out
+
+
+def _validate_raw(kind: str, raw: bytes) -> Tuple[List[str], List[str]]:
+    # Runs in pool processes; payloads travel as JSON bytes, which pickle far faster than parsed objects
+    payload = codec.loads(raw)
+    return validate(kind, payload), schema_warnings(kind, payload)
+
+
+# 0 validates on threads in the server process (no pool)
+WORKERS = int(os.environ.get("ZGDG_VALIDATE_WORKERS") or os.cpu_count() or 1)
+# Batches smaller than this are validated in-process; pool round trips would cost more than they save
+POOL_MIN_BYTES = int(os.environ.get("ZGDG_VALIDATE_POOL_MIN_BYTES") or 256 * 1024)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_threads: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _executor(total_bytes: int) -> Executor:
+    global _pool, _threads
+    with _pool_lock:
+        if WORKERS > 0 and total_bytes >= POOL_MIN_BYTES:
+            if _pool is None:
+                # spawn: forking a threaded server process can inherit held locks
+                _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=get_context("spawn"))
+            return _pool
+        if _threads is None:
+            _threads = ThreadPoolExecutor(max_workers=len(SPECS), thread_name_prefix="validate")
+        return _threads
+
+
+def shutdown() -> None:
+    global _pool, _threads
+    with _pool_lock:
+        pool, threads, _pool, _threads = _pool, _threads, None, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if threads is not None:
+        threads.shutdown(wait=False)
+
+
+async def validate_many(payloads: Dict[str, bytes]) -> AsyncIterator[Tuple[str, List[str], List[str]]]:
+    """Validate each `kind -> JSON bytes` in parallel, yielding `(kind, errors, warnings)` as each finishes."""
+    loop = asyncio.get_running_loop()
+    executor = _executor(sum(len(raw) for raw in payloads.values()))
+
+    async def one(kind: str, raw: bytes) -> Tuple[str, List[str], List[str]]:
+        with metrics.timer("zgdg_validate_seconds", kind=kind):
+            # Worker processes are out of the profiler's reach; the thread pool is sampled for a profiled request
+            fn = profiling.bind(_validate_raw) if executor is _threads else _validate_raw
+            errors, warns = await loop.run_in_executor(executor, fn, kind, raw)
+            return kind, errors, warns
+
+    for fut in asyncio.as_completed([one(k, raw) for k, raw in payloads.items()]):
+        yield await fut
+
+
+metrics.describe("zgdg_validate_seconds", "histogram", "Time to validate one kind's payload, by kind")
@@ -0,0 +1,131 @@
+"""Content negotiation between JSON, MessagePack and CBOR.
+
+Request bodies are decoded according to `Content-Type` and responses encoded
+according to `Accept`; JSON stays the default for both. MessagePack needs
+`msgspec` and CBOR needs `cbor2`; a format whose package is missing is
+simply not offered (requests in it get 415, and `Accept` falls back to
+JSON).
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+
+from . import codec
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional dependency
+    msgspec = None  # type: ignore[assignment]
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover - optional dependency
+    cbor2 = None  # type: ignore[assignment]
+
+
+class WireFormat:
+    def __init__(self, name: str, media_types: Tuple[str, ...], loads: Callable[[bytes], Any], dumps: Callable[[Any], bytes]):
+        self.name = name
+        # First entry is what responses are labelled with
+        self.media_types = media_types
+        self.loads = loads
+        self.dumps = dumps
+
+    @property
+    def media_type(self) -> str:
+        return self.media_types[0]
+
+
+JSON = WireFormat("json", ("application/json",), codec.loads, codec.dumps)
+FORMATS: Dict[str, WireFormat] = {"json": JSON}
+
+_MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+_CBOR_TYPES = ("application/cbor",)
+
+if msgspec is not None:
+    _mp_encoder = msgspec.msgpack.Encoder()
+    _mp_decoder = msgspec.msgpack.Decoder()
+    FORMATS["msgpack"] = WireFormat("msgpack", _MSGPACK_TYPES, _mp_decoder.decode, _mp_encoder.encode)
+
+if cbor2 is not None:
+    FORMATS["cbor"] = WireFormat("cbor", _CBOR_TYPES, cbor2.loads, cbor2.dumps)
+
+# Binary formats, for pre-encoding cached bodies
+BINARY = [f for f in FORMATS.values() if f is not JSON]
+
+_BY_MEDIA_TYPE: Dict[str, Optional[WireFormat]] = {t: FORMATS.get("msgpack") for t in _MSGPACK_TYPES}
+_BY_MEDIA_TYPE.update({t: FORMATS.get("cbor") for t in _CBOR_TYPES})
+_BY_MEDIA_TYPE.update({t: JSON for t in JSON.media_types})
+
+
+def _media_type(header: str) -> str:
+    return header.split(";", 1)[0].strip().lower()
+
+
+def request_format(content_type: Optional[str]) -> WireFormat:
+    """Format of a request body; anything unrecognised is treated as JSON, as before."""
+    if not isinstance(content_type, str) or not content_type:
+        return JSON
+    mt = _media_type(content_type)
+    if mt not in _BY_MEDIA_TYPE:
+        return JSON
+    fmt = _BY_MEDIA_TYPE[mt]
+    if fmt is None:
+        raise HTTPException(status_code=415, detail=f"服务器不支持该请求格式: {mt}")
+    return fmt
+
+
+def response_format(accept: Optional[str]) -> WireFormat:
+    """Most preferred available format in an `Accept` header; JSON when none is named."""
+    if not accept:
+        return JSON
+    best: Optional[WireFormat] = None
+    best_q = 0.0
+    for part in accept.split(","):
+        mt, _, params = part.partition(";")
+        fmt = _BY_MEDIA_TYPE.get(mt.strip().lower())
+        if fmt is None:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        # Ties go to the first listed format
+        if q > best_q:
+            best, best_q = fmt, q
+    return best or JSON
+
+
+async def body(request: Request) -> Any:
+    """Request body decoded per its `Content-Type`; usable as a FastAPI dependency."""
+    fmt = request_format(request.headers.get("content-type"))
+    raw = await request.body()
+    if not raw:
+        raise HTTPException(status_code=400, detail="请求体不能为空")
+    try:
+        return fmt.loads(raw)
+    except Exception:  # noqa: PIE786 - each backend raises its own error type
+        raise HTTPException(status_code=400, detail=f"请求体无法按 {fmt.name} 解析")
+
+
+class WireResponse(Response):
+    """Response encoded in `fmt`; takes an object or bytes already in that format."""
+
+    def __init__(self, content: Any, fmt: WireFormat = JSON, status_code: int = 200, headers: Optional[Dict[str, str]] = None):
+        self.fmt = fmt
+        headers = {"Vary": "Accept", **(headers or {})}
+        super().__init__(content=content, status_code=status_code, headers=headers, media_type=fmt.media_type)
+
+    def render(self, content: Any) -> Any:
+        if isinstance(content, memoryview):
+            # Shared, memory-mapped bytes go out as they are, without a private copy per response
+            return content
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return self.fmt.dumps(content)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""In-process benchmarks for the patch, validation, share and crypto hot paths.
+
+Runs each target against the real `Data/` files and against synthetic
+datasets scaled up (10×, 100×, ...), records latency percentiles and peak
+memory to a JSON results file, and optionally compares with a saved baseline.
+
+    python tools/benchmark.py                       # all cases, scales 1,10,100
+    python tools/benchmark.py --scales 1 --filter diff
+    python tools/benchmark.py --save-baseline       # store results as baseline
+    python tools/benchmark.py --compare             # exit 1 on regressions
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+DATA = ROOT / "Data"
+SERVER = ROOT / "server"
+DEFAULT_OUTPUT = ROOT / "tools" / "bench_results.json"
+DEFAULT_BASELINE = ROOT / "tools" / "bench_baseline.json"
+
+sys.path.insert(0, str(SERVER))
+
+from routers import assets, patch, share  # noqa: E402
+from services import baseline, codec, crypto, idempotency, trending  # noqa: E402
+from services.share_store import ShareStore  # noqa: E402
+
+# kind -> (file name, list key or None for array roots)
+KINDS: Dict[str, Tuple[str, Optional[str]]] = {
+    "card": ("Card.json", "Cards"),
+    "pendant": ("Pendant.json", "Pendant"),
+    "mapevent": ("MapEvent.json", None),
+    "begineffect": ("BeginEffect.json", None),
+    "disaster": ("Disaster.json", "Pendant"),
+}
+
+# Share store size at scale 1; scaled linearly like the datasets
+BASE_SHARE_COUNT = 50
+
+
+def load(path: Path) -> Any:
+    with path.open("rb") as f:
+        return json.load(f)
+
+
+def data_of(kind: str) -> Any:
+    return baseline.get(kind).data
+
+
+def entity_list(kind: str, data: Any) -> List[Dict[str, Any]]:
+    _, list_key = KINDS[kind]
+    return data[list_key] if list_key else data
+
+
+def scale_dataset(kind: str, data: Any, factor: int) -> Any:
+    """Replicate every entity `factor` times with suffixed IDs."""
+    if factor <= 1:
+        return data
+    out = deepcopy(data)
+    items = entity_list(kind, out)
+    originals = list(items)
+    for n in range(1, factor):
+        for it in originals:
+            cp = dict(it)
+            cp["ID"] = f"{it.get('ID')}~x{n}"
+            items.append(cp)
+    return out
+
+
+def edit_dataset(kind: str, data: Any, ratio: float = 0.05) -> Any:
+    """Produce an edited copy touching ~ratio of entities (updates, adds, deletes)."""
+    out = deepcopy(data)
+    items = entity_list(kind, out)
+    step = max(1, int(1 / ratio))
+    for i in range(0, len(items), step):
+        it = items[i]
+        if "Name" in it:
+            it["Name"] = f"{it['Name']}*"
+        else:
+            it["EffectString"] = f"{it.get('EffectString', '')} # Exit"
+    del items[1::step * 3]
+    for i in range(max(1, len(items) // (step * 3))):
+        cp = dict(items[i])
+        cp["ID"] = f"bench-add-{i}"
+        items.append(cp)
+    return out
+
+
+def percentile(samples: List[float], q: float) -> float:
+    s = sorted(samples)
+    if not s:
+        return 0.0
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def call(fn: Callable[[], Any]) -> Any:
+    res = fn()
+    if inspect.isawaitable(res):
+        return asyncio.run(res)
+    return res
+
+
+def measure(fn: Callable[[], Any], iterations: int, min_time: float) -> Dict[str, Any]:
+    call(fn)  # warm-up
+    samples: List[float] = []
+    started = time.perf_counter()
+    while len(samples) < iterations or (time.perf_counter() - started) < min_time:
+        t0 = time.perf_counter()
+        call(fn)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+        if len(samples) >= iterations * 20:
+            break
+    # Peak memory of a single call, measured separately so tracing doesn't skew latency
+    tracemalloc.start()
+    try:
+        call(fn)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "min_ms": round(min(samples), 4),
+        "p50_ms": round(percentile(samples, 0.50), 4),
+        "p90_ms": round(percentile(samples, 0.90), 4),
+        "p99_ms": round(percentile(samples, 0.99), 4),
+        "max_ms": round(max(samples), 4),
+        "peak_mem_kb": round(peak / 1024.0, 1),
+    }
+
+
+class Workspace:
+    """Temporary Data/ and share store directories the server modules are pointed at."""
+
+    def __init__(self, scale: int):
+        self.scale = scale
+        self.tmp = Path(tempfile.mkdtemp(prefix=f"zgdg-bench-x{scale}-"))
+        self.data_dir = self.tmp / "Data"
+        self.store_dir = self.tmp / "share"
+        self.data: Dict[str, Any] = {}
+        self.edited: Dict[str, Any] = {}
+        self.patches: Dict[str, Dict[str, Any]] = {}
+        self.share_ids: List[str] = []
+        self._saved: Dict[str, Any] = {}
+
+    def __enter__(self) -> "Workspace":
+        self.data_dir.mkdir(parents=True)
+        for kind, (fname, _) in KINDS.items():
+            data = scale_dataset(kind, load(DATA / fname), self.scale)
+            (self.data_dir / fname).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+            self.data[kind] = data
+            self.edited[kind] = edit_dataset(kind, data)
+        self._saved = {
+            "DATA_DIR": baseline.DATA_DIR,
+            "ARCHIVE_DIR": baseline.ARCHIVE_DIR,
+            "ARENA_DIR": baseline.ARENA_DIR,
+            "store": share.store,
+            "trending": share.trending_index,
+            "idempotency": share.idempotency_table,
+        }
+        baseline.DATA_DIR = self.data_dir
+        baseline.ARCHIVE_DIR = self.tmp / "baselines"
+        baseline.ARENA_DIR = self.tmp / "arena"
+        share.store = ShareStore(self.store_dir)
+        # Downloads and publishes benchmarked below are recorded here, not in the real store's logs
+        share.trending_index = trending.Trending(self.store_dir / "trending.log")
+        share.idempotency_table = idempotency.IdempotencyTable(share.store)
+        for kind in KINDS:
+            self.patches[kind] = patch.compute_diff(kind, data_of(kind), self.edited[kind])
+        self._populate_shares()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        baseline.DATA_DIR = self._saved["DATA_DIR"]
+        baseline.ARCHIVE_DIR = self._saved["ARCHIVE_DIR"]
+        baseline.ARENA_DIR = self._saved["ARENA_DIR"]
+        share.store = self._saved["store"]
+        share.trending_index = self._saved["trending"]
+        share.idempotency_table = self._saved["idempotency"]
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _populate_shares(self) -> None:
+        share._ensure_store()
+        kinds = list(KINDS)
+        items: List[Dict[str, Any]] = []
+        for i in range(BASE_SHARE_COUNT * self.scale):
+            kind = kinds[i % len(kinds)]
+            sid = f"bench{i:06d}"
+            obj = {
+                "meta": {
+                    "title": f"Bench share {i}",
+                    "author": "bench",
+                    "description": "" if i % 7 == 0 else f"Synthetic share #{i}",
+                    "baseDataVersion": "",
+                    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1700000000 + i * 60)),
+                    "mode": "patch",
+                    "kinds": [kind],
+                },
+                "patch": self.patches[kind],
+            }
+            size = share.store.write_payload(sid, obj)
+            items.append({
+                "id": sid,
+                "title": obj["meta"]["title"],
+                "author": "bench",
+                "description": obj["meta"]["description"],
+                "baseDataVersion": "",
+                "createdAt": obj["meta"]["createdAt"],
+                "size": size,
+                "downloads": 0,
+                "tokenHash": "",
+                "mode": "patch",
+                "kinds": [kind],
+            })
+            self.share_ids.append(sid)
+        share._save_index({"items": items})
+
+
+def build_cases(ws: Workspace) -> List[Tuple[str, Callable[[], Any]]]:
+    cases: List[Tuple[str, Callable[[], Any]]] = []
+    for kind in ("card", "pendant", "mapevent"):
+        edited = ws.edited[kind]
+        p = ws.patches[kind]
+        cases.append((f"diff_patch[{kind}]", lambda k=kind, e=edited: patch.diff_patch(k, e, accept=None)))
+        cases.append((f"apply_patch[{kind}]", lambda k=kind, p=p: patch.apply_patch(k, {"patch": p}, accept=None)))
+        cases.append((f"validate_payload[{kind}]", lambda k=kind, e=edited: assets.validate_payload(k, e)))
+        cases.append((f"patch_impact[{kind}]", lambda k=kind, p=p: patch.patch_impact(k, p, depth=None)))
+    cases.append(("list_shares[q=]", lambda: share._list_bytes(None, 30, "new", None)))
+    cases.append(("list_shares[q=share 1]", lambda: share._list_bytes("share 1", 30, "new", None)))
+    cases.append(("list_shares[cached]", lambda: share.list_shares(None, 30, "new", None)))
+    sid = ws.share_ids[len(ws.share_ids) // 2]
+    cases.append(("get_share", lambda: share.get_share(sid, accept_encoding=None, want_rebase=True, accept=None)))
+    cases.append(("get_baseline[card]", lambda: assets.get_baseline("card", accept=None, since=None)))
+    cases.append(("get_baseline[card,msgpack]", lambda: assets.get_baseline("card", accept="application/msgpack", since=None)))
+    raw = (ws.data_dir / "Card.json").read_bytes()
+    card = ws.data["card"]
+    for name, be in codec.BACKENDS.items():
+        cases.append((f"codec.loads[{name}]", lambda be=be: be.loads(raw)))
+        cases.append((f"codec.dumps[{name}]", lambda be=be: be.dumps(card)))
+        cases.append((f"codec.canonical[{name}]", lambda be=be: be.canonical(card)))
+    plain = json.dumps(ws.data["card"], ensure_ascii=False)
+    enc = crypto.encrypt_text(plain)
+    cases.append(("encrypt_text[card]", lambda: crypto.encrypt_text(plain)))
+    cases.append(("decrypt_text[card]", lambda: crypto.decrypt_text(enc)))
+    return cases
+
+
+def git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip()
+    except Exception:
+        return ""
+
+
+def run(scales: List[int], iterations: int, min_time: float, name_filter: Optional[str]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for scale in scales:
+        with Workspace(scale) as ws:
+            for name, fn in build_cases(ws):
+                key = f"{name}@x{scale}"
+                if name_filter and name_filter not in key:
+                    continue
+                # Fewer iterations for the large scales; the time floor keeps samples meaningful
+                its = max(3, iterations // scale) if scale > 1 else iterations
+                res = measure(fn, its, min_time)
+                results[key] = res
+                print(f"{key:<40} p50 {res['p50_ms']:>10.3f} ms  p99 {res['p99_ms']:>10.3f} ms  peak {res['peak_mem_kb']:>10.1f} KiB")
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git": git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scales": scales,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return human-readable regressions where p50 latency or peak memory grew beyond threshold."""
+    regressions: List[str] = []
+    base_res = baseline.get("results", {})
+    for key, cur in current.get("results", {}).items():
+        old = base_res.get(key)
+        if not old:
+            continue
+        for metric in ("p50_ms", "peak_mem_kb"):
+            a = float(old.get(metric) or 0)
+            b = float(cur.get(metric) or 0)
+            if a > 0 and b > a * (1 + threshold):
+                regressions.append(f"{key} {metric}: {a} -> {b} (+{(b / a - 1) * 100:.1f}%)")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scales", default="1,10,100", help="comma separated dataset scale factors")
+    ap.add_argument("--iterations", type=int, default=30, help="iterations per case at scale 1")
+    ap.add_argument("--min-time", type=float, default=0.5, help="minimum seconds spent per case")
+    ap.add_argument("--filter", default=None, help="only run cases whose name contains this text")
+    ap.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="also write the results as the new baseline")
+    ap.add_argument("--compare", action="store_true", help="compare with baseline; exit 1 on regressions")
+    ap.add_argument("--threshold", type=float, default=0.15, help="allowed relative slowdown before flagging")
+    args = ap.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    current = run(scales, args.iterations, args.min_time, args.filter)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(current, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Wrote results to {args.output}")
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(current, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.compare:
+        if not args.baseline.exists():
+            raise SystemExit(f"Baseline not found: {args.baseline}")
+        regressions = compare(current, load(args.baseline), args.threshold)
+        if regressions:
+            print("Regressions:")
+            for r in regressions:
+                print(f"  - {r}")
+            raise SystemExit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
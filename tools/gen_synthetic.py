@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Synthesize large card/pendant/mapevent/begineffect/disaster datasets and share stores.
+
+Field presence and value distributions are sampled from the real `Data/*.json`
+files; EffectStrings are generated from the DSL vocabulary in
+`ui/src/assets/dsl_dictionary.json`. The output directory can be served directly:
+
+    python tools/gen_synthetic.py --out /tmp/zgdg-syn --scale 10 --shares 2000
+    ZGDG_DATA_DIR=/tmp/zgdg-syn/Data ZGDG_SHARE_DIR=/tmp/zgdg-syn/uploads/share uvicorn main:app
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+DATA = ROOT / "Data"
+DSL_DICT = ROOT / "ui" / "src" / "assets" / "dsl_dictionary.json"
+
+# kind -> (file name, list key or None for array roots)
+KINDS: Dict[str, Tuple[str, Optional[str]]] = {
+    "card": ("Card.json", "Cards"),
+    "pendant": ("Pendant.json", "Pendant"),
+    "mapevent": ("MapEvent.json", None),
+    "begineffect": ("BeginEffect.json", None),
+    "disaster": ("Disaster.json", "Pendant"),
+}
+
+SIMPLE_TOKEN = re.compile(r"^[A-Za-z][A-Za-z0-9]*$")
+# Only plain identifiers make it into generated strings; exotic dictionary entries are skipped
+SIMPLE_EVENT = re.compile(r"^[A-Za-z]+(\([A-Za-z]+,[A-Za-z]+\))?$")
+
+
+def load(path: Path) -> Any:
+    with path.open("rb") as f:
+        return json.load(f)
+
+
+def _sha256_of_obj(obj: Any) -> str:
+    # Same canonical form as the server's patch meta
+    text = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class FieldModel:
+    """Empirical per-field presence and value distribution of a list of entities."""
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.total = max(1, len(items))
+        self.order: List[str] = []
+        self.present: Dict[str, int] = {}
+        self.values: Dict[str, List[Any]] = {}
+        for it in items:
+            if not isinstance(it, dict):
+                continue
+            for k, v in it.items():
+                if k not in self.present:
+                    self.order.append(k)
+                    self.present[k] = 0
+                    self.values[k] = []
+                self.present[k] += 1
+                self.values[k].append(v)
+
+    def sample(self, rng: random.Random, key: str) -> Any:
+        return rng.choice(self.values[key])
+
+    def fields(self, rng: random.Random) -> List[str]:
+        return [k for k in self.order if rng.random() < self.present[k] / self.total]
+
+
+class EffectGrammar:
+    """Generates well-formed EffectStrings from the DSL vocabulary."""
+
+    def __init__(self, vocab: Dict[str, Dict[str, List[str]]], names: List[str]):
+        def pick(group: str, pattern: re.Pattern) -> List[str]:
+            src = vocab.get(group) or {}
+            out = sorted({t for part in src.values() for t in part if pattern.match(t)})
+            return out
+
+        self.events = pick("events", SIMPLE_EVENT) or ["Play", "Harvest", "RoundEnd"]
+        self.targets = pick("targets", SIMPLE_TOKEN) or ["Self", "Global"]
+        self.properties = pick("properties", SIMPLE_TOKEN) or ["Money", "Growth"]
+        self.comparators = pick("comparators", SIMPLE_TOKEN) or ["Equal"]
+        self.functions = [f for f in ("BagIn", "HandIn", "Transfer") if f in pick("functions", SIMPLE_TOKEN)] or ["BagIn"]
+        self.tags = [t for t in pick("tags", SIMPLE_TOKEN) if t in {"Consume", "BackBag", "CannotMove", "CannotSell", "DoubleHarvest", "Foresee"}]
+        self.names = names or ["粑粑"]
+
+    def _action(self, rng: random.Random) -> str:
+        if rng.random() < 0.3:
+            fn = rng.choice(self.functions)
+            if fn == "Transfer":
+                return f"[Transfer(Self;{rng.choice(self.names)})]"
+            return f"[{fn}({rng.choice(self.names)};{rng.randint(1, 3)})]"
+        value = rng.choice([str(rng.randint(-5, 10)), f"={rng.randint(0, 10)}"])
+        return f"[{rng.choice(self.targets)},{rng.choice(self.properties)},{value}]"
+
+    def _block(self, rng: random.Random) -> str:
+        cond = ""
+        if rng.random() < 0.4:
+            cond = f"{{{rng.choice(self.targets)},{rng.choice(self.properties)},{rng.choice(self.comparators)},{rng.randint(0, 30)}}}"
+        actions = "".join(self._action(rng) for _ in range(rng.randint(1, 3)))
+        return f"<{cond}{actions}>"
+
+    def effect_string(self, rng: random.Random) -> str:
+        clauses = []
+        for _ in range(rng.choices([1, 2, 3], weights=[6, 3, 1])[0]):
+            blocks = "".join(self._block(rng) for _ in range(rng.randint(1, 2)))
+            clauses.append(f"{rng.choice(self.events)} {blocks}")
+        text = " # ".join(clauses)
+        if self.tags and rng.random() < 0.2:
+            text += f"({rng.choice(self.tags)})"
+        return text
+
+    def choice_effect(self, rng: random.Random) -> str:
+        steps = [f"Global,Money,{rng.choice([-100, -50, -10, 10, 50])}"] if rng.random() < 0.5 else []
+        if rng.random() < 0.5:
+            steps.append(f"BagIn({rng.choice(self.names)};1)")
+        steps.append(rng.choice(["Exit", "Turn"]))
+        return " # ".join(steps)
+
+
+def synthesize_items(kind: str, real: List[Dict[str, Any]], grammar: EffectGrammar, count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    model = FieldModel(real)
+    choice_model = FieldModel([ch for ev in real for ch in (ev.get("Choices") or []) if isinstance(ch, dict)])
+    choice_counts = [len(ev.get("Choices") or []) for ev in real] or [1]
+    out: List[Dict[str, Any]] = []
+    for n in range(count):
+        it: Dict[str, Any] = {}
+        for key in model.fields(rng):
+            if key == "ID":
+                it[key] = f"Syn-{kind}-{n + 1}"
+            elif key in ("EffectString", "TemplateEffectString"):
+                it[key] = grammar.effect_string(rng)
+            elif key == "Choices":
+                choices = []
+                for _ in range(rng.choice(choice_counts)):
+                    ch = {k: choice_model.sample(rng, k) for k in choice_model.fields(rng)}
+                    ch["Effect"] = grammar.choice_effect(rng)
+                    choices.append(ch)
+                it[key] = choices
+            elif key == "Name":
+                it[key] = f"{model.sample(rng, key)}{n + 1}"
+            else:
+                it[key] = model.sample(rng, key)
+        it.setdefault("ID", f"Syn-{kind}-{n + 1}")
+        out.append(it)
+    return out
+
+
+def synthesize_dataset(kind: str, scale: float, grammar: EffectGrammar, rng: random.Random) -> Any:
+    fname, list_key = KINDS[kind]
+    real_root = load(DATA / fname)
+    real = real_root[list_key] if list_key else real_root
+    count = max(1, int(len(real) * scale))
+    items = synthesize_items(kind, real, grammar, count, rng)
+    if list_key:
+        return {"Name": real_root.get("Name", kind), list_key: items}
+    return items
+
+
+def synthesize_patch(kind: str, dataset: Any, grammar: EffectGrammar, rng: random.Random) -> Dict[str, Any]:
+    """A patch against `dataset` in the shape produced by /api/patch/diff."""
+    _, list_key = KINDS[kind]
+    items = dataset[list_key] if list_key else dataset
+    picks = rng.sample(items, min(len(items), rng.randint(1, 12)))
+    updates = []
+    for it in picks:
+        fields: Dict[str, Any] = {}
+        if "EffectString" in it:
+            fields["EffectString"] = {"from": it["EffectString"], "to": grammar.effect_string(rng)}
+        if isinstance(it.get("Level"), int):
+            fields["Level"] = {"from": it["Level"], "to": it["Level"] + rng.choice([-1, 1])}
+        if "Name" in it:
+            fields["Name"] = {"from": it["Name"], "to": f"{it['Name']}改"}
+        if fields:
+            updates.append({"id": it["ID"], "fields": fields})
+    adds = []
+    for i in range(rng.choice([0, 0, 1, 2])):
+        data = dict(rng.choice(items))
+        data["ID"] = f"Mod-{kind}-{rng.randrange(1 << 30)}"
+        adds.append({"id": data["ID"], "data": data})
+    deletes = [{"id": rng.choice(items)["ID"]}] if rng.random() < 0.2 else []
+    return {
+        "meta": {"schema": 1, "kind": kind, "baseSha256": _sha256_of_obj(dataset)},
+        "changes": {"adds": adds, "updates": updates, "deletes": deletes},
+    }
+
+
+def write_share_store(store_dir: Path, datasets: Dict[str, Any], grammar: EffectGrammar, count: int, rng: random.Random) -> None:
+    store_dir.mkdir(parents=True, exist_ok=True)
+    kinds = list(datasets)
+    items: List[Dict[str, Any]] = []
+    start = int(time.time()) - count * 600
+    for i in range(count):
+        sid = f"syn{i:07d}"
+        picked = rng.sample(kinds, rng.choices([1, 2, 3], weights=[8, 2, 1])[0])
+        patches = [synthesize_patch(k, datasets[k], grammar, rng) for k in picked]
+        created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start + i * 600))
+        meta = {
+            "title": f"合成分享 {i}",
+            "author": f"user{rng.randrange(max(1, count // 5))}",
+            "description": f"Synthetic share #{i}",
+            "baseDataVersion": "",
+            "createdAt": created,
+            "mode": "patch",
+            "kinds": sorted(picked),
+        }
+        obj: Dict[str, Any] = {"meta": meta}
+        if len(patches) == 1:
+            obj["patch"] = patches[0]
+        else:
+            obj["patches"] = patches
+        fpath = store_dir / f"{sid}.json"
+        fpath.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+        items.append({
+            "id": sid,
+            "title": meta["title"],
+            "author": meta["author"],
+            "description": meta["description"],
+            "baseDataVersion": "",
+            "createdAt": created,
+            "size": fpath.stat().st_size,
+            "downloads": int(rng.paretovariate(1.2)) - 1,
+            "tokenHash": "",
+            "mode": "patch",
+            "kinds": meta["kinds"],
+        })
+    (store_dir / "index.json").write_text(json.dumps({"items": items}, ensure_ascii=False, indent=2), encoding="utf-8")
+    # Synthetic stores are already in patch format
+    (store_dir / "migrated_v1.flag").write_text("ok", encoding="utf-8")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", type=Path, required=True, help="output directory (Data/ and uploads/share/ are created inside)")
+    ap.add_argument("--scale", type=float, default=10.0, help="entity count relative to the real data")
+    ap.add_argument("--shares", type=int, default=1000, help="number of shares in the synthetic store")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    card_names = [c.get("Name") for c in load(DATA / "Card.json").get("Cards", []) if isinstance(c.get("Name"), str)]
+    grammar = EffectGrammar(load(DSL_DICT), card_names)
+
+    data_dir = args.out / "Data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    datasets: Dict[str, Any] = {}
+    for kind, (fname, _) in KINDS.items():
+        datasets[kind] = synthesize_dataset(kind, args.scale, grammar, rng)
+        with (data_dir / fname).open("w", encoding="utf-8") as f:
+            json.dump(datasets[kind], f, ensure_ascii=False, indent=2)
+        print(f"Wrote {data_dir / fname}")
+
+    store_dir = args.out / "uploads" / "share"
+    write_share_store(store_dir, datasets, grammar, args.shares, rng)
+    print(f"Wrote {args.shares} shares to {store_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""Local load driver for the API.
+
+Replays a weighted mix of baseline fetches, share listings, share downloads,
+publishes and patch applies, and reports throughput and tail latency per route.
+Either targets a running server (`--url`) or starts one (`--spawn`) against a
+data directory produced by `tools/gen_synthetic.py`:
+
+    python tools/gen_synthetic.py --out /tmp/zgdg-syn --scale 10 --shares 1000
+    python tools/loadtest.py --spawn gunicorn --workers 2 --data /tmp/zgdg-syn \
+        --mix baseline=40,list=30,download=20,publish=5,apply=5 --concurrency 16 --duration 30
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+ROOT = Path(__file__).resolve().parents[1]
+SERVER = ROOT / "server"
+
+BASELINE_KINDS = ["card", "pendant", "mapevent", "begineffect", "disaster"]
+DEFAULT_MIX = "baseline=40,list=30,download=20,publish=5,apply=5"
+
+
+def percentile(samples: List[float], q: float) -> float:
+    s = sorted(samples)
+    if not s:
+        return 0.0
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def parse_mix(text: str) -> List[Tuple[str, float]]:
+    mix: List[Tuple[str, float]] = []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"unknown operation in mix: {name} (choose from {', '.join(OPERATIONS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.shed: Dict[str, int] = {}
+        self.bytes_in: Dict[str, int] = {}
+
+    def record(self, route: str, ms: float, ok: bool, nbytes: int, shed: bool = False) -> None:
+        with self._lock:
+            self.latencies.setdefault(route, []).append(ms)
+            self.bytes_in[route] = self.bytes_in.get(route, 0) + nbytes
+            if shed:
+                # Load shedding (429/503) is expected under overload; counted apart from errors
+                self.shed[route] = self.shed.get(route, 0) + 1
+            elif not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for route, lat in sorted(self.latencies.items()):
+            out[route] = {
+                "requests": len(lat),
+                "errors": self.errors.get(route, 0),
+                "shed": self.shed.get(route, 0),
+                "rps": round(len(lat) / elapsed, 2) if elapsed > 0 else 0.0,
+                "p50_ms": round(percentile(lat, 0.50), 2),
+                "p90_ms": round(percentile(lat, 0.90), 2),
+                "p99_ms": round(percentile(lat, 0.99), 2),
+                "max_ms": round(max(lat), 2),
+                "mean_kb": round(self.bytes_in.get(route, 0) / len(lat) / 1024.0, 1),
+            }
+        return out
+
+
+class Client:
+    """One keep-alive connection per worker thread."""
+
+    def __init__(self, base_url: str, timeout: float):
+        u = urlsplit(base_url)
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 80
+        self.timeout = timeout
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def request(self, method: str, path: str, body: Any = None) -> Tuple[int, bytes]:
+        payload = None
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=payload, headers=headers)
+                resp = self.conn.getresponse()
+                return resp.status, resp.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        raise RuntimeError("unreachable")
+
+
+class State:
+    """Share IDs and sample patches discovered while the test runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.share_ids: List[str] = []
+        self.patches: Dict[str, Dict[str, Any]] = {}
+
+    def add_ids(self, ids: List[str]) -> None:
+        with self.lock:
+            known = set(self.share_ids)
+            self.share_ids.extend(i for i in ids if i not in known)
+
+
+def op_baseline(c: Client, st: State, rng: random.Random) -> Tuple[str, int, bytes]:
+    kind = rng.choice(BASELINE_KINDS)
+    status, body = c.request("GET", f"/api/baseline/{kind}")
+    return "GET /api/baseline/{kind}", status, body
+
+
+def op_list(c: Client, st: State, rng: random.Random) -> Tuple[str, int, bytes]:
+    params = {"limit": 30}
+    if rng.random() < 0.2:
+        params["q"] = rng.choice(["分享", "1", "mod", "卡"])
+    status, body = c.request("GET", f"/api/share?{urlencode(params)}")
+    if status == 200:
+        try:
+            st.add_ids([it["id"] for it in json.loads(body).get("items", [])])
+        except Exception:
+            pass
+    return "GET /api/share", status, body
+
+
+def op_download(c: Client, st: State, rng: random.Random) -> Tuple[str, int, bytes]:
+    with st.lock:
+        sid = rng.choice(st.share_ids) if st.share_ids else None
+    if sid is None:
+        return op_list(c, st, rng)
+    status, body = c.request("GET", f"/api/share/{sid}")
+    return "GET /api/share/{share_id}", status, body
+
+
+def op_publish(c: Client, st: State, rng: random.Random) -> Tuple[str, int, bytes]:
+    kind = rng.choice(list(st.patches)) if st.patches else "card"
+    patch = st.patches.get(kind) or {"meta": {"schema": 1, "kind": kind}, "changes": {"adds": [], "updates": [], "deletes": []}}
+    body = {
+        "meta": {"title": f"压测分享 {rng.randrange(1 << 20)}", "author": "loadtest", "description": "load test publish"},
+        "patch": patch,
+    }
+    status, resp = c.request("POST", "/api/share", body)
+    if status == 200:
+        try:
+            st.add_ids([json.loads(resp)["id"]])
+        except Exception:
+            pass
+    return "POST /api/share", status, resp
+
+
+def op_apply(c: Client, st: State, rng: random.Random) -> Tuple[str, int, bytes]:
+    kind = rng.choice(list(st.patches)) if st.patches else "card"
+    patch = st.patches.get(kind) or {"changes": {}}
+    status, body = c.request("POST", f"/api/patch/apply?kind={kind}", {"patch": patch})
+    return "POST /api/patch/apply", status, body
+
+
+OPERATIONS = {
+    "baseline": op_baseline,
+    "list": op_list,
+    "download": op_download,
+    "publish": op_publish,
+    "apply": op_apply,
+}
+
+
+def prime(base_url: str, st: State, timeout: float) -> None:
+    """Collect share IDs and one real patch per kind to replay."""
+    c = Client(base_url, timeout)
+    status, body = c.request("GET", "/api/share?limit=200")
+    if status == 200:
+        st.add_ids([it["id"] for it in json.loads(body).get("items", [])])
+    for sid in st.share_ids[:50]:
+        status, body = c.request("GET", f"/api/share/{sid}")
+        if status != 200:
+            continue
+        obj = json.loads(body)
+        for p in ([obj.get("patch")] if obj.get("patch") else []) + list(obj.get("patches") or []):
+            kind = ((p or {}).get("meta") or {}).get("kind")
+            if isinstance(kind, str):
+                st.patches.setdefault(kind, p)
+
+
+def wait_ready(base_url: str, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = Client(base_url, 2.0).request("GET", "/api/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"server at {base_url} did not become ready")
+
+
+def spawn(server: str, workers: int, port: int, data: Optional[Path]) -> subprocess.Popen:
+    env = dict(os.environ)
+    if data is not None:
+        env["ZGDG_DATA_DIR"] = str(data / "Data")
+        # Everything the server writes stays under the data dir, not in the checkout's server/uploads
+        uploads = data / "uploads"
+        env["ZGDG_SHARE_DIR"] = str(uploads / "share")
+        env["ZGDG_BASELINE_ARCHIVE"] = str(uploads / "baselines")
+        env["ZGDG_BASELINE_ARENA"] = str(uploads / "arena")
+        env["ZGDG_JOBS_DIR"] = str(uploads / "jobs")
+        env["ZGDG_PROFILE_DIR"] = str(uploads / "profiles")
+        env["ZGDG_METRICS_DIR"] = str(uploads / "metrics")
+    # All load comes from one address; per-client publish rate limiting would dominate the results
+    env.setdefault("ZGDG_SHARE_RATE_PER_MIN", "0")
+    if server == "gunicorn":
+        cmd = ["gunicorn", "-k", "uvicorn.workers.UvicornWorker", "-w", str(workers), "-b", f"127.0.0.1:{port}", "main:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=SERVER, env=env)
+
+
+def run(base_url: str, mix: List[Tuple[str, float]], concurrency: int, duration: float, timeout: float, seed: int) -> Dict[str, Any]:
+    st = State()
+    prime(base_url, st, timeout)
+    rec = Recorder()
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    stop_at = time.perf_counter() + duration
+
+    def worker(n: int) -> None:
+        rng = random.Random(seed + n)
+        c = Client(base_url, timeout)
+        while time.perf_counter() < stop_at:
+            op = OPERATIONS[rng.choices(names, weights)[0]]
+            t0 = time.perf_counter()
+            shed = False
+            try:
+                route, status, body = op(c, st, rng)
+                ok = 200 <= status < 300
+                shed = status in (429, 503)
+                nbytes = len(body)
+            except Exception:
+                route, ok, nbytes = op.__name__, False, 0
+            rec.record(route, (time.perf_counter() - t0) * 1000.0, ok, nbytes, shed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    routes = rec.summary(elapsed)
+    total = sum(r["requests"] for r in routes.values())
+    return {
+        "meta": {
+            "url": base_url,
+            "mix": dict(mix),
+            "concurrency": concurrency,
+            "duration_s": round(elapsed, 2),
+            "requests": total,
+            "rps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        },
+        "routes": routes,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default=None, help="base URL of a running server (default: spawn one)")
+    ap.add_argument("--spawn", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--data", type=Path, default=None, help="directory produced by gen_synthetic.py")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="weighted operation mix, e.g. " + DEFAULT_MIX)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds")
+    ap.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--output", type=Path, default=None, help="write JSON results here")
+    args = ap.parse_args()
+
+    mix = parse_mix(args.mix)
+    proc = None
+    base_url = args.url
+    if base_url is None:
+        proc = spawn(args.spawn, args.workers, args.port, args.data)
+        base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url, 60.0)
+        result = run(base_url, mix, args.concurrency, args.duration, args.timeout, args.seed)
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    meta = result["meta"]
+    print(f"{meta['requests']} requests in {meta['duration_s']}s ({meta['rps']} req/s), concurrency {meta['concurrency']}")
+    print(f"{'route':<30} {'reqs':>7} {'err':>5} {'shed':>5} {'rps':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'KiB':>8}")
+    for route, r in result["routes"].items():
+        print(f"{route:<30} {r['requests']:>7} {r['errors']:>5} {r['shed']:>5} {r['rps']:>8} {r['p50_ms']:>9} {r['p90_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9} {r['mean_kb']:>8}")
+    if args.output:
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Wrote results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Move share payloads between the flat and the sharded, compressed layouts.
+
+The server reads both layouts, so this can run while it is serving. Moving
+back to `flat` writes plain `<id>.json` files that older server versions can
+read (the JSON is compact rather than indented; contents are unchanged).
+
+    python tools/migrate_share_layout.py                      # flat -> sharded, default compression
+    python tools/migrate_share_layout.py --compression zlib   # recompress existing sharded files too
+    python tools/migrate_share_layout.py --to flat            # roll back
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+SERVER = ROOT / "server"
+
+sys.path.insert(0, str(SERVER))
+
+from services.compression import COMPRESSIONS, DEFAULT  # noqa: E402
+from services.share_store import RESERVED_NAMES, ShareStore  # noqa: E402
+
+
+def disk_usage(store: ShareStore) -> int:
+    total = 0
+    for dirpath, _, files in os.walk(store.root):
+        for name in files:
+            if name in RESERVED_NAMES or name.startswith("."):
+                continue
+            if name.endswith(".json") or ".json." in name:
+                total += (Path(dirpath) / name).stat().st_size
+    return total
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--store", type=Path, default=Path(os.environ.get("ZGDG_SHARE_DIR") or SERVER / "uploads" / "share"))
+    ap.add_argument("--to", choices=["sharded", "flat"], default="sharded")
+    ap.add_argument("--compression", choices=sorted(COMPRESSIONS), default=DEFAULT.name, help="for --to sharded")
+    ap.add_argument("--dry-run", action="store_true", help="only count files that would move")
+    args = ap.parse_args()
+
+    if not args.store.is_dir():
+        raise SystemExit(f"Share store not found: {args.store}")
+    comp = COMPRESSIONS[args.compression]
+    store = ShareStore(args.store, compression=comp)
+    flat = args.to == "flat"
+    ids = sorted({sid for sid, _ in store.iter_payload_files()})
+    before = disk_usage(store)
+
+    moved = 0
+    for sid in ids:
+        if args.dry_run:
+            target = store.legacy_payload_path(sid) if flat else store.payload_path(sid)
+            moved += 0 if target.exists() else 1
+            continue
+        if store.relocate_payload(sid, comp, flat=flat):
+            moved += 1
+
+    if flat and not args.dry_run:
+        # Drop the now-empty shard directories
+        for de in os.scandir(store.root):
+            if de.is_dir(follow_symlinks=False):
+                try:
+                    os.rmdir(de.path)
+                except OSError:
+                    pass
+
+    label = "flat" if flat else f"sharded/{comp.name}"
+    verb = "would move" if args.dry_run else "moved"
+    print(f"{len(ids)} payloads, {verb} {moved} to {label}")
+    if not args.dry_run:
+        after = disk_usage(store)
+        print(f"payload bytes on disk: {before} -> {after}")
+
+
+if __name__ == "__main__":
+    main()
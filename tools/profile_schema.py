@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""Profile the schema of every `Data/*.json` file in one pass per file.
+
+Entities are walked once, on a pool of worker processes (large files are
+split into slices whose summaries are merged), and every value is serialized
+at most once. For each field of the file's entities the profile records:
+
+- presence (how many entities have it) and the set of JSON types seen;
+- distinct values, exact up to `SKETCH_K` and estimated beyond that with a
+  k-minimum-values sketch of bounded size;
+- numeric ranges and string / list length ranges;
+- the most frequent values (space-saving, bounded) and a `default` when the
+  field is on every entity and one value covers at least `DEFAULT_MIN_SHARE`
+  of them. Counts are exact while a field has fewer than `TOP_K` distinct
+  values; beyond that they are upper bounds and may vary with the slicing.
+
+`X_Demo.json` is profiled as the demo variant of `X.json`, and fields that
+differ between the two variants are listed. The result is written as JSON
+(default `server/data_schema.json`), which the server loads for validation
+warnings and default elision.
+
+    python tools/profile_schema.py                  # write server/data_schema.json
+    python tools/profile_schema.py --report         # also print a summary
+    python tools/profile_schema.py --workers 1      # profile in-process
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+DATA = ROOT / "Data"
+SERVER = ROOT / "server"
+DEFAULT_OUTPUT = SERVER / "data_schema.json"
+
+sys.path.insert(0, str(SERVER))
+
+from services import codec  # noqa: E402
+
+SCHEMA_VERSION = 1
+# Values kept by the distinct-count sketch; counts are exact below this
+SKETCH_K = 256
+# Candidates tracked by the frequent-value summary
+TOP_K = 32
+# Values listed per field in the artifact
+TOP_LISTED = 5
+# Values longer than this (canonical JSON bytes) are counted but never written out
+MAX_VALUE_BYTES = 256
+DEFAULT_MIN_SHARE = 0.5
+DEMO_SUFFIX = "_Demo"
+# Below this total size the files are profiled in-process; spawning workers would take longer
+POOL_MIN_BYTES = 4 * 1024 * 1024
+# Files are profiled in slices of about this many bytes
+SHARD_BYTES = 4 * 1024 * 1024
+
+_HASH_SPACE = float(1 << 64)
+
+
+_TYPE_NAMES = {type(None): "null", bool: "bool", int: "int", float: "float", str: "string", list: "list", dict: "object"}
+
+
+def value_key(t: str, v: Any) -> bytes:
+    """Bytes identifying a value: type-tagged text for scalars, canonical JSON otherwise."""
+    if t == "string":
+        return b"s" + v.encode("utf-8")
+    if t in ("list", "object"):
+        return codec.canonical(v)
+    return t[0].encode() + repr(v).encode()
+
+
+class DistinctSketch:
+    """k-minimum-values: the `SKETCH_K` smallest 64-bit hashes seen."""
+
+    __slots__ = ("_heap", "_kept")
+
+    def __init__(self) -> None:
+        # Max-heap (negated) of the kept hashes
+        self._heap: List[int] = []
+        self._kept: Set[int] = set()
+
+    def add(self, raw: bytes) -> None:
+        self._add_hash(int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big"))
+
+    def merge(self, other: "DistinctSketch") -> None:
+        for h in other._kept:
+            self._add_hash(h)
+
+    def _add_hash(self, h: int) -> None:
+        if h in self._kept:
+            return
+        if len(self._heap) < SKETCH_K:
+            heapq.heappush(self._heap, -h)
+            self._kept.add(h)
+        elif h < -self._heap[0]:
+            self._kept.discard(-heapq.heapreplace(self._heap, -h))
+            self._kept.add(h)
+
+    @property
+    def exact(self) -> bool:
+        return len(self._heap) < SKETCH_K
+
+    def estimate(self) -> int:
+        if self.exact:
+            return len(self._heap)
+        return int(round((SKETCH_K - 1) * _HASH_SPACE / (-self._heap[0] + 1)))
+
+
+class TopValues:
+    """Space-saving summary of the most frequent values; exact while fewer than `TOP_K` are distinct."""
+
+    __slots__ = ("counts", "values")
+
+    def __init__(self) -> None:
+        self.counts: Dict[bytes, int] = {}
+        self.values: Dict[bytes, Any] = {}
+
+    def add(self, raw: bytes, v: Any) -> None:
+        counts = self.counts
+        if raw in counts:
+            counts[raw] += 1
+            return
+        if len(counts) < TOP_K:
+            counts[raw] = 1
+            self.values[raw] = v
+            return
+        # Replace the least frequent candidate and inherit its count (an overestimate bound)
+        low = min(counts, key=counts.__getitem__)
+        n = counts.pop(low)
+        del self.values[low]
+        counts[raw] = n + 1
+        self.values[raw] = v
+
+    def merge(self, other: "TopValues") -> None:
+        # Sum the two summaries and keep the TOP_K largest; the standard merge for space-saving
+        for raw, n in other.counts.items():
+            self.counts[raw] = self.counts.get(raw, 0) + n
+            self.values.setdefault(raw, other.values[raw])
+        if len(self.counts) > TOP_K:
+            keep = dict(self.most_common(TOP_K))
+            self.values = {raw: self.values[raw] for raw in keep}
+            self.counts = keep
+
+    def most_common(self, n: int) -> List[Tuple[bytes, int]]:
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+
+class FieldStats:
+    __slots__ = ("present", "types", "distinct", "top", "min", "max", "min_len", "max_len")
+
+    def __init__(self) -> None:
+        self.present = 0
+        self.types: Set[str] = set()
+        self.distinct = DistinctSketch()
+        self.top = TopValues()
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.min_len: Optional[int] = None
+        self.max_len: Optional[int] = None
+
+    def add(self, v: Any) -> None:
+        self.present += 1
+        t = _TYPE_NAMES.get(type(v), "object")
+        self.types.add(t)
+        raw = value_key(t, v)
+        self.distinct.add(raw)
+        self.top.add(raw, v)
+        if t in ("int", "float"):
+            self.min = v if self.min is None or v < self.min else self.min
+            self.max = v if self.max is None or v > self.max else self.max
+        elif t in ("string", "list"):
+            n = len(v)
+            self.min_len = n if self.min_len is None or n < self.min_len else self.min_len
+            self.max_len = n if self.max_len is None or n > self.max_len else self.max_len
+
+    def merge(self, other: "FieldStats") -> None:
+        self.present += other.present
+        self.types |= other.types
+        self.distinct.merge(other.distinct)
+        self.top.merge(other.top)
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None or v < self.min else self.min
+                self.max = v if self.max is None or v > self.max else self.max
+        for n in (other.min_len, other.max_len):
+            if n is not None:
+                self.min_len = n if self.min_len is None or n < self.min_len else self.min_len
+                self.max_len = n if self.max_len is None or n > self.max_len else self.max_len
+
+    def to_json(self, total: int) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "present": self.present,
+            "missing": total - self.present,
+            "types": sorted(self.types),
+            "distinct": min(self.distinct.estimate(), self.present),
+            "distinctExact": self.distinct.exact,
+        }
+        if self.min is not None:
+            out["min"], out["max"] = self.min, self.max
+        if self.min_len is not None:
+            out["minLength"], out["maxLength"] = self.min_len, self.max_len
+        common = self.top.most_common(TOP_LISTED)
+        out["top"] = [
+            {"value": self.top.values[raw], "count": n} for raw, n in common if len(raw) <= MAX_VALUE_BYTES
+        ]
+        if common and self.present == total and total:
+            raw, n = common[0]
+            if n >= DEFAULT_MIN_SHARE * total and len(raw) <= MAX_VALUE_BYTES:
+                out["default"] = self.top.values[raw]
+        return out
+
+
+def entity_list(data: Any) -> Tuple[str, Optional[str], List[Any]]:
+    """(layout, list key, entities): the root array, the first list of objects in the root object, or the root itself."""
+    if isinstance(data, list):
+        return "array", None, data
+    if isinstance(data, dict):
+        for key, v in data.items():
+            if isinstance(v, list) and v and all(isinstance(it, dict) for it in v):
+                return "object_list", key, v
+        return "object", None, [data]
+    return "scalar", None, []
+
+
+def profile_shard(path: str, shard: int, shards: int) -> Tuple[Dict[str, Any], int, Dict[str, FieldStats]]:
+    """(file info, entity count, field stats) for one contiguous slice of a file's entities; runs on pool workers."""
+    raw = Path(path).read_bytes()
+    data = codec.loads(raw[3:] if raw.startswith(b"\xef\xbb\xbf") else raw)
+    layout, list_key, items = entity_list(data)
+    step = -(-len(items) // shards)
+    stats: Dict[str, FieldStats] = {}
+    entities = 0
+    for it in items[shard * step : (shard + 1) * step]:
+        if not isinstance(it, dict):
+            continue
+        entities += 1
+        for key, v in it.items():
+            fs = stats.get(key)
+            if fs is None:
+                fs = stats[key] = FieldStats()
+            fs.add(v)
+    info: Dict[str, Any] = {"file": Path(path).name, "sha256": hashlib.sha256(raw).hexdigest(), "bytes": len(raw), "layout": layout}
+    if list_key is not None:
+        info["listKey"] = list_key
+        info["rootKeys"] = [k for k in data if k != list_key]
+    return info, entities, stats
+
+
+def merge_shards(parts: List[Tuple[Dict[str, Any], int, Dict[str, FieldStats]]]) -> Dict[str, Any]:
+    info, total, stats = parts[0]
+    for _, n, more in parts[1:]:
+        total += n
+        for key, fs in more.items():
+            if key in stats:
+                stats[key].merge(fs)
+            else:
+                stats[key] = fs
+    out = dict(info)
+    out["count"] = total
+    out["fields"] = {key: stats[key].to_json(total) for key in sorted(stats)}
+    return out
+
+
+def split_variant(stem: str) -> Tuple[str, str]:
+    if stem.endswith(DEMO_SUFFIX):
+        return stem[: -len(DEMO_SUFFIX)], "demo"
+    return stem, "release"
+
+
+def variant_diff(release: Dict[str, Any], demo: Dict[str, Any]) -> Dict[str, Any]:
+    rf, df = release["fields"], demo["fields"]
+    types = {
+        key: {"release": rf[key]["types"], "demo": df[key]["types"]}
+        for key in sorted(rf.keys() & df.keys())
+        if rf[key]["types"] != df[key]["types"]
+    }
+    return {"onlyRelease": sorted(rf.keys() - df.keys()), "onlyDemo": sorted(df.keys() - rf.keys()), "types": types}
+
+
+def profile_dir(data_dir: Path, workers: int) -> Dict[str, Any]:
+    sizes = {str(p): p.stat().st_size for p in data_dir.glob("*.json")}
+    pooled = workers > 1 and sum(sizes.values()) >= POOL_MIN_BYTES
+    # With a pool, large files are split into slices (each re-parses the file) so one big file doesn't
+    # leave the other workers idle; in-process every file is walked whole
+    tasks = []
+    for path, size in sizes.items():
+        shards = min(workers, -(-size // SHARD_BYTES)) if pooled else 1
+        tasks.extend((path, i, max(shards, 1)) for i in range(max(shards, 1)))
+    # Largest slices first so they don't finish last
+    tasks.sort(key=lambda t: sizes[t[0]] / t[2], reverse=True)
+    if pooled:
+        # spawn, as in the server's pools
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=get_context("spawn")) as pool:
+            results = list(pool.map(profile_shard, *zip(*tasks)))
+    else:
+        results = [profile_shard(*t) for t in tasks]
+    by_file: Dict[str, List[Any]] = {}
+    for (path, shard, _), res in sorted(zip(tasks, results), key=lambda tr: tr[0][:2]):
+        by_file.setdefault(path, []).append(res)
+    profiles = [merge_shards(parts) for parts in by_file.values()]
+
+    files: Dict[str, Dict[str, Any]] = {}
+    for prof in profiles:
+        name, variant = split_variant(Path(prof["file"]).stem)
+        files.setdefault(name, {"variants": {}})["variants"][variant] = prof
+    for entry in files.values():
+        v = entry["variants"]
+        if "release" in v and "demo" in v:
+            entry["diff"] = variant_diff(v["release"], v["demo"])
+    return {"schema": SCHEMA_VERSION, "files": {name: files[name] for name in sorted(files)}}
+
+
+def _short(v: Any) -> str:
+    s = json.dumps(v, ensure_ascii=False)
+    return s if len(s) <= 40 else s[:37] + "..."
+
+
+def report(schema: Dict[str, Any]) -> None:
+    for name, entry in schema["files"].items():
+        for variant, prof in entry["variants"].items():
+            fields = prof["fields"]
+            defaults = [k for k, f in fields.items() if "default" in f]
+            print(f"=== {prof['file']} ({variant}) ===")
+            print(f"条目: {prof['count']}  字段: {len(fields)}  有默认值: {len(defaults)}")
+            for key, f in fields.items():
+                approx = "" if f["distinctExact"] else "≈"
+                extra = f"; 默认 {_short(f['default'])}" if "default" in f else ""
+                print(f"  · {key}: 出现 {f['present']}, 缺失 {f['missing']}, 类型 {'/'.join(f['types'])}, 不同值 {approx}{f['distinct']}{extra}")
+        diff = entry.get("diff")
+        if diff and (diff["onlyRelease"] or diff["onlyDemo"] or diff["types"]):
+            print(f"--- {name}: 正式版与试玩版差异 ---")
+            if diff["onlyRelease"]:
+                print("  仅正式版: " + ", ".join(diff["onlyRelease"]))
+            if diff["onlyDemo"]:
+                print("  仅试玩版: " + ", ".join(diff["onlyDemo"]))
+            for key, t in diff["types"].items():
+                print(f"  类型不同 {key}: 正式版 {'/'.join(t['release'])}, 试玩版 {'/'.join(t['demo'])}")
+        print()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--data", type=Path, default=DATA, help="directory of *.json data files")
+    ap.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="schema artifact to write")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (0 or 1 = in-process)")
+    ap.add_argument("--report", action="store_true", help="print a per-field summary")
+    args = ap.parse_args(argv)
+
+    if not args.data.is_dir():
+        print(f"数据目录不存在: {args.data}", file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    schema = profile_dir(args.data, args.workers)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = args.output.with_name(args.output.name + ".tmp")
+    tmp.write_text(json.dumps(schema, ensure_ascii=False, indent=1) + "\n", encoding="utf-8")
+    os.replace(tmp, args.output)
+    if args.report:
+        report(schema)
+    n = sum(len(e["variants"]) for e in schema["files"].values())
+    print(f"{n} files profiled in {time.perf_counter() - started:.2f}s -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
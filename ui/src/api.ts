@@ -5,22 +5,160 @@ import axios from 'axios'
 const rawBase = (import.meta as any).env?.VITE_API_BASE as string | undefined
 const API_BASE = rawBase && rawBase.trim() !== '' ? rawBase.replace(/\/+$/, '') : ''
 
-export async function getData(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect') {
-  // Prefer new /data route; fallback to /baseline for compatibility
+// Baselines are cached in localStorage and revalidated on every load; only the delta is downloaded
+// when the cached version is still a recent one on the server
+export async function getData(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect' | 'disaster') {
+  const key = `baseline.${kind}`
+  let cached: CachedBaseline | undefined
   try {
-    const { data } = await axios.get(`${API_BASE}/api/data/${kind}`)
-    return data
+    cached = JSON.parse(localStorage.getItem(key) || 'null') ?? undefined
   } catch {
-    const { data } = await axios.get(`${API_BASE}/api/baseline/${kind}`)
-    return data
+    cached = undefined
   }
+  const fresh = await syncBaseline(kind, cached)
+  if (fresh.sha256 !== cached?.sha256) {
+    try {
+      localStorage.setItem(key, JSON.stringify(fresh))
+    } catch {
+      // Over quota: better no cache than a stale one
+      localStorage.removeItem(key)
+    }
+  }
+  return fresh.data
+}
+
+export type CachedBaseline = { sha256: string; data: any }
+const LIST_KEYS: Record<string, string | null> = { card: 'Cards', pendant: 'Pendant', disaster: 'Pendant', mapevent: null, begineffect: null }
+
+// Same bytes as the server's codec.canonical(): sorted keys, compact, UTF-8 without escaping
+function canonicalJson(v: any): string {
+  if (Array.isArray(v)) return `[${v.map(canonicalJson).join(',')}]`
+  if (v && typeof v === 'object') {
+    return `{${Object.keys(v).sort().map((k) => `${JSON.stringify(k)}:${canonicalJson(v[k])}`).join(',')}}`
+  }
+  return JSON.stringify(v)
+}
+
+async function canonicalSha256(v: any): Promise<string> {
+  const digest = await (globalThis.crypto as any).subtle.digest('SHA-256', new TextEncoder().encode(canonicalJson(v)))
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('')
+}
+
+// The server only sends a delta when adds go at the end, no fields are dropped and the root object is unchanged
+function applyBaselineDelta(kind: string, data: any, patch: any): any {
+  const out = structuredClone(data)
+  const key = LIST_KEYS[kind]
+  const items: any[] = key ? out[key] : out
+  const { adds = [], updates = [], deletes = [] } = patch?.changes || {}
+  const deleted = new Set(deletes.map((d: any) => d.id))
+  const kept = items.filter((it) => !deleted.has(it?.ID))
+  const byId = new Map(kept.map((it) => [it?.ID, it]))
+  for (const u of updates) {
+    const it = byId.get(u.id)
+    if (!it) continue
+    for (const [field, ft] of Object.entries<any>(u.fields || {})) it[field] = ft.to
+  }
+  for (const a of adds) kept.push(a.data)
+  if (key) out[key] = kept
+  return key ? out : kept
+}
+
+// Fetch a baseline, downloading only the delta when `cached` is a recent version
+export async function syncBaseline(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect' | 'disaster', cached?: CachedBaseline): Promise<CachedBaseline> {
+  // A delta can't be verified without WebCrypto, so such clients always take the full file
+  const params = cached && (globalThis.crypto as any)?.subtle ? { since: cached.sha256 } : undefined
+  const resp = await axios.get(`${API_BASE}/api/baseline/${kind}`, { params })
+  const sha256 = resp.headers['x-baseline-sha256'] as string
+  if (cached && resp.headers['x-baseline-delta'] === cached.sha256) {
+    const data = applyBaselineDelta(kind, cached.data, resp.data)
+    // A rebuilt copy is only kept if it hashes to the version it will be stored as; otherwise start over from the full file
+    if ((await canonicalSha256(data)) === sha256) return { sha256, data }
+    return syncBaseline(kind)
+  }
+  return { sha256, data: resp.data }
 }
 
-export async function validate(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect', payload: any): Promise<{ ok: boolean; errors: string[] }> {
+export async function validate(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect' | 'disaster', payload: any): Promise<{ ok: boolean; errors: string[]; warnings: string[] }> {
   const { data } = await axios.post(`${API_BASE}/api/validate`, payload, { params: { kind } })
   return data
 }
 
+export type KindValidation = { kind: string; ok: boolean; errors: string[]; warnings: string[] }
+// Validates all kinds in one request; `onResult` fires per kind as the server finishes it
+async function readNdjson(resp: Response, onLine: (msg: any) => void): Promise<void> {
+  if (!resp.body) throw new Error('response has no body')
+  const reader = resp.body.getReader()
+  const decoder = new TextDecoder()
+  let buf = ''
+  for (;;) {
+    const { done, value } = await reader.read()
+    if (value) buf += decoder.decode(value, { stream: !done })
+    let nl: number
+    while ((nl = buf.indexOf('\n')) >= 0) {
+      const line = buf.slice(0, nl).trim()
+      buf = buf.slice(nl + 1)
+      if (line) onLine(JSON.parse(line))
+    }
+    if (done) break
+  }
+}
+
+export async function validateBatch(payloads: Record<string, any>, onResult?: (r: KindValidation) => void): Promise<{ ok: boolean; results: KindValidation[] }> {
+  const resp = await fetch(`${API_BASE}/api/validate/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(payloads),
+  })
+  if (!resp.ok) throw new Error(`validate/batch failed: ${resp.status}`)
+  const results: KindValidation[] = []
+  let ok = false
+  await readNdjson(resp, (msg) => {
+    if (msg.done) {
+      ok = msg.ok
+    } else {
+      results.push(msg)
+      onResult?.(msg)
+    }
+  })
+  return { ok, results }
+}
+
+export type StreamMeta = { kind: string; sha256: string; count: number; root?: Record<string, any>; listKey?: string; defaults?: Record<string, any> }
+// elide: the server leaves out fields equal to their schema default; rows are handed out with them filled back in
+export type StreamOptions = { q?: string; filter?: Record<string, string | number>; order?: string; elide?: boolean }
+
+// Entities arrive one per line after a metadata line; onRows fires every 200 rows so tables can render early
+export async function streamBaseline(
+  kind: string,
+  onRows: (rows: any[], meta: StreamMeta) => void,
+  opts: StreamOptions = {},
+): Promise<StreamMeta> {
+  const params = new URLSearchParams()
+  if (opts.q) params.set('q', opts.q)
+  if (opts.order) params.set('order', opts.order)
+  if (opts.elide) params.set('elide', 'true')
+  for (const [k, v] of Object.entries(opts.filter || {})) params.append('filter', `${k}=${v}`)
+  const qs = params.toString()
+  const resp = await fetch(`${API_BASE}/api/baseline/${kind}/stream${qs ? `?${qs}` : ''}`)
+  if (!resp.ok) throw new Error(`baseline stream failed: ${resp.status}`)
+  let meta = null as StreamMeta | null
+  let rows: any[] = []
+  await readNdjson(resp, (msg) => {
+    if (meta === null) {
+      meta = msg
+      return
+    }
+    rows.push(meta.defaults ? { ...meta.defaults, ...msg } : msg)
+    if (rows.length >= 200) {
+      onRows(rows, meta)
+      rows = []
+    }
+  })
+  if (meta === null) throw new Error('baseline stream was empty')
+  if (rows.length) onRows(rows, meta)
+  return meta
+}
+
 export async function decodeEncrypted(file: File) {
   const fd = new FormData()
   fd.append('file', file)
@@ -41,32 +179,98 @@ export async function patchDiff(kind: 'card' | 'pendant' | 'mapevent' | 'beginef
   return data
 }
 
-export async function patchApply(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect' | 'disaster', patch: any, target?: any): Promise<{ ok: boolean; result: any; stats: any; conflicts: any[] }> {
+export async function patchApply(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect' | 'disaster', patch: any, target?: any): Promise<{ ok: boolean; result: any; stats: any; conflicts: PatchConflict[] }> {
   const body: any = { patch }
   if (typeof target !== 'undefined') body.target = target
   const { data } = await axios.post(`${API_BASE}/api/patch/apply`, body, { params: { kind } })
   return data
 }
 
+export type ImpactEntity = { kind: string; id: string; name: string | null }
+export type PatchImpact = {
+  changed: (ImpactEntity & { op: 'add' | 'update' | 'delete' })[]
+  impacted: (ImpactEntity & { depth: number; via: { kind: string; id: string } })[]
+  broken: (ImpactEntity & { target: string })[]
+  total: number
+}
+export async function patchImpact(kind: 'card' | 'pendant' | 'mapevent' | 'begineffect' | 'disaster', patch: any, depth?: number): Promise<PatchImpact> {
+  const { data } = await axios.post(`${API_BASE}/api/patch/impact`, { patch }, { params: { kind, depth } })
+  return data
+}
+
 // ---- Share APIs ----
-export type ShareCreateResp = { id: string; url: string; manageToken: string }
+// `manageToken` is absent when identical content was already published (by anyone) and that share is returned
+export type ShareCreateResp = { id: string; url: string; manageToken?: string }
+// A publish whose response was lost (network error, 502-504) is retried under the same Idempotency-Key,
+// so the server returns the share the first attempt created instead of publishing a duplicate
+async function postShare(body: any): Promise<ShareCreateResp> {
+  const key = (globalThis.crypto as any)?.randomUUID?.() ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const { data } = await axios.post(`${API_BASE}/api/share`, body, { headers: { 'Idempotency-Key': key } })
+      return data
+    } catch (e: any) {
+      const status = e?.response?.status
+      const transient = !e?.response || status === 502 || status === 503 || status === 504
+      if (!transient || attempt >= 2) throw e
+      await new Promise((r) => setTimeout(r, 500 * 2 ** attempt))
+    }
+  }
+}
 export async function shareCreate(meta: { title: string; author?: string; description?: string; baseDataVersion?: string }, data: { cards?: any; pendants?: any; mapEvents?: any; beginEffects?: any }): Promise<ShareCreateResp> {
-  const { data: resp } = await axios.post(`${API_BASE}/api/share`, { meta, data })
-  return resp
+  return postShare({ meta, data })
 }
 
 export async function shareCreatePatch(meta: { title: string; author?: string; description?: string; baseDataVersion?: string }, patch: any): Promise<ShareCreateResp> {
-  const { data: resp } = await axios.post(`${API_BASE}/api/share`, { meta, patch })
-  return resp
+  return postShare({ meta, patch })
 }
 
 export async function shareCreatePatches(meta: { title: string; author?: string; description?: string; baseDataVersion?: string }, patches: any[]): Promise<ShareCreateResp> {
-  const { data: resp } = await axios.post(`${API_BASE}/api/share`, { meta, patches })
-  return resp
+  return postShare({ meta, patches })
+}
+
+export async function shareList(q?: string, limit = 30, sort: 'new' | 'old' | 'downloads' | 'trending' = 'new', cursor?: string): Promise<{ items: Array<{ id: string; title: string; author?: string; createdAt: string; size: number; downloads: number; trendingScore?: number; description?: string; baseDataVersion?: string; summary?: Record<string, { adds?: number; updates?: number; deletes?: number; entityCount?: number }> | null }>; nextCursor?: string }> {
+  const { data } = await axios.get(`${API_BASE}/api/share`, { params: { q, limit, sort, cursor } })
+  return data
+}
+
+export type ShareKindSummary = {
+  adds?: number
+  updates?: number
+  deletes?: number
+  entityCount?: number
+  entities?: Array<{ id: string; name: string | null; op: 'add' | 'update' | 'delete' }>
+  entitiesTruncated?: boolean
+  fields?: string[]
+  baseSha256?: string | null
+}
+
+export type PatchConflict = { id: string; type: 'add_exists' | 'update_missing' | 'update_not_object' | 'conflict'; field?: string; current?: any; expected?: any }
+type CompareList<T> = { count: number; items: T[]; truncated?: boolean }
+export type ShareCompare = {
+  a: any
+  b: any
+  overlap: number
+  conflicts: number
+  skipped: { a: number; b: number }
+  kinds: Record<string, {
+    same: CompareList<string>
+    conflicts: CompareList<{ id: string; name: string | null; type: 'fields' | 'deleted_a' | 'deleted_b'; fields?: Record<string, { a: any; b: any }> }>
+    onlyA: CompareList<string>
+    onlyB: CompareList<string>
+    // Changes applying that side skips, as /api/patch/apply reports them in `conflicts`
+    skippedA: CompareList<PatchConflict>
+    skippedB: CompareList<PatchConflict>
+  }>
+}
+// `other` is another share ID, or `${kind}@${baseSha256}` for a baseline version
+export async function shareCompare(id: string, other: string): Promise<ShareCompare> {
+  const { data } = await axios.get(`${API_BASE}/api/share/${encodeURIComponent(id)}/compare`, { params: { other } })
+  return data
 }
 
-export async function shareList(q?: string, limit = 30): Promise<{ items: Array<{ id: string; title: string; author?: string; createdAt: string; size: number; downloads: number; description?: string; baseDataVersion?: string }> }> {
-  const { data } = await axios.get(`${API_BASE}/api/share`, { params: { q, limit } })
+export async function sharePreview(id: string): Promise<{ id: string; title: string; author?: string; createdAt: string; size: number; downloads: number; description?: string; kinds?: string[]; summary: { kinds: Record<string, ShareKindSummary> } | null }> {
+  const { data } = await axios.get(`${API_BASE}/api/share/${id}/preview`)
   return data
 }
 
@@ -79,3 +283,42 @@ export async function shareDelete(id: string, manageToken: string): Promise<{ ok
   const { data } = await axios.delete(`${API_BASE}/api/share/${id}`, { params: { manageToken } })
   return data
 }
+
+// ---- Background jobs ----
+export type Job = {
+  id: string
+  kind: string
+  state: 'queued' | 'running' | 'done' | 'failed' | 'cancelled'
+  progress: { total?: number; done?: number } | null
+  result: any
+  error: string | null
+  attempts: number
+  maxAttempts: number
+  cancelRequested: boolean
+  createdAt: string
+  startedAt: string | null
+  finishedAt: string | null
+  download?: string
+}
+export async function jobGet(id: string): Promise<Job> {
+  const { data } = await axios.get(`${API_BASE}/api/jobs/${id}`)
+  return data
+}
+
+export async function jobCancel(id: string): Promise<Job> {
+  const { data } = await axios.post(`${API_BASE}/api/jobs/${id}/cancel`)
+  return data
+}
+
+// Packs shares into one zip on the server; resolves with the download URL once the job is done
+export async function shareBundleExport(ids: string[], onProgress?: (job: Job) => void, pollMs = 1000): Promise<string> {
+  const { data } = await axios.post(`${API_BASE}/api/jobs`, { kind: 'bundle-export', params: { ids } })
+  let job: Job = data
+  while (job.state === 'queued' || job.state === 'running') {
+    onProgress?.(job)
+    await new Promise((r) => setTimeout(r, pollMs))
+    job = await jobGet(job.id)
+  }
+  if (job.state !== 'done' || !job.download) throw new Error(job.error || `bundle export ${job.state}`)
+  return `${API_BASE}${job.download}`
+}